@@ -0,0 +1,540 @@
+"""Streaming FortiOS configuration (show full-configuration, backups) parser."""
+import ipaddress
+import itertools
+import logging
+import mmap
+import os
+import re
+
+from functools import cached_property
+
+# FortiOS writes top level blocks, VDOM entries and their blocks at column 0
+# and indents everything else, so only those lines are looked at
+RX_STRUCTURE = re.compile(rb'^(config|edit|next|end)(?=\s|$)', re.M)
+# for configurations indented some other way
+RX_INDENTED_STRUCTURE = re.compile(rb'^[ \t]*(config|edit|next|end)(?=\s|$)', re.M)
+
+# a token is a double quoted value or a run of anything else but spaces
+RX_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|([^\s"]+)', re.S)
+RX_UNESCAPE = re.compile(r'\\(.)', re.S)
+
+# quotes are counted in chunks this size, so counting doesn't copy whole blocks
+COUNT_CHUNK_SIZE = 1 << 20
+
+# blocks that hold other top level blocks, they aren't indexed themselves
+CONTAINERS = ("global", "vdom")
+
+
+def config_path(path: str) -> str:
+    """Normalize a config path, ex.: 'firewall  vip' is 'firewall vip'."""
+    return " ".join(path.split())
+
+
+def unquote(value: str) -> str:
+    """Remove the quotes and escapes of a value."""
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return RX_UNESCAPE.sub(r"\1", value[1:-1])
+
+    return value
+
+
+def quotes(text: str) -> int:
+    """Number of unescaped double quotes, odd if text ends inside a quoted value."""
+    return text.count('"') - text.count('\\"')
+
+
+def count_quotes(buffer, start: int, end: int) -> int:
+    """Number of unescaped double quotes of buffer[start:end], a chunk at a time."""
+    count = 0
+    for chunk_start in range(start, end, COUNT_CHUNK_SIZE):
+        chunk_end = min(chunk_start + COUNT_CHUNK_SIZE, end)
+        count += buffer[chunk_start:chunk_end].count(b'"')
+        # one more byte, so escapes split between chunks are counted
+        count -= buffer[chunk_start:min(chunk_end + 1, end)].count(b'\\"')
+
+    return count
+
+
+def statements(text: str):
+    """Yield the statements of a config text as lists of unquoted tokens, skipping comments.
+
+    Quoted values can span lines (ex.: certificates), lines without quotes
+    are just split.
+    """
+    pending = None
+
+    for line in text.split("\n"):
+        if pending is not None:
+            line = f"{pending}\n{line}"
+            pending = None
+
+        if '"' in line:
+            if quotes(line) % 2:
+                pending = line
+                continue
+
+            tokens = [
+                bare or RX_UNESCAPE.sub(r"\1", quoted)
+                for (quoted, bare) in RX_TOKEN.findall(line)
+            ]
+        else:
+            tokens = line.split()
+
+        if tokens and not line.lstrip().startswith("#"):
+            yield tokens
+
+    if pending is not None:
+        logging.debug("statements(): unbalanced quotes in '%s'", pending)
+
+
+class Block:
+    """A config block or one of its edit entries.
+
+    settings maps every set option to its values, blocks has the nested config
+    blocks by path and entries the edit entries in order (names can repeat,
+    ex.: edit 0).
+    """
+
+    __slots__ = ("path", "name", "settings", "blocks", "entries")
+
+    def __init__(self, path: str | None, name: str | None = None):
+        self.path = path
+        self.name = name
+        self.settings = {}
+        self.blocks = {}
+        self.entries = []
+
+    def values(self, key: str) -> list:
+        """Values of an option, empty if it isn't set."""
+        return self.settings.get(key, [])
+
+    def get(self, key: str, default=None):
+        """Values of an option joined by spaces like the CLI shows them, default if it isn't set."""
+        if key not in self.settings:
+            return default
+
+        return " ".join(self.settings[key])
+
+    def entry(self, name: str):
+        """First edit entry with that name, None if there isn't one."""
+        for entry in self.entries:
+            if entry.name == name:
+                return entry
+
+        return None
+
+    def merge(self, other):
+        """Add the settings, blocks and entries of another block of the same path."""
+        self.settings.update(other.settings)
+        self.blocks.update(other.blocks)
+        self.entries.extend(other.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.settings
+
+    def __repr__(self):
+        if self.name is not None:
+            return f"Block({self.path!r}, edit {self.name!r}, {len(self.settings)} setting(s))"
+
+        return f"Block({self.path!r}, {len(self.entries)} entries)"
+
+
+def parse_block(text: str) -> Block:
+    """Parse config text, returns a block holding its top level config blocks."""
+    root = Block(None)
+    stack = [root]
+
+    for tokens in statements(text):
+        keyword = tokens[0]
+        current = stack[-1]
+
+        if keyword == "config":
+            block = Block(config_path(" ".join(tokens[1:])))
+            if block.path in current.blocks:
+                current.blocks[block.path].merge(block)
+                block = current.blocks[block.path]
+            else:
+                current.blocks[block.path] = block
+            stack.append(block)
+        elif keyword == "edit":
+            entry = Block(current.path, tokens[1] if len(tokens) > 1 else "")
+            current.entries.append(entry)
+            stack.append(entry)
+        elif keyword in ("next", "end"):
+            if current.name is not None and len(stack) > 1:
+                stack.pop()
+            if keyword == "end" and len(stack) > 1:
+                stack.pop()
+        elif keyword == "set" and len(tokens) > 1:
+            current.settings[tokens[1]] = tokens[2:]
+        elif keyword == "unset" and len(tokens) > 1:
+            current.settings.pop(tokens[1], None)
+        elif keyword == "append" and len(tokens) > 1:
+            current.settings.setdefault(tokens[1], []).extend(tokens[2:])
+        else:
+            logging.debug("parse_block(): skipping '%s'", " ".join(tokens))
+
+    return root
+
+
+class Config:
+    """FortiOS configuration indexed in a single pass.
+
+    index maps every top level config path (ex.: 'firewall vip') to its
+    (start, end, vdom) byte ranges, vdom is None for global and single VDOM
+    blocks. Blocks are parsed the first time they're read.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.header = {}
+        self.index = {}
+        self.vdoms = []
+        self._blocks = {}
+        self._file = None
+
+        self._read_header()
+        self._index()
+
+    @classmethod
+    def open(cls, file_name: str):
+        """Index a configuration file, memory-mapped until the config is closed."""
+        config_file = open(file_name, "rb")
+
+        if os.fstat(config_file.fileno()).st_size == 0:
+            config_file.close()
+            return cls(b"")
+
+        config = cls(mmap.mmap(config_file.fileno(), 0, access=mmap.ACCESS_READ))
+        config._file = config_file
+
+        return config
+
+    @classmethod
+    def from_text(cls, text: str):
+        """Index a configuration held in a string."""
+        return cls(text.encode("utf-8"))
+
+    def close(self):
+        """Release the memory-mapped file, blocks already read can still be used."""
+        if self._file is not None:
+            self.buffer.close()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_header(self):
+        """Read the #key=value lines at the start (config-version, buildno...)."""
+        position = 0
+        while self.buffer[position:position + 1] == b"#":
+            line_end = self.buffer.find(b"\n", position) + 1 or len(self.buffer)
+            (key, _, value) = self.buffer[position + 1:line_end].decode("utf-8", "replace").strip().partition("=")
+            self.header[key] = value
+            position = line_end
+
+    def _index(self):
+        """Find the byte ranges of every top level, global and VDOM config block.
+
+        Configurations with blocks indented some other way are indexed again
+        looking at every line.
+        """
+        if not self._index_structure(RX_STRUCTURE):
+            self._index_structure(RX_INDENTED_STRUCTURE)
+
+    def _index_structure(self, rx_structure) -> bool:
+        """Index the blocks found with rx_structure, False if it didn't find any or they're unbalanced."""
+        self.index = {}
+        self.vdoms = []
+        size = len(self.buffer)
+        balanced = True
+        stack = []
+        position = 0
+        in_quotes = False
+
+        for m in rx_structure.finditer(self.buffer):
+            # lines inside multi-line quoted values aren't structure
+            in_quotes ^= count_quotes(self.buffer, position, m.start()) % 2 == 1
+            position = m.start()
+            if in_quotes:
+                continue
+
+            keyword = m.group(1)
+
+            line_end = self.buffer.find(b"\n", m.end()) + 1 or size
+            argument = self.buffer[m.end():line_end].decode("utf-8", "replace")
+
+            if keyword == b"config":
+                stack.append((b"config", config_path(argument), m.start()))
+            elif keyword == b"edit":
+                name = unquote(argument)
+                if len(stack) == 1 and stack[0][1] == "vdom" and name not in self.vdoms:
+                    self.vdoms.append(name)
+                stack.append((b"edit", name, m.start()))
+            elif keyword == b"next":
+                if stack and stack[-1][0] == b"edit":
+                    stack.pop()
+                else:
+                    balanced = False
+            else:
+                # end closes the edit entry missing its next too
+                if stack and stack[-1][0] == b"edit":
+                    stack.pop()
+                if not stack:
+                    balanced = False
+                    continue
+
+                (_, path, start) = stack.pop()
+                if len(stack) > 2 or path in CONTAINERS and not stack:
+                    continue
+
+                parents = [(parent_keyword, name) for (parent_keyword, name, _) in stack]
+                if not parents or parents == [(b"config", "global")]:
+                    self.index.setdefault(path, []).append((start, line_end, None))
+                elif len(parents) == 2 and parents[0] == (b"config", "vdom") and parents[1][0] == b"edit":
+                    self.index.setdefault(path, []).append((start, line_end, parents[1][1]))
+
+        if not balanced or stack:
+            logging.debug("Config(): unbalanced config blocks")
+            return False
+
+        return bool(self.index) or bool(self.vdoms)
+
+    def ranges(self, path: str, vdom: str | None = None) -> list:
+        """(start, end) byte ranges of a path.
+
+        Without a VDOM, global and single VDOM blocks are used or, if there
+        aren't any, the blocks of the only VDOM that has the path.
+        """
+        blocks = self.index.get(config_path(path), [])
+        ranges = [(start, end) for (start, end, block_vdom) in blocks if block_vdom == vdom]
+
+        if not ranges and vdom is None and len({block_vdom for (_, _, block_vdom) in blocks}) == 1:
+            ranges = [(start, end) for (start, end, _) in blocks]
+
+        return ranges
+
+    def get(self, path: str, vdom: str | None = None) -> Block | None:
+        """Block of a config path, None if it isn't in the configuration."""
+        path = config_path(path)
+        if (path, vdom) in self._blocks:
+            return self._blocks[(path, vdom)]
+
+        block = None
+        for (start, end) in self.ranges(path, vdom):
+            parsed = parse_block(self.buffer[start:end].decode("utf-8", "replace")).blocks.get(path)
+            if parsed is None:
+                continue
+
+            if block is None:
+                block = parsed
+            else:
+                block.merge(parsed)
+
+        self._blocks[(path, vdom)] = block
+
+        return block
+
+    def __getitem__(self, path: str) -> Block:
+        """Block of a config path, KeyError if it isn't in the configuration."""
+        if (block := self.get(path)) is None:
+            raise KeyError(path)
+
+        return block
+
+    def __contains__(self, path: str) -> bool:
+        return config_path(path) in self.index
+
+    def paths(self) -> list:
+        """Indexed config paths, in the order they first appear."""
+        return list(self.index)
+
+    def is_global(self, path: str) -> bool:
+        """Whether a path has global or single VDOM blocks, ex.: system interface."""
+        return any(vdom is None for (_, _, vdom) in self.index.get(config_path(path), []))
+
+
+def range_key(value: str | None) -> str | None:
+    """Address or port range with single value ranges collapsed, ex.: '80-80' is '80'."""
+    if value is None:
+        return None
+
+    (start, _, end) = value.partition("-")
+
+    return start if end in ("", start) else value
+
+
+def vip_key(extintf: str | None, protocol: str | None, extip: str, extport: str | None, mappedip: str, mappedport: str | None) -> tuple:
+    """What a VIP does, the same for equal VIPs no matter their names.
+
+    Unset values take the FortiOS defaults: any interface, TCP and the
+    external port as the mapped one. Static NAT VIPs have no protocol or ports.
+    """
+    extport = range_key(extport)
+
+    return (
+        extintf or "any",
+        (protocol or "tcp").casefold() if extport is not None else None,
+        range_key(extip),
+        extport,
+        range_key(mappedip),
+        range_key(mappedport) or extport
+    )
+
+
+class Objects:
+    """Firewall objects of a configuration indexed by their contents instead of their names.
+
+    Every index is built the first time it's used, so only the config blocks
+    it needs are parsed. Global blocks (ex.: system interface) are used when
+    the VDOM doesn't have its own.
+    """
+
+    def __init__(self, config: Config, vdom: str | None = None):
+        self.config = config
+        self.vdom = vdom
+
+    def entries(self, path: str) -> list:
+        """Edit entries of a config path, empty if it isn't in the configuration."""
+        block = self.config.get(path, self.vdom)
+        if block is None and self.vdom is not None and self.config.is_global(path):
+            block = self.config.get(path)
+
+        return [] if block is None else block.entries
+
+    def names(self, path: str) -> set:
+        """Names of the edit entries of a config path."""
+        return {entry.name for entry in self.entries(path)}
+
+    @cached_property
+    def vips(self) -> dict:
+        """vip_key() to the name of the first VIP that does it."""
+        vips = {}
+        for entry in self.entries("firewall vip"):
+            if entry.get("type", "static-nat") != "static-nat" or "extip" not in entry:
+                continue
+
+            portforward = entry.get("portforward") == "enable"
+            key = vip_key(
+                entry.get("extintf"),
+                entry.get("protocol") if portforward else None,
+                entry.get("extip"),
+                entry.get("extport") if portforward else None,
+                entry.get("mappedip", ""),
+                entry.get("mappedport") if portforward else None
+            )
+            vips.setdefault(key, entry.name)
+
+        return vips
+
+    @cached_property
+    def services(self) -> dict:
+        """Name to (TCP, UDP) port ranges of the custom services that only match destination ports.
+
+        Services with source ports, other protocols, addresses or FQDNs
+        aren't equivalent to a port range and are left out.
+        """
+        services = {}
+        for entry in self.entries("firewall service custom"):
+            # TCP/UDP/SCTP, TCP/UDP/UDP-Lite/SCTP since FortiOS 7.4
+            if not entry.get("protocol", "TCP/UDP/SCTP").startswith("TCP/UDP/"):
+                continue
+
+            if entry.get("iprange", "0.0.0.0") != "0.0.0.0" or entry.get("fqdn", "") != "":
+                continue
+
+            # full configurations show unset ranges as ""
+            port_ranges = {
+                key: [port_range for port_range in entry.values(f"{key}-portrange") if port_range]
+                for key in ("tcp", "udp", "sctp", "udplite")
+            }
+            if port_ranges["sctp"] or port_ranges["udplite"] or not port_ranges["tcp"] and not port_ranges["udp"]:
+                continue
+
+            if any(":" in port_range for port_range in port_ranges["tcp"] + port_ranges["udp"]):
+                continue
+
+            services[entry.name] = (port_ranges["tcp"], port_ranges["udp"])
+
+        return services
+
+    @cached_property
+    def policies(self) -> set:
+        """(srcintf, dstintf, srcaddr, dstaddr, service) combinations allowed by enabled accept policies."""
+        policies = set()
+        for entry in self.entries("firewall policy"):
+            if entry.get("action") != "accept" or entry.get("status") == "disable":
+                continue
+
+            policies.update(itertools.product(
+                entry.values("srcintf"),
+                entry.values("dstintf"),
+                entry.values("srcaddr"),
+                entry.values("dstaddr"),
+                entry.values("service")
+            ))
+
+        return policies
+
+    @cached_property
+    def policy_names(self) -> set:
+        """Names of the firewall policies, they're set with set name (edit has the policyid)."""
+        return {entry.get("name") for entry in self.entries("firewall policy") if entry.get("name")}
+
+    @cached_property
+    def interface_addresses(self) -> dict:
+        """Interface address (ipaddress.IPv4Interface) to its interface, primary and secondary addresses."""
+        addresses = {}
+        for entry in self.entries("system interface"):
+            ips = [entry.values("ip")]
+            if "secondaryip" in entry.blocks:
+                ips.extend(secondary.values("ip") for secondary in entry.blocks["secondaryip"])
+
+            for ip in ips:
+                if len(ip) != 2:
+                    continue
+
+                try:
+                    address = ipaddress.ip_interface("/".join(ip))
+                except ValueError:
+                    logging.debug("Objects.interface_addresses(): invalid ip '%s' in '%s'", " ".join(ip), entry.name)
+                    continue
+
+                if address.ip.packed != bytes(4):
+                    addresses.setdefault(address, entry.name)
+
+        return addresses
+
+    @cached_property
+    def dhcp_servers(self) -> dict:
+        """Interface to the id of its (first) DHCP server."""
+        servers = {}
+        for entry in self.entries("system dhcp server"):
+            servers.setdefault(entry.get("interface"), entry.name)
+
+        return servers
+
+    @cached_property
+    def dhcp_reservations(self) -> dict:
+        """(ip, mac) to the id of the DHCP server that reserves it, MACs are casefolded."""
+        reservations = {}
+        for entry in self.entries("system dhcp server"):
+            if "reserved-address" not in entry.blocks:
+                continue
+
+            for reservation in entry.blocks["reserved-address"]:
+                key = (reservation.get("ip"), (reservation.get("mac") or "").casefold())
+                reservations.setdefault(key, entry.name)
+
+        return reservations
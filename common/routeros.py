@@ -0,0 +1,306 @@
+"""Streaming RouterOS export (.rsc) parser."""
+import mmap
+import os
+import re
+
+# commands that can follow the menu path on the same line, ex.: /ip address add address=...
+COMMANDS = ("add", "set", "remove", "unset", "enable", "disable")
+
+# a token is a run of adjacent pieces: double quoted strings, escapes and
+# unquoted characters; the alternatives can't overlap, so matching is linear
+RX_PIECE = re.compile(r'"(?:[^"\\]|\\.)*"|\\.|[^\s"\\]+')
+RX_UNQUOTE = re.compile(r'\\([\\"$])|"')
+
+# newlines are counted in chunks this size, so counting doesn't copy whole sections
+COUNT_CHUNK_SIZE = 1 << 20
+
+
+def section_path(header: str) -> str:
+    """Normalize a menu path, '/ip firewall nat' and '/ip/firewall/nat' are both '/ip/firewall/nat'."""
+    return "/" + "/".join(header.replace("/", " ").split())
+
+
+def logical_lines(lines, first_line_number: int = 1):
+    """Yield (line number, line) joining continuation lines, skipping blank lines and comments.
+
+    A line ending with a backslash continues in the next one, whatever its
+    indentation is. The line number is the first physical line's.
+    """
+    pending = None
+    pending_number = None
+
+    for (line_number, line) in enumerate(lines, start=first_line_number):
+        line = line.rstrip("\r\n")
+
+        if pending is not None:
+            line = pending + line.lstrip()
+        else:
+            pending_number = line_number
+
+        if line.endswith("\\"):
+            pending = line[:-1]
+            continue
+
+        pending = None
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#"):
+            yield (pending_number, stripped)
+
+    if pending is not None and pending.strip():
+        yield (pending_number, pending.strip())
+
+
+def split_header(line: str) -> tuple:
+    """Split a menu line into its path and the command that follows it, if there's one."""
+    tokens = line.split(" ")
+
+    for (ix, token) in enumerate(tokens):
+        if ix > 0 and (token in COMMANDS or "=" in token):
+            return (section_path(" ".join(tokens[:ix])), " ".join(tokens[ix:]))
+
+    return (section_path(line), None)
+
+
+def tokenize(line: str) -> list:
+    """Split a command line like RouterOS does, double quotes group and \\ escapes \\, " and $.
+
+    Raises ValueError on unbalanced quotes.
+    """
+    tokens = []
+    position = 0
+    for m in RX_PIECE.finditer(line):
+        gap = line[position:m.start()]
+        if gap == "" and tokens:
+            # no whitespace since the previous piece, same token
+            tokens[-1] += m.group()
+        elif gap == "" or gap.isspace():
+            tokens.append(m.group())
+        else:
+            # a quote or an escape no piece could match
+            raise ValueError(f"unbalanced quotes in '{line}'")
+        position = m.end()
+
+    if line[position:] != "" and not line[position:].isspace():
+        raise ValueError(f"unbalanced quotes in '{line}'")
+
+    return [
+        RX_UNQUOTE.sub(lambda m: m.group(1) or "", token) if '"' in token or "\\" in token else token
+        for token in tokens
+    ]
+
+
+def count_lines(buffer, start: int, end: int) -> int:
+    """Count the newlines of buffer[start:end], a chunk at a time."""
+    count = 0
+    for chunk_start in range(start, end, COUNT_CHUNK_SIZE):
+        count += buffer[chunk_start:min(chunk_start + COUNT_CHUNK_SIZE, end)].count(b"\n")
+
+    return count
+
+
+def section_offsets(buffer):
+    """Yield (path, start, end, line number) for every section block of an export buffer.
+
+    Blocks go from their menu line to the next one. Menu lines are found with
+    find(), nothing is decoded but the menu lines themselves.
+    """
+    size = len(buffer)
+    start = 0 if buffer[:1] == b"/" else buffer.find(b"\n/") + 1
+    if start == 0 and buffer[:1] != b"/":
+        return
+
+    line_number = 1 + count_lines(buffer, 0, start)
+
+    while start < size:
+        end = buffer.find(b"\n/", start) + 1 or size
+        header_end = buffer.find(b"\n", start, end)
+        header = buffer[start:end if header_end == -1 else header_end].decode("utf-8").rstrip("\r\\")
+
+        yield (split_header(header.strip())[0], start, end, line_number)
+
+        line_number += count_lines(buffer, start, end)
+        start = end
+
+
+class Record:
+    """A section command (add, set...) parsed on first access."""
+
+    __slots__ = ("line_number", "line", "_command", "_find", "_params")
+
+    def __init__(self, line_number: int, line: str):
+        self.line_number = line_number
+        self.line = line
+        self._command = None
+        self._find = None
+        self._params = None
+
+    def _parse(self):
+        """Split the command line, [ find ... ] conditions are kept apart from the parameters."""
+        tokens = tokenize(self.line)
+        self._command = tokens[0] if tokens else ""
+        self._params = {}
+
+        in_find = False
+        for token in tokens[1:]:
+            if token.startswith("["):
+                in_find = True
+                self._find = {}
+                token = token[1:]
+
+            closing = in_find and token.endswith("]")
+            if closing:
+                token = token[:-1]
+
+            if token and not (in_find and token in ("find", "where")):
+                (key, _, value) = token.partition("=")
+                target = self._find if in_find else self._params
+                target[key] = value if "=" in token else None
+
+            if closing:
+                in_find = False
+
+    @property
+    def command(self) -> str:
+        """Command name, ex.: add."""
+        if self._params is None:
+            self._parse()
+
+        return self._command
+
+    @property
+    def find(self) -> dict | None:
+        """[ find ... ] conditions, None if the command doesn't have them."""
+        if self._params is None:
+            self._parse()
+
+        return self._find
+
+    @property
+    def params(self) -> dict:
+        """Command parameters, flags without a value are None."""
+        if self._params is None:
+            self._parse()
+
+        return self._params
+
+    def get(self, key: str, default=None):
+        """Parameter value, default if it isn't set."""
+        return self.params.get(key, default)
+
+    def __getitem__(self, key: str):
+        return self.params[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.params
+
+    def __repr__(self):
+        return f"Record({self.line_number}, {self.line!r})"
+
+
+class Section:
+    """Commands of a menu path, records are created and parsed when they're read."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lines = []
+
+    def append(self, line_number: int, line: str):
+        """Add a command line."""
+        self.lines.append((line_number, line))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        for (line_number, line) in self.lines:
+            yield Record(line_number, line)
+
+    def __getitem__(self, ix: int) -> Record:
+        return Record(*self.lines[ix])
+
+    def records(self, *command_names: str):
+        """Yield the records of the given commands (ex.: "add", "set"), all of them if none is given."""
+        for (line_number, line) in self.lines:
+            if not command_names or line.split(" ", 1)[0] in command_names:
+                yield Record(line_number, line)
+
+    def __repr__(self):
+        return f"Section({self.path!r}, {len(self.lines)} command(s))"
+
+
+class Export:
+    """RouterOS export read in a single pass.
+
+    index maps every menu path to the line numbers where its blocks start, only
+    the sections in wanted (all of them if it's None) keep their commands.
+    """
+
+    def __init__(self, lines=(), wanted=None):
+        self.index = {}
+        self.offsets = {}
+        self.sections = {}
+        self.wanted = None if wanted is None else {section_path(path) for path in wanted}
+
+        self._read(lines)
+
+    def _read(self, lines, first_line_number: int = 1):
+        """Add the commands of the wanted sections and index every section."""
+        current_section = None
+        for (line_number, line) in logical_lines(lines, first_line_number):
+            if line.startswith("/"):
+                (path, line) = split_header(line)
+                self.index.setdefault(path, []).append(line_number)
+
+                if self.wanted is None or path in self.wanted:
+                    current_section = self.sections.setdefault(path, Section(path))
+                else:
+                    current_section = None
+
+                if line is None:
+                    continue
+
+            if current_section is not None:
+                current_section.append(line_number, line)
+
+    @classmethod
+    def open(cls, file_name: str, wanted=None):
+        """Read an export file, memory-mapped."""
+        with open(file_name, "rb") as export_file:
+            return cls.map(export_file, wanted)
+
+    @classmethod
+    def map(cls, export_file, wanted=None):
+        """Read an open export file, memory-mapped.
+
+        Section blocks are found by their byte offsets and only the wanted ones
+        are decoded, so memory use depends on the sections read and not on the
+        file size. offsets maps every menu path to its (start, end) byte ranges.
+        """
+        export = cls(wanted=wanted)
+
+        if os.fstat(export_file.fileno()).st_size == 0:
+            return export
+
+        with mmap.mmap(export_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for (path, start, end, line_number) in section_offsets(buffer):
+                export.offsets.setdefault(path, []).append((start, end))
+
+                if export.wanted is None or path in export.wanted:
+                    export._read(buffer[start:end].decode("utf-8").splitlines(), line_number)
+                else:
+                    export.index.setdefault(path, []).append(line_number)
+
+        return export
+
+    def __contains__(self, path: str) -> bool:
+        return section_path(path) in self.index
+
+    def __getitem__(self, path: str) -> Section:
+        """Section of a menu path, KeyError if it isn't in the export or wasn't wanted."""
+        return self.sections[section_path(path)]
+
+    def get(self, path: str) -> Section:
+        """Section of a menu path, empty if it isn't in the export."""
+        path = section_path(path)
+
+        return self.sections.get(path, Section(path))
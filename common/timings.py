@@ -0,0 +1,168 @@
+"""Per-stage timings and profiling hooks for the command line tools."""
+import json
+import sys
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+PROFILERS = ["cprofile", "tracemalloc"]
+PROFILE_EXTENSIONS = {
+    "cprofile": "pstats",
+    "tracemalloc": "tracemalloc"
+}
+
+
+def peak_rss() -> int | None:
+    """Peak resident set size of this process in bytes, None if it can't be measured."""
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes everywhere else
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def add_arguments(parser):
+    """Add --timings and --profile to a command line parser."""
+    parser.add_argument(
+        "--timings",
+        nargs="?",
+        const="",
+        metavar="FILE",
+        help="Print per stage timings and write them to a JSON file (def: a file named after the output)."
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILERS,
+        help="Profile the run with cProfile (pstats file) or tracemalloc (snapshot file)."
+    )
+
+
+def profile_file_name(profiler: str, basename: str) -> str:
+    """Profile output file name for a profiler."""
+    return f"{basename}-profile.{PROFILE_EXTENSIONS[profiler]}"
+
+
+class Profiler:
+    """cProfile or tracemalloc profiler, for scripts that can't wrap their code in profile()."""
+
+    def __init__(self, profiler: str):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Profiler(): unknown profiler '{profiler}'")
+
+        self.profiler = profiler
+        self.profile = None
+
+    def start(self):
+        """Start profiling."""
+        # profilers are only loaded when a run is profiled
+        if self.profiler == "cprofile":
+            import cProfile  # pylint: disable=C0415
+
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            import tracemalloc  # pylint: disable=C0415
+
+            tracemalloc.start()
+
+    def stop(self, file_name: str):
+        """Stop profiling and dump a pstats or tracemalloc snapshot file."""
+        if self.profiler == "cprofile":
+            self.profile.disable()
+            self.profile.dump_stats(file_name)
+        else:
+            import tracemalloc  # pylint: disable=C0415
+
+            tracemalloc.take_snapshot().dump(file_name)
+            tracemalloc.stop()
+
+
+@contextmanager
+def profile(profiler: str | None, file_name: str):
+    """Profile the block with cProfile or tracemalloc and dump the results to file_name."""
+    if profiler is None:
+        yield
+        return
+
+    profiler_object = Profiler(profiler)
+    profiler_object.start()
+
+    try:
+        yield
+    finally:
+        profiler_object.stop(file_name)
+
+
+class Timings:
+    """Wall time, CPU time, rule count and peak RSS of each stage of a run."""
+
+    def __init__(self):
+        self.stages = []
+        self.running = None
+
+    def start(self, name: str, rules: int | None = None) -> dict:
+        """Start measuring a stage, stopping the running one, the returned dict can be updated."""
+        self.stop()
+
+        result = {"stage": name, "rules": rules}
+        self.running = (result, time.perf_counter(), time.process_time())
+
+        return result
+
+    def stop(self):
+        """Stop measuring the running stage, if there's one."""
+        if self.running is None:
+            return
+
+        (result, wall_started, cpu_started) = self.running
+        result["wall_seconds"] = round(time.perf_counter() - wall_started, 6)
+        result["cpu_seconds"] = round(time.process_time() - cpu_started, 6)
+        result["peak_rss_bytes"] = peak_rss()
+        self.stages.append(result)
+        self.running = None
+
+    @contextmanager
+    def stage(self, name: str, rules: int | None = None):
+        """Measure a block, the yielded dict can be updated (ex.: with the rule count)."""
+        result = self.start(name, rules)
+
+        try:
+            yield result
+        finally:
+            self.stop()
+
+    def summary(self) -> list:
+        """Timings formatted as text lines, one per stage plus the total."""
+        lines = [f"{'stage':<16} {'rules':>9} {'wall s':>9} {'cpu s':>9} {'peak rss MB':>12}"]
+
+        for result in self.stages + [self.total()]:
+            rules = "" if result["rules"] is None else result["rules"]
+            rss = "" if result["peak_rss_bytes"] is None else f"{result['peak_rss_bytes'] / 1048576:.1f}"
+            lines.append(
+                f"{result['stage']:<16} {rules:>9} {result['wall_seconds']:>9.3f} {result['cpu_seconds']:>9.3f} {rss:>12}"
+            )
+
+        return lines
+
+    def total(self) -> dict:
+        """Totals of all the stages."""
+        return {
+            "stage": "total",
+            "rules": None,
+            "wall_seconds": round(sum(result["wall_seconds"] for result in self.stages), 6),
+            "cpu_seconds": round(sum(result["cpu_seconds"] for result in self.stages), 6),
+            "peak_rss_bytes": peak_rss()
+        }
+
+    def write(self, file_name: str):
+        """Write the timings to a JSON file."""
+        with open(file_name, "w", encoding="utf-8") as output:
+            json.dump({"stages": self.stages, "total": self.total()}, output, indent=2)
@@ -1,10 +1,16 @@
 import argparse
 import os
 import sys
-import shlex
 from collections import defaultdict
 from jinja2 import Template
 
+# shared modules live in the repository's common package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from common import routeros
+
+LEASES_SECTION = "/ip dhcp-server lease"
+
 class DHCPServerLease:
 
     def __init__ (self, mac, ip, comment=None):
@@ -50,44 +56,31 @@ if not os.path.isfile(args.config):
     sys.exit(-1)
 
 try:
-    with open(args.config, encoding="utf-8") as f:
-        rsc_content = f.read().replace("\\\n    ", "")
-        config_lines = rsc_content.splitlines()
+    export = routeros.Export.open(args.config, wanted=[LEASES_SECTION])
 except Exception as err:
     print(f"Unable to read file '{args.config}', error: {err}")
     sys.exit(-1)
 
-try:
-    leases_config_line = config_lines.index("/ip dhcp-server lease")
-except ValueError:
-    abort(f"Configuration file '{args.config}' doesn't appear to have DHCP leases, exiting.")
+if LEASES_SECTION not in export:
+    print(f"Configuration file '{args.config}' doesn't appear to have DHCP leases, exiting.")
     sys.exit(-1)
 
 dhcp_servers = {}
 
-for line in config_lines[leases_config_line+1:]:
-    if line[0] == "/":
-        break
-
-    tokens = shlex.split(line)
-    if tokens[0] == "add":
-        lease = defaultdict(lambda: None)
-
-        for token in tokens[1:]:
-            (k, v) = token.split("=", maxsplit=1)
-            lease[k] = v
+for record in export[LEASES_SECTION].records("add"):
+    lease = defaultdict(lambda: None, record.params)
 
-        if lease["disabled"] == "yes":
-            continue
+    if lease["disabled"] == "yes":
+        continue
 
-        if lease["server"] not in dhcp_servers:
-            dhcp_servers[lease["server"]] = DHCPServer(lease["server"])
+    if lease["server"] not in dhcp_servers:
+        dhcp_servers[lease["server"]] = DHCPServer(lease["server"])
 
-        dhcp_servers[lease["server"]].add_lease(
-            mac=lease["mac-address"],
-            ip=lease["address"],
-            comment=lease["comment"]
-        )
+    dhcp_servers[lease["server"]].add_lease(
+        mac=lease["mac-address"],
+        ip=lease["address"],
+        comment=lease["comment"]
+    )
 
 with open("dhcp.conf.jinja2", encoding="utf-8") as template_file:
     template = Template(template_file.read())
@@ -0,0 +1 @@
+"""dstnat2tf benchmarks."""
@@ -0,0 +1,171 @@
+"""Seeded generators of synthetic iptables-save dumps, dstnat CSVs and RouterOS exports."""
+import argparse
+import random
+
+# external ports, every external IP gets up to one rule per port
+COMMON_PORTS = (21, 22, 25, 53, 80, 110, 143, 443, 465, 587, 993, 995, 1194, 3389, 5060, 8080)
+
+# networks used by the generated rules, for --map-network
+EXTERNAL_NETWORK = "200.0.0.0/8"
+INTERNAL_NETWORK = "10.0.0.0/8"
+EXTERNAL_INTERFACE = "ether1"
+INTERNAL_INTERFACE = "bridge-lan"
+
+FORMATS = ("iptables", "csv", "rsc")
+SIZES = (1000, 10000, 100000, 1000000)
+DEFAULT_SEED = 42
+
+
+def synthetic_rules(rules: int, seed: int = DEFAULT_SEED):
+    """Yield (protocol, extip, extport, mappedip, mappedport, comment) tuples.
+
+    External IP and port pairs are unique, so the rules don't conflict. About
+    one rule in ten maps a port range and one in three has a comment.
+    """
+    rng = random.Random(seed)
+
+    for ix in range(rules):
+        host = ix // len(COMMON_PORTS) + 1
+        external_port = COMMON_PORTS[ix % len(COMMON_PORTS)]
+        protocol = "udp" if external_port in (53, 1194, 5060) else "tcp"
+
+        if rng.random() < 0.1:
+            # each port slot gets its own 3000 port band, so ranges don't overlap
+            external_port = 10000 + (ix % len(COMMON_PORTS)) * 3000 + rng.randrange(0, 2900, 100)
+            ports = (f"{external_port}-{external_port + rng.randrange(1, 100)}", None)
+        elif rng.random() < 0.5:
+            ports = (str(external_port), None)
+        else:
+            ports = (str(external_port), str(rng.choice(COMMON_PORTS + (8000, 8443, 9000))))
+
+        yield (
+            protocol,
+            f"200.{(host >> 16) & 0xFF}.{(host >> 8) & 0xFF}.{host & 0xFF}",
+            ports[0],
+            f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+            ports[1],
+            f"rule {ix}" if rng.random() < 0.33 else None
+        )
+
+
+def iptables_lines(rules: int, seed: int = DEFAULT_SEED):
+    """Yield an iptables-save dump with filter, nat and mangle tables."""
+    yield "# Generated by iptables-save v1.8.7\n"
+    yield "*filter\n:INPUT ACCEPT [0:0]\n:FORWARD DROP [0:0]\n:OUTPUT ACCEPT [0:0]\n"
+    yield "-A FORWARD -m state --state RELATED,ESTABLISHED -j ACCEPT\n"
+    yield "COMMIT\n"
+    yield "*nat\n:PREROUTING ACCEPT [0:0]\n:INPUT ACCEPT [0:0]\n:OUTPUT ACCEPT [0:0]\n:POSTROUTING ACCEPT [0:0]\n"
+
+    for (protocol, external_ip, external_port, internal_ip, internal_port, comment) in synthetic_rules(rules, seed):
+        destination = internal_ip
+        if internal_port is not None:
+            destination += f":{internal_port}"
+        elif "-" in external_port:
+            destination += f":{external_port}"
+
+        comment_match = f' -m comment --comment "{comment}"' if comment else ""
+
+        yield (
+            f"-A PREROUTING -d {external_ip}/32 -i {EXTERNAL_INTERFACE} -p {protocol} -m {protocol} "
+            f"--dport {external_port.replace('-', ':')}{comment_match} -m state --state NEW "
+            f"-j DNAT --to-destination {destination}\n"
+        )
+
+    yield f"-A POSTROUTING -o {EXTERNAL_INTERFACE} -j MASQUERADE\n"
+    yield "COMMIT\n"
+    yield "*mangle\n:PREROUTING ACCEPT [0:0]\n:POSTROUTING ACCEPT [0:0]\n"
+    yield "-A PREROUTING -p tcp -m tcp --dport 80 -j MARK --set-xmark 0x1/0xffffffff\n"
+    yield "COMMIT\n"
+
+
+def csv_lines(rules: int, seed: int = DEFAULT_SEED):
+    """Yield a dstnat CSV, one rule per line."""
+    yield "protocol,extip,extport,mappedip,mappedport,comment\n"
+
+    for (protocol, external_ip, external_port, internal_ip, internal_port, comment) in synthetic_rules(rules, seed):
+        yield f"{protocol},{external_ip},{external_port},{internal_ip},{internal_port or ''},{comment or ''}\n"
+
+
+def rsc_lines(rules: int, seed: int = DEFAULT_SEED):
+    """Yield a RouterOS export with addresses, pools, ppp secrets and dst-nat rules.
+
+    Long commands are wrapped with a trailing backslash like /export does.
+    """
+    rng = random.Random(seed)
+
+    yield "# oct/18/2026 10:00:00 by RouterOS 6.49.10\n# software id = BENCH-0001\n#\n"
+
+    yield "/interface bridge\n"
+    yield f"add name={INTERNAL_INTERFACE}\n"
+
+    yield "/ip pool\n"
+    yield "add name=dhcp-lan ranges=10.0.0.100-10.0.0.200\n"
+
+    yield "/ip address\n"
+    yield f"add address=200.0.0.1/8 interface={EXTERNAL_INTERFACE} network=200.0.0.0\n"
+    yield f"add address=10.0.0.1/8 interface={INTERNAL_INTERFACE} network=10.0.0.0\n"
+
+    yield "/ip firewall nat\n"
+    yield f"add action=masquerade chain=srcnat out-interface={EXTERNAL_INTERFACE}\n"
+
+    for (protocol, external_ip, external_port, internal_ip, internal_port, comment) in synthetic_rules(rules, seed):
+        line = "add action=dst-nat chain=dstnat"
+        if comment:
+            line += f' comment="{comment}"'
+        line += f" dst-address={external_ip} dst-port={external_port} in-interface={EXTERNAL_INTERFACE}"
+        line += f" protocol={protocol} to-addresses={internal_ip}"
+        if internal_port is not None:
+            line += f" to-ports={internal_port}"
+
+        yield wrap_rsc(line)
+
+    yield "/ppp secret\n"
+    for ix in range(max(rules // 100, 1)):
+        yield f"add name=user{ix:06} password={rng.getrandbits(48):012x} service=pptp\n"
+
+
+def wrap_rsc(line: str, width: int = 80) -> str:
+    """Wrap a RouterOS command at spaces, continuation lines start with 4 spaces."""
+    wrapped = []
+    while len(line) > width:
+        cut = line.rfind(" ", 0, width)
+        if cut <= 0:
+            break
+        wrapped.append(line[:cut + 1] + "\\")
+        line = "    " + line[cut + 1:]
+
+    wrapped.append(line)
+
+    return "\n".join(wrapped) + "\n"
+
+
+GENERATORS = {
+    "iptables": iptables_lines,
+    "csv": csv_lines,
+    "rsc": rsc_lines
+}
+
+
+def write(input_format: str, rules: int, file_name: str, seed: int = DEFAULT_SEED):
+    """Write a generated file."""
+    with open(file_name, "w", encoding="utf-8", newline="") as output:
+        output.writelines(GENERATORS[input_format](rules, seed))
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(
+        prog="generators",
+        description="Generate synthetic NAT rule sets."
+    )
+    parser.add_argument("--format", choices=FORMATS, required=True, help="Output format")
+    parser.add_argument("--rules", type=int, default=SIZES[0], help=f"Number of rules (def: {SIZES[0]})")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help=f"Random seed (def: {DEFAULT_SEED})")
+    parser.add_argument("--output", required=True, help="Output file")
+    args = parser.parse_args()
+
+    write(args.format, args.rules, args.output, args.seed)
+
+
+if __name__ == "__main__":
+    main()
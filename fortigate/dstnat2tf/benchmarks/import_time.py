@@ -0,0 +1,75 @@
+"""Measure dstnat2tf startup with python -X importtime."""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DSTNAT2TF_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(command: list) -> dict:
+    """Run a command with -X importtime and return the cumulative microseconds of each top level import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command,
+        cwd=DSTNAT2TF_PATH,
+        capture_output=True,
+        text=True,
+        check=False
+    )
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        (_, cumulative, module) = line[len("import time:"):].split("|")
+        # top level imports aren't indented
+        if not module.startswith("  "):
+            modules[module.strip()] = int(cumulative)
+
+    return modules
+
+
+def measure(command: list, runs: int, top: int) -> dict:
+    """Run the command several times and return the median import times."""
+    samples = [import_times(command) for _ in range(runs)]
+    modules = {
+        module: statistics.median(sample.get(module, 0) for sample in samples)
+        for module in samples[-1]
+    }
+
+    return {
+        "command": " ".join(command),
+        "runs": runs,
+        "total_us": statistics.median(sum(sample.values()) for sample in samples),
+        "slowest": dict(sorted(modules.items(), key=lambda item: -item[1])[:top])
+    }
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(
+        prog="import_time",
+        description="Measure dstnat2tf import time."
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command, the median is reported (def: 5)")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top level imports to report (def: 10)")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    results = [
+        measure(["dstnat2tf.py", "--help"], args.runs, args.top),
+        measure(["-c", "import dstnat2tf"], args.runs, args.top)
+    ]
+
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
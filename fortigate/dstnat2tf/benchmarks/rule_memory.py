@@ -0,0 +1,64 @@
+"""Measure the memory used by parsed NAT rules with tracemalloc."""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nat import NetworkMap, parse_csv  # pylint: disable=C0413
+
+
+def csv_lines(rules: int):
+    """Generate dstnat CSV lines, one rule per line."""
+    yield "protocol,extip,extport,mappedip,mappedport,comment\n"
+    for ix in range(rules):
+        yield "{protocol},200.{b}.{c}.{d},{extport},10.{b}.{c}.{d},{mappedport},{comment}\n".format(
+            protocol="tcp" if ix % 4 else "udp",
+            b=(ix >> 16) & 0xFF,
+            c=(ix >> 8) & 0xFF,
+            d=ix & 0xFF,
+            extport=1024 + ix % 60000,
+            mappedport=f"{ix % 1000 + 1}-{ix % 1000 + 10}" if ix % 10 == 0 else "",
+            comment=f"rule {ix}" if ix % 3 == 0 else ""
+        )
+
+
+def measure(rules: int) -> dict:
+    """Parse the generated rules and return the traced memory per rule."""
+    network_map = NetworkMap()
+    network_map.add("200.0.0.0/8", "wan1")
+    network_map.add("10.0.0.0/8", "lan")
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    nat_rules = list(parse_csv(csv_lines(rules), network_map))
+    elapsed = time.perf_counter() - started
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "rules": len(nat_rules),
+        "seconds": round(elapsed, 3),
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "bytes_per_rule": round(current / max(len(nat_rules), 1), 1)
+    }
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(
+        prog="rule_memory",
+        description="Measure per-rule memory of parsed NAT rules."
+    )
+    parser.add_argument("--rules", type=int, default=1000000, help="Number of rules (def: 1000000)")
+    args = parser.parse_args()
+
+    print(json.dumps(measure(args.rules), indent=2))
+
+
+if __name__ == "__main__":
+    main()
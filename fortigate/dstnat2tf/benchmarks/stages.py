@@ -0,0 +1,203 @@
+"""Time and memory-profile every dstnat2tf stage on generated rule sets."""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DSTNAT2TF_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MKT2FGT_FILE = os.path.join(DSTNAT2TF_PATH, "..", "..", "mikrotik", "mkt2fgt.py")
+
+sys.path.insert(0, DSTNAT2TF_PATH)
+
+# pylint: disable=C0413
+import dstnat2tf
+from benchmarks import generators
+from coalesce import coalesce_rules
+from nat import NetworkMap, format_csv, format_iptables, format_mikrotik
+from report import REPORT_FORMATS, write_report
+from ruletable import RuleTable
+
+# runs mkt2fgt.py as __main__ and reports its traced peak on the last stderr line
+MKT2FGT_BOOTSTRAP = """
+import json, runpy, sys, tracemalloc
+tracemalloc.start()
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+print(json.dumps({"peak_bytes": tracemalloc.get_traced_memory()[1]}), file=sys.stderr)
+"""
+
+
+class Stage:
+    """Context manager that measures wall time and, optionally, the traced memory peak."""
+
+    def __init__(self, results: list, name: str, rules: int, memory: bool):
+        """Stage results are appended to results."""
+        self.results = results
+        self.result = {"stage": name, "rules": rules}
+        self.memory = memory
+        self.started = None
+
+    def __enter__(self):
+        if self.memory:
+            tracemalloc.start()
+        self.started = time.perf_counter()
+
+        return self.result
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        self.result["seconds"] = round(seconds, 4)
+        self.result["rules_per_second"] = round(self.result["rules"] / seconds) if seconds else None
+
+        if self.memory:
+            self.result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        self.results.append(self.result)
+
+
+def network_map() -> NetworkMap:
+    """Network map for the generated rules."""
+    generated_map = NetworkMap()
+    generated_map.add(generators.EXTERNAL_NETWORK, generators.EXTERNAL_INTERFACE)
+    generated_map.add(generators.INTERNAL_NETWORK, generators.INTERNAL_INTERFACE)
+
+    return generated_map
+
+
+def run_dstnat2tf(work_dir: str, rules: int, seed: int, report_format: str, memory: bool) -> list:
+    """Run the dstnat2tf stages on generated iptables and CSV files."""
+    results = []
+    files = {}
+
+    for input_format in generators.FORMATS:
+        files[input_format] = os.path.join(work_dir, f"rules-{rules}.{input_format}")
+        with Stage(results, f"generate {input_format}", rules, False) as result:
+            generators.write(input_format, rules, files[input_format], seed)
+        result["bytes"] = os.path.getsize(files[input_format])
+
+    parsed = {}
+    for (input_format, formatter) in (("iptables", format_iptables), ("csv", format_csv), ("rsc", format_mikrotik)):
+        parsed[input_format] = []
+        with Stage(results, formatter.__name__, rules, memory):
+            with open(files[input_format], encoding="utf-8", newline="") as input_file:
+                formatter(parsed[input_format], input_file, network_map())
+
+    nat_rules = parsed["iptables"]
+    args = dstnat2tf.build_parser().parse_args([
+        "--input", files["iptables"],
+        "--input-format", "iptables",
+        "--output-basename", os.path.join(work_dir, f"rules-{rules}")
+    ])
+
+    lookup_map = network_map()
+    with Stage(results, "NetworkMap.lookup", 2 * len(nat_rules), memory):
+        for nat_rule in nat_rules:
+            lookup_map.lookup(nat_rule.external_address)
+            lookup_map.lookup(nat_rule.internal_address)
+
+    with Stage(results, "coalesce_rules", len(nat_rules), memory):
+        coalesce_rules(nat_rules)
+
+    services = dstnat2tf.load_services(dstnat2tf.DEFAULT_SERVICES_FILE)
+    with Stage(results, "Services.lookup", len(nat_rules), memory):
+        for nat_rule in nat_rules:
+            services.lookup(nat_rule.protocol.name, nat_rule.external_ports)
+
+    with Stage(results, "prepare_rules", len(nat_rules), memory):
+        (rule_services, _) = dstnat2tf.prepare_rules(nat_rules, services, args)
+
+    with Stage(results, "diagnose", len(nat_rules), memory):
+        rule_table = RuleTable(nat_rules)
+        rule_issues = dict(rule_table.rule_issues())
+
+    with Stage(results, f"report {report_format}", len(nat_rules), memory):
+        write_report(report_format, args.output_basename, nat_rules, rule_services, rule_issues, services)
+
+    j2_env = dstnat2tf.template_environment()
+    with Stage(results, "render", len(nat_rules), memory):
+        with open(args.output_basename + "-services.tf", "w", encoding="utf-8") as services_tf:
+            services_tf.write(j2_env.get_template("service.j2").render(services=services))
+        with open(args.output_basename + ".tf", "w", encoding="utf-8") as output_tf:
+            j2_env.get_template("dstnat.j2").stream(
+                rules=dstnat2tf.dstnat_contexts(nat_rules, rule_table, rule_services, services, args)
+            ).dump(output_tf)
+
+    return results
+
+
+def run_mkt2fgt(work_dir: str, rules: int, memory: bool) -> list:
+    """Run mkt2fgt.py on the generated RouterOS export, it's a script so it runs in a subprocess."""
+    results = []
+    rsc_file = os.path.join(work_dir, f"rules-{rules}.rsc")
+
+    command = [
+        MKT2FGT_FILE,
+        "--mikrotik-config", rsc_file,
+        "--fortigate-config", os.path.join(work_dir, f"rules-{rules}.conf"),
+        "--map-interfaces", f"{generators.EXTERNAL_INTERFACE}:port1",
+        "--addresses", "*",
+        "--ppp-users"
+    ]
+    if memory:
+        command = ["-c", MKT2FGT_BOOTSTRAP] + command
+
+    with Stage(results, "mkt2fgt.py", rules, False) as result:
+        process = subprocess.run([sys.executable] + command, capture_output=True, text=True, check=False)
+
+    result["returncode"] = process.returncode
+    if memory and process.returncode == 0:
+        result.update(json.loads(process.stderr.splitlines()[-1]))
+
+    return results
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(
+        prog="stages",
+        description="Time and memory-profile the dstnat2tf stages on generated rule sets."
+    )
+    parser.add_argument("--rules", type=int, nargs="+", default=list(generators.SIZES[:3]),
+                        help=f"Rule set sizes (def: {' '.join(str(size) for size in generators.SIZES[:3])})")
+    parser.add_argument("--seed", type=int, default=generators.DEFAULT_SEED, help=f"Random seed (def: {generators.DEFAULT_SEED})")
+    parser.add_argument("--report-format", choices=REPORT_FORMATS, default="csv", help="Report format (def: csv)")
+    parser.add_argument("--memory", action="store_true", default=False, help="Trace the memory peak of every stage, slower")
+    parser.add_argument("--work-dir", help="Keep the generated and output files here")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "memory": args.memory,
+        "runs": []
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+
+        for rules in args.rules:
+            stages = run_dstnat2tf(work_dir, rules, args.seed, args.report_format, args.memory)
+            stages.extend(run_mkt2fgt(work_dir, rules, args.memory))
+            results["runs"].append({"rules": rules, "stages": stages})
+
+            for stage in stages:
+                print(f"{rules:>9} {stage['stage']:<20} {stage['seconds']:>10.3f}s", file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
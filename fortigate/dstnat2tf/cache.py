@@ -0,0 +1,241 @@
+"""Rendered rule blocks cache and output files that are rewritten only when they change."""
+import filecmp
+import hashlib
+import itertools
+import logging
+import os
+
+# bump it when the cached blocks change for reasons the fingerprint can't see
+CACHE_VERSION = 2
+CACHE_FILE = "dstnat2tf-cache.sqlite3"
+DEFAULT_CACHE_SIZE = 256
+
+# blocks are looked up and marked as used this many per query
+QUERY_KEYS = 500
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS blocks (
+    key BLOB PRIMARY KEY,
+    block TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used INTEGER NOT NULL
+);
+-- every used block was updated in it too, eviction sorts when it has to
+DROP INDEX IF EXISTS blocks_used;
+"""
+
+
+def fingerprint(file_names: list) -> str:
+    """Hash of the cache version and the name and contents of every file, missing files included."""
+    digest = hashlib.sha256(f"dstnat2tf cache {CACHE_VERSION}".encode())
+
+    for file_name in file_names:
+        digest.update(os.path.basename(file_name).encode() + b"\0")
+        try:
+            with open(file_name, "rb") as hashed_file:
+                digest.update(hashlib.sha256(hashed_file.read()).digest())
+        except FileNotFoundError:
+            digest.update(b"\0missing")
+
+    return digest.hexdigest()
+
+
+def block_key(context) -> bytes:
+    """Cache key of a (vip, policy) template context, values are hashed as they're rendered (str).
+
+    Contexts are built by the same code, so their keys are always in the same
+    order and only the values are hashed (much faster than serializing them).
+    """
+    return hashlib.blake2b(
+        "\x1f".join([str(value) for part in context for value in part.values()]).encode(),
+        digest_size=16
+    ).digest()
+
+
+def cacheable(template) -> bool:
+    """Whether the rules of a template can be rendered one at a time.
+
+    The template can't have any output outside the rules loop and neither it
+    nor its includes can use loop variables (ex.: loop.index).
+    """
+    environment = template.environment
+    for name in environment.list_templates(extensions=["j2"]):
+        (source, _, _) = environment.loader.get_source(environment, name)
+        if "loop." in source:
+            return False
+
+    return template.render(rules=[]) == ""
+
+
+class RenderCache:
+    """LRU cache of rendered rule blocks, stored in a SQLite database.
+
+    Blocks are keyed by their template context. The whole cache is emptied
+    when the fingerprint (templates, default services) changes and the least
+    recently used blocks are evicted when it grows past max_bytes.
+    """
+
+    def __init__(self, directory: str, cache_fingerprint: str, max_bytes: int):
+        os.makedirs(directory, exist_ok=True)
+        self.file_name = os.path.join(directory, CACHE_FILE)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.invalidated = False
+        # rowids of the cached blocks that were used
+        self._used = []
+        self._added = {}
+
+        # OutputFile is used on every run, sqlite3 is only loaded for --cache
+        import sqlite3  # pylint: disable=C0415
+
+        # batch workers can share a cache, writers wait for each other
+        self.db = sqlite3.connect(self.file_name, timeout=60)
+        self.db.executescript(CACHE_SCHEMA)
+
+        with self.db:
+            stored = self._meta("fingerprint")
+            if stored != cache_fingerprint:
+                logging.debug("RenderCache(): fingerprint changed, emptying '%s'", self.file_name)
+                self.db.execute("DELETE FROM blocks")
+                self._set_meta("fingerprint", cache_fingerprint)
+                self._set_meta("size", "0")
+                self.invalidated = stored is not None
+
+            self.generation = int(self._meta("generation") or 0) + 1
+            self._set_meta("generation", str(self.generation))
+
+    def _meta(self, name: str) -> str | None:
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def _set_meta(self, name: str, value: str):
+        self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def get_many(self, keys: list) -> dict:
+        """Cached blocks of the keys that are cached, one query per QUERY_KEYS keys."""
+        blocks = {key: self._added[key] for key in keys if key in self._added}
+        missing = [key for key in keys if key not in blocks]
+
+        for start in range(0, len(missing), QUERY_KEYS):
+            chunk = missing[start:start + QUERY_KEYS]
+            for (rowid, key, block) in self.db.execute(
+                f"SELECT rowid, key, block FROM blocks WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ):
+                blocks[key] = block
+                self._used.append(rowid)
+
+        return blocks
+
+    def put(self, key: bytes, block: str):
+        """Cache a block, it's stored when the cache is closed."""
+        self._added[key] = block
+
+    def render(self, template, contexts):
+        """Yield the rendered block of every context, from the cache when it's there."""
+        contexts = iter(contexts)
+        while chunk := list(itertools.islice(contexts, QUERY_KEYS)):
+            keys = [block_key(context) for context in chunk]
+            blocks = self.get_many(keys)
+
+            for (key, context) in zip(keys, chunk):
+                block = blocks.get(key)
+
+                if block is None:
+                    self.misses += 1
+                    block = template.render(rules=[context])
+                    self.put(key, block)
+                    # repeated contexts in the same chunk
+                    blocks[key] = block
+                else:
+                    self.hits += 1
+
+                yield block
+
+    def evict(self, added_bytes: int):
+        """Remove the least recently used blocks until the cache fits in max_bytes.
+
+        The size is kept in meta and only recounted when it isn't there or says
+        the cache is too big (a block another worker stored too is counted twice).
+        """
+        total = self._meta("size")
+        if total is None or int(total) + added_bytes > self.max_bytes:
+            (total,) = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blocks").fetchone()
+        else:
+            total = int(total) + added_bytes
+
+        evicted = []
+        if total > self.max_bytes:
+            for (rowid, size) in self.db.execute("SELECT rowid, size FROM blocks ORDER BY used"):
+                if total <= self.max_bytes:
+                    break
+                evicted.append((rowid,))
+                total -= size
+
+        self.db.executemany("DELETE FROM blocks WHERE rowid = ?", evicted)
+        self._set_meta("size", str(total))
+        self.evicted += len(evicted)
+
+    def close(self):
+        """Store the new blocks, mark the used ones and evict."""
+        added = [(key, block, len(block.encode()), self.generation) for (key, block) in self._added.items()]
+
+        with self.db:
+            # sorted rowids update the table in order
+            self._used.sort()
+            for start in range(0, len(self._used), QUERY_KEYS):
+                chunk = self._used[start:start + QUERY_KEYS]
+                self.db.execute(
+                    f"UPDATE blocks SET used = ? WHERE rowid IN ({','.join('?' * len(chunk))})",
+                    [self.generation] + chunk
+                )
+            self.db.executemany("INSERT OR REPLACE INTO blocks (key, block, size, used) VALUES (?, ?, ?, ?)", added)
+            self.evict(sum(size for (_, _, size, _) in added))
+
+        self.db.close()
+        self._used = []
+        self._added = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.db.close()
+
+
+class OutputFile:
+    """Text file written to a temporary file that replaces it only if its contents changed.
+
+    Unchanged files keep their modification time, so tools watching them
+    (make, Terraform wrappers) don't see a change.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.temp_name = f"{file_name}.tmp"
+        self.changed = None
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.temp_name, "w", encoding="utf-8")
+
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+
+        if exc_type is not None:
+            os.remove(self.temp_name)
+            return
+
+        self.changed = not (os.path.isfile(self.file_name) and filecmp.cmp(self.temp_name, self.file_name, shallow=False))
+        if self.changed:
+            os.replace(self.temp_name, self.file_name)
+        else:
+            os.remove(self.temp_name)
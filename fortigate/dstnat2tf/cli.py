@@ -0,0 +1,77 @@
+"""FortiOS CLI scripts (--output-format fortios-cli), optionally split in chunks of objects."""
+import logging
+import os
+import re
+
+from cache import OutputFile
+
+
+def chunk_units(units, size: int) -> list:
+    """Split (vips, policy) units in chunks of at most size objects, 0 for a single chunk.
+
+    A policy stays in the same chunk as its new VIPs, so chunks can be applied
+    in any order or at the same time. Units bigger than size get a chunk of
+    their own.
+    """
+    chunks = [[]]
+    objects = 0
+
+    for unit in units:
+        unit_objects = len(unit[0]) + 1
+        if size and chunks[-1] and objects + unit_objects > size:
+            chunks.append([])
+            objects = 0
+
+        chunks[-1].append(unit)
+        objects += unit_objects
+
+    return chunks
+
+
+def chunk_list(items: list, size: int) -> list:
+    """Split a list in chunks of at most size items, 0 for a single chunk."""
+    if not size or not items:
+        return [items]
+
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def script_names(basename: str, count: int, chunked: bool) -> list:
+    """BASENAME.conf or BASENAME-001.conf, BASENAME-002.conf..."""
+    if not chunked:
+        return [f"{basename}.conf"]
+
+    return [f"{basename}-{number:03}.conf" for number in range(1, count + 1)]
+
+
+def stale_scripts(basename: str, count: int, chunked: bool) -> list:
+    """Scripts of a previous run that this one doesn't write, they'd be applied twice."""
+    (directory, name) = os.path.split(basename)
+    rx_chunk = re.compile(rf"{re.escape(name)}-(\d{{3,}})\.conf")
+
+    stale = []
+    for file_name in os.listdir(directory or "."):
+        if (m := rx_chunk.fullmatch(file_name)) is not None and (not chunked or int(m.group(1)) > count):
+            stale.append(os.path.join(directory, file_name))
+
+    if chunked and os.path.isfile(f"{basename}.conf"):
+        stale.append(f"{basename}.conf")
+
+    return sorted(stale)
+
+
+def write_scripts(basename: str, chunks: list, render, chunked: bool) -> tuple:
+    """Write every chunk with render(chunk, file) and remove the stale scripts, returns (outputs, removed)."""
+    outputs = []
+    for (file_name, chunk) in zip(script_names(basename, len(chunks), chunked), chunks):
+        output = OutputFile(file_name)
+        with output as script:
+            render(chunk, script)
+        outputs.append(output)
+
+    removed = stale_scripts(basename, len(chunks), chunked)
+    for file_name in removed:
+        logging.debug("write_scripts(): removing stale script '%s'", file_name)
+        os.remove(file_name)
+
+    return (outputs, removed)
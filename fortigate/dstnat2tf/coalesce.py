@@ -0,0 +1,199 @@
+"""Coalesce DNAT rules with contiguous ports or addresses into range VIPs."""
+import logging
+import re
+
+from nat import IPRange, NATRule, PortRange
+
+# numbers don't change a comment's class, "web 1" and "web 2" can be merged
+RX_DIGITS = re.compile(r"\d+")
+
+
+def comment_class(comment: str | None) -> str | None:
+    """Comment with its numbers replaced by #."""
+    return None if comment is None else RX_DIGITS.sub("#", comment)
+
+
+def internal_ports(nat_rule: NATRule) -> PortRange:
+    """Mapped ports, the external ones if the rule doesn't set them."""
+    return nat_rule.internal_ports if nat_rule.internal_ports.start is not None else nat_rule.external_ports
+
+
+def coalescable(nat_rule: NATRule) -> bool:
+    """Whether a TCP/UDP rule maps its port and address ranges 1:1, only those are merged."""
+    external_address = nat_rule.external_address
+    internal_address = nat_rule.internal_address
+    external_ports = nat_rule.external_ports
+    ports = nat_rule.internal_ports if nat_rule.internal_ports.start is not None else external_ports
+
+    # range widths are compared directly, len() is much slower
+    return (
+        nat_rule.protocol.id in (6, 17)
+        and not external_address.any and external_address.start is not None
+        and not internal_address.any and internal_address.start is not None
+        and external_address.end - external_address.start == internal_address.end - internal_address.start
+        and external_ports.start is not None
+        and external_ports.end - external_ports.start == ports.end - ports.start
+    )
+
+
+def group_key(nat_rule: NATRule) -> tuple:
+    """Sortable key of what merged rules must share: protocol, interfaces and comment class."""
+    comment = comment_class(nat_rule.comment)
+
+    return (
+        nat_rule.protocol.id,
+        nat_rule.external_interface is None, nat_rule.external_interface or "",
+        nat_rule.internal_interface is None, nat_rule.internal_interface or "",
+        comment is None, comment or ""
+    )
+
+
+class Entry:
+    """Rule being coalesced, the indexes of the parsed rules it covers and its group key."""
+
+    __slots__ = ("members", "rule", "group", "copied")
+
+    def __init__(self, ix: int, nat_rule: NATRule):
+        self.members = [ix]
+        self.rule = nat_rule
+        self.group = group_key(nat_rule)
+        self.copied = False
+
+    def merge(self, other):
+        """Take the members of other, the rule is copied first so the parsed rules don't change."""
+        if not self.copied:
+            copy = NATRule()
+            for attribute in NATRule.__slots__:
+                setattr(copy, attribute, getattr(self.rule, attribute))
+            self.rule = copy
+            self.copied = True
+
+        self.members.extend(other.members)
+
+
+def merge_ports(entries: list) -> list:
+    """Merge rules of the same addresses with contiguous external and mapped ports."""
+    def sort_key(entry):
+        nat_rule = entry.rule
+        return (
+            entry.group,
+            nat_rule.external_address.start, nat_rule.external_address.end,
+            nat_rule.internal_address.start, nat_rule.internal_address.end,
+            nat_rule.external_ports.start, internal_ports(nat_rule).start
+        )
+
+    merged = []
+    previous_key = None
+    for (key, entry) in sorted(((sort_key(entry), entry) for entry in entries), key=lambda item: item[0]):
+        key = key[:5]
+
+        if key == previous_key:
+            previous = merged[-1]
+            (previous_rule, nat_rule) = (previous.rule, entry.rule)
+            (previous_ports, ports) = (internal_ports(previous_rule), internal_ports(nat_rule))
+
+            if previous_rule.external_ports.end + 1 == nat_rule.external_ports.start and previous_ports.end + 1 == ports.start:
+                previous.merge(entry)
+                previous.rule.external_ports = PortRange.from_ports(previous_rule.external_ports.start, nat_rule.external_ports.end)
+                previous.rule.internal_ports = PortRange.from_ports(previous_ports.start, ports.end)
+                continue
+
+        merged.append(entry)
+        previous_key = key
+
+    return merged
+
+
+def merge_addresses(entries: list) -> list:
+    """Merge rules of the same ports with contiguous 1:1 external and mapped addresses."""
+    def sort_key(entry):
+        nat_rule = entry.rule
+        ports = internal_ports(nat_rule)
+        return (
+            entry.group,
+            nat_rule.external_ports.start, nat_rule.external_ports.end,
+            ports.start, ports.end,
+            nat_rule.external_address.start, nat_rule.internal_address.start
+        )
+
+    merged = []
+    previous_key = None
+    for (key, entry) in sorted(((sort_key(entry), entry) for entry in entries), key=lambda item: item[0]):
+        key = key[:5]
+
+        if key == previous_key:
+            previous = merged[-1]
+            (previous_rule, nat_rule) = (previous.rule, entry.rule)
+
+            if (previous_rule.external_address.end + 1 == nat_rule.external_address.start
+                    and previous_rule.internal_address.end + 1 == nat_rule.internal_address.start):
+                previous.merge(entry)
+                previous.rule.external_address = IPRange.from_ints(previous_rule.external_address.start, nat_rule.external_address.end)
+                previous.rule.internal_address = IPRange.from_ints(previous_rule.internal_address.start, nat_rule.internal_address.end)
+                continue
+
+        merged.append(entry)
+        previous_key = key
+
+    return merged
+
+
+def coalesce_rules(nat_rules: list) -> tuple:
+    """Coalesce rules into port and address range rules.
+
+    Rules sharing protocol, interfaces and comment class are sorted and merged
+    when their external and mapped ports are contiguous (same addresses) and
+    then when their external and mapped addresses are contiguous (same ports),
+    O(n log n). Merged rules take the place of their first rule.
+
+    Returns the new rule list and, for each rule, the indexes of the rules it
+    replaces.
+    """
+    entries = []
+    kept = []
+    for (ix, nat_rule) in enumerate(nat_rules):
+        if coalescable(nat_rule):
+            entries.append(Entry(ix, nat_rule))
+        else:
+            kept.append((ix, nat_rule))
+
+    coalesced = [(min(entry.members), entry) for entry in merge_addresses(merge_ports(entries))]
+    coalesced.sort(key=lambda item: item[0])
+
+    rules = []
+    rule_members = []
+    for (_, entry) in coalesced:
+        if len(entry.members) > 1:
+            entry.members.sort()
+            comments = [nat_rules[ix].comment for ix in entry.members]
+            if len(set(comments)) > 1:
+                entry.rule.comment = f"{comments[0]} .. {comments[-1]}"
+
+            logging.debug("coalesce_rules(): %d rules merged into %s", len(entry.members), entry.rule)
+
+        rules.append(entry.rule)
+        rule_members.append(entry.members)
+
+    return merge_kept(rules, rule_members, kept)
+
+
+def merge_kept(rules: list, rule_members: list, kept: list) -> tuple:
+    """Put back the rules that weren't coalesced in their place, both lists are in rule order."""
+    merged_rules = []
+    merged_members = []
+    kept_ix = 0
+
+    for (nat_rule, members) in zip(rules, rule_members):
+        while kept_ix < len(kept) and kept[kept_ix][0] < members[0]:
+            merged_rules.append(kept[kept_ix][1])
+            merged_members.append([kept[kept_ix][0]])
+            kept_ix += 1
+
+        merged_rules.append(nat_rule)
+        merged_members.append(members)
+
+    for (ix, nat_rule) in kept[kept_ix:]:
+        merged_rules.append(nat_rule)
+        merged_members.append([ix])
+
+    return (merged_rules, merged_members)
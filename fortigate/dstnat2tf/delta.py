@@ -0,0 +1,99 @@
+"""Generate only what an existing FortiGate configuration doesn't have (--against)."""
+import logging
+
+from common import fortios
+from nat import Services, unique_name
+
+
+def literal_name(value: str) -> str | None:
+    """Object name of a quoted template value, None if it references a generated resource."""
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+
+    return None
+
+
+class Delta:
+    """Objects of an existing configuration and what was reused or renamed because of them.
+
+    Services are added to the Services as built in ones, so rules use them
+    instead of new ones. VIPs and policies that do the same as an existing one
+    aren't generated, new ones whose names are taken are renamed.
+    """
+
+    def __init__(self, objects: fortios.Objects):
+        self.objects = objects
+        self.services = 0
+        self.vips = 0
+        self.policies = 0
+        self.renamed = 0
+
+        # the indexes are built now, the configuration can be closed after this
+        self.vip_names = objects.names("firewall vip")
+        # a copy, renamed policies are added to it
+        self.policy_names = set(objects.policy_names)
+        self.existing_vips = objects.vips
+        self.existing_policies = objects.policies
+        self.existing_services = objects.services
+
+    @classmethod
+    def load(cls, file_name: str, vdom: str | None = None):
+        """Index the objects of a configuration file, raises OSError."""
+        with fortios.Config.open(file_name) as config:
+            if vdom is not None and vdom not in config.vdoms:
+                raise KeyError(f"VDOM '{vdom}' isn't in '{file_name}'")
+
+            return cls(fortios.Objects(config, vdom))
+
+    def add_services(self, services: Services) -> int:
+        """Add the existing services that aren't already there as built in, returns how many."""
+        added = 0
+        for (name, (tcp_portranges, udp_portranges)) in self.existing_services.items():
+            if name in services.services:
+                continue
+
+            try:
+                services.add(name, tcp_portrange=",".join(tcp_portranges), udp_portrange=",".join(udp_portranges), built_in=True)
+            except ValueError as e:
+                logging.debug("Delta.add_services(): skipping '%s': %s", name, e)
+                continue
+
+            added += 1
+
+        return added
+
+    def contexts(self, contexts):
+        """Yield the (vip, policy) contexts that aren't in the configuration.
+
+        vip is None when an existing VIP is reused, the policy references it by
+        name. Rules whose VIP and policy both exist aren't yielded.
+        """
+        for (vip, policy) in contexts:
+            key = fortios.vip_key(
+                vip["extintf"], vip["protocol"], str(vip["extip"]), str(vip["extport"]),
+                str(vip["mappedip"]), str(vip["mappedport"])
+            )
+
+            if (vip_name := self.existing_vips.get(key)) is not None:
+                self.vips += 1
+                existing_policy = (
+                    policy["extintf"], policy["intintf"], literal_name(policy["source"]), vip_name, literal_name(policy["service"])
+                )
+                if existing_policy in self.existing_policies:
+                    self.policies += 1
+                    continue
+
+                vip = None
+                policy = dict(policy, dstaddr=f"\"{vip_name}\"", vip_name=vip_name)
+            elif vip["name"] in self.vip_names:
+                self.renamed += 1
+                vip = dict(vip, name=unique_name(vip["name"], self.vip_names))
+                self.vip_names.add(vip["name"])
+                policy = dict(policy, vip_name=vip["name"])
+
+            if policy["name"] in self.policy_names:
+                self.renamed += 1
+                policy = dict(policy, name=unique_name(policy["name"], self.policy_names))
+                self.policy_names.add(policy["name"])
+
+            yield (vip, policy)
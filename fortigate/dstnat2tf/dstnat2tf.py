@@ -1,170 +1,267 @@
 """Convert destination NAT rules to a FortiGate Terraform template."""
 import argparse
+import copy
 import os
 import sys
 import json
-from nat import NetworkMap, InterfaceMap, Services, format_iptables, format_csv
-from rich.console import Console
-from rich.table import Table
-from jinja2 import Environment, FileSystemLoader, TemplateNotFound
+import time
 
-import pandas as pd
+SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.dirname(os.path.dirname(SCRIPT_PATH))
+
+# shared modules live in the repository's common package
+if REPO_PATH not in sys.path:
+    sys.path.append(REPO_PATH)
+
+# pylint: disable=C0413
+from common import timings
+from cache import DEFAULT_CACHE_SIZE, OutputFile
+from nat import NetworkMap, InterfaceMap, Services, format_iptables, format_csv, format_mikrotik
+from nat import parse_iptables_parallel, parse_csv_parallel, name_hash, unique_name
+from report import REPORT_FORMATS
+
+# rich, jinja2, numpy (ruletable) and the report writers are imported when they're needed
 
-SCRIPT_PATH = sys.path[0]
 DEFAULT_SERVICES_FILE = f"{SCRIPT_PATH}{os.sep}default-services.json"
+TEMPLATES_PATH = f"{SCRIPT_PATH}{os.sep}templates"
+TEMPLATES_CACHE = f"{TEMPLATES_PATH}{os.sep}__pycache__"
 
-parser = argparse.ArgumentParser(
-    prog="dstnat2tf",
-    description="Converts destination NAT rules to a FortiGate Terraform template."
-)
-
-parser.add_argument(
-    "--input",
-    required=True,
-    help="Input file."
-)
-
-parser.add_argument(
-    "--input-format",
-    required=True,
-    choices=["iptables", "mikrotik", "csv"],
-    help="Input file format."
-)
-
-parser.add_argument(
-    "--output-basename",
-    required=True,
-    help="Output base name for files. Ie: 'test' will generate 'test.tf' and 'test.xlsx'."
-)
-
-parser.add_argument(
-    "--map-network",
-    action="append",
-    help="Map a network address to interface, format ADDRESS:INTERFACE"
-)
-
-parser.add_argument(
-    "--map-interface",
-    action="append",
-    help="Map an interface name to a destination interface name SOURCE_INTERFACE:TARGET_INTERFACE"
-)
-
-parser.add_argument(
-    "--default-internal",
-    help="Default internal (ie: LAN) interface name"
-)
-
-parser.add_argument(
-    "--default-external",
-    help="Default external (ie: ISP) interface name"
-)
-
-parser.add_argument(
-    "--ignore-issues",
-    help="Ignore rules with issues.",
-    action="store_true",
-    default=False
-)
-
-parser.add_argument(
-    "--use-sdwan",
-    help="Create policies with an SD-WAN zone instead of an interface.",
-    action="store_true",
-    default=False
-)
-
-parser.add_argument(
-    "--sdwan-zone",
-    help="SD-WAN zone for internet (def: virtual-wan-link)",
-    default="virtual-wan-link"
-)
-
-console = Console(emoji_variant="emoji", tab_size=2, highlighter=None)
-console.print("[yellow][bold]dstnat2tf[/bold] Convert destination NAT rules to a FortiGate Terraform template.\n")
-
-args = parser.parse_args()
-console.print(f"[bold][green]input file[/green][/bold]: {args.input}")
-console.print(f"[bold][green]input file format[/green][/bold]: {args.input_format}")
-console.print(f"[bold][green]output filename base[/green][/bold]: {args.output_basename}")
-
-# init
-network_map = NetworkMap()
-interface_map = InterfaceMap()
-
-ABORT = False
-
-if args.default_internal:
-    console.print(f"[bold][cyan]default internal interface[/cyan][/bold]: {args.default_internal}")
-
-if args.default_external:
-    console.print(f"[bold][cyan]default external interface[/cyan][/bold]: {args.default_external}")
-
-if args.map_network:
-    console.print("[bold]network to interface map[/bold]:")
-    for map_spec in args.map_network:
-        tokens = map_spec.split(":")
-        if len(tokens) != 2:
-            console.print(f"⛔ [bold]invalid spec '{map_spec}'")
-            ABORT = True
-        else:
-            try:
-                network_map.add(tokens[0], tokens[1])
-                console.print(f"\t 🛜  {tokens[0]} => {tokens[1]}")
-            except ValueError as e:
-                console.print(f"⛔ [bold]invalid spec '{map_spec}':[/bold] {e}")
-                ABORT = True
-
-if args.map_interface:
-    console.print("[bold]interface to interface map[/bold]:")
-    for map_spec in args.map_interface:
-        tokens = map_spec.split(":")
-        if len(tokens) != 2:
-            console.print(f"⛔ [bold]invalid spec '{map_spec}'")
-            ABORT = True
-        else:
-            try:
-                interface_map.add(tokens[0], tokens[1])
-                console.print(f"\t ⏩ {tokens[0]} => {tokens[1]}")
-            except ValueError as e:
-                console.print(f"⛔ [bold]invalid spec '{map_spec}':[/bold] {e}")
-                ABORT = True
-
-# initialize jinja2 environment and load templates
-j2_env = Environment(
-    loader = FileSystemLoader(SCRIPT_PATH + os.sep + "templates"),
-    trim_blocks = True,
-    lstrip_blocks = True
-)
-
-try:
-    vip_template = j2_env.get_template("vip.j2")
-    policy_template = j2_env.get_template("policy.j2")
-    services_template = j2_env.get_template("service.j2")
-except TemplateNotFound as e:
-    print(f"⛔ [bold]template not found:[/bold] {e}")
-    ABORT = True
-
-if ABORT:
-    sys.exit(-1)
-
-if not os.path.isfile(args.input):
-    console.print(f"⛔ [bold]invalid input file '{args.input}', aborting.")
-    sys.exit(-1)
-
-try:
-    output_file = open(args.output_basename + ".tf", "w", encoding="utf-8")
-except OSError as e:
-    console.print(f"⛔ [bold]can't create output file '{args.output_basename}.tf', aborting: {e}")
-    sys.exit(-1)
-
-# load port to default services map
-services = Services()
-
-## usar PWD
-
-if os.path.isfile(DEFAULT_SERVICES_FILE):
-    console.print("📃 loading [bold]default services[/bold] file.")
-    with open(DEFAULT_SERVICES_FILE, encoding="utf-8") as f:
+INPUT_FORMATS = {
+    "iptables": format_iptables,
+    "mikrotik": format_mikrotik,
+    "csv": format_csv
+}
+
+# terraform: .tf files, terraform-json: .tf.json files with for_each maps, fortios-cli: FortiOS CLI scripts
+OUTPUT_FORMATS = {
+    "terraform": ".tf",
+    "terraform-json": ".tf.json",
+    "fortios-cli": ".conf"
+}
+
+# index: names numbered in rule order, hash: names derived from each rule or service
+NAMING_MODES = ("index", "hash")
+
+# VIPs per policy with --aggregate-policies
+DEFAULT_POLICY_MEMBERS = 100
+
+# formats with interface names of the source device, renamed with --map-interface
+INTERFACE_FORMATS = ("mikrotik",)
+
+# formats that can be parsed in chunks by several processes, see --jobs
+PARALLEL_FORMATS = {
+    "iptables": parse_iptables_parallel,
+    "csv": parse_csv_parallel
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Command line parser."""
+    parser = argparse.ArgumentParser(
+        prog="dstnat2tf",
+        description="Converts destination NAT rules to a FortiGate Terraform template."
+    )
+
+    parser.add_argument(
+        "--input",
+        help="Input file, required unless --batch is used."
+    )
+
+    parser.add_argument(
+        "--input-format",
+        choices=list(INPUT_FORMATS),
+        help="Input file format, required unless --batch is used."
+    )
+
+    parser.add_argument(
+        "--output-basename",
+        help="Output base name for files. Ie: 'test' will generate 'test.tf' and 'test.xlsx'. With --batch, the output directory."
+    )
+
+    parser.add_argument(
+        "--output-format",
+        choices=list(OUTPUT_FORMATS),
+        default="terraform",
+        help="Output format, Terraform files, Terraform JSON files or FortiOS CLI scripts (def: terraform)."
+    )
+
+    parser.add_argument(
+        "--cli-chunk",
+        metavar="N",
+        type=int,
+        default=0,
+        help="Split the FortiOS CLI scripts in files of at most N objects, a policy stays with its VIPs (def: 0, a single script)."
+    )
+
+    parser.add_argument(
+        "--coalesce-vips",
+        help="Merge rules with contiguous ports or 1:1 addresses into range VIPs.",
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        "--no-table",
+        help="Don't print the rules table, only the rules with issues.",
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        "--batch",
+        help="Convert every input of a directory (format by extension) or of a JSON manifest."
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Batch worker processes (def: number of CPUs)."
+    )
+
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Reuse the rules rendered by previous runs, cached in DIR."
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        metavar="MB",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help=f"Cache size limit, least recently used rules are evicted (def: {DEFAULT_CACHE_SIZE})."
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Parse the input with this many processes, iptables and csv only (def: 1)."
+    )
+
+    parser.add_argument(
+        "--against",
+        metavar="BACKUP",
+        help="Only generate what this FortiGate configuration backup doesn't have, existing services, VIPs and policies are reused."
+    )
+
+    parser.add_argument(
+        "--against-vdom",
+        metavar="VDOM",
+        help="VDOM of the --against configuration (def: the global or only one)."
+    )
+
+    parser.add_argument(
+        "--report-format",
+        help="Report file format (def: xlsx)",
+        choices=REPORT_FORMATS,
+        default="xlsx"
+    )
+
+    parser.add_argument(
+        "--no-report",
+        help="Don't generate the report file.",
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        "--map-network",
+        action="append",
+        help="Map a network address to interface, format ADDRESS:INTERFACE"
+    )
+
+    parser.add_argument(
+        "--map-network-file",
+        action="append",
+        help="File with one ADDRESS:INTERFACE network to interface map per line"
+    )
+
+    parser.add_argument(
+        "--allow-nested-networks",
+        help="Allow nested mapped networks, the longest prefix wins.",
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        "--map-interface",
+        action="append",
+        help="Map an interface name to a destination interface name SOURCE_INTERFACE:TARGET_INTERFACE"
+    )
+
+    parser.add_argument(
+        "--default-internal",
+        help="Default internal (ie: LAN) interface name"
+    )
+
+    parser.add_argument(
+        "--default-external",
+        help="Default external (ie: ISP) interface name"
+    )
+
+    parser.add_argument(
+        "--ignore-issues",
+        help="Ignore rules with issues.",
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        "--service-match",
+        help="How to reuse existing services: 'exact' port range or the tightest 'containing' range (def: exact)",
+        choices=["exact", "containing"],
+        default="exact"
+    )
+
+    parser.add_argument(
+        "--naming",
+        help="Resource and service names: numbered in rule 'index' order or a 'hash' of the rule or port range (def: index)",
+        choices=NAMING_MODES,
+        default="index"
+    )
+
+    parser.add_argument(
+        "--aggregate-policies",
+        help="One policy for all the VIPs with the same interfaces, source and service.",
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        "--policy-members",
+        help=f"Most VIPs in an aggregated policy, bigger groups get more policies (def: {DEFAULT_POLICY_MEMBERS})",
+        type=int,
+        default=DEFAULT_POLICY_MEMBERS
+    )
+
+    parser.add_argument(
+        "--use-sdwan",
+        help="Create policies with an SD-WAN zone instead of an interface.",
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        "--sdwan-zone",
+        help="SD-WAN zone for internet (def: virtual-wan-link)",
+        default="virtual-wan-link"
+    )
+
+    timings.add_arguments(parser)
+
+    return parser
+
+
+def load_services(services_file: str) -> Services | None:
+    """Load the default (built in) services, None if there's no services file."""
+    if not os.path.isfile(services_file):
+        return None
+
+    services = Services()
+
+    with open(services_file, encoding="utf-8") as f:
         temp_services=json.load(f)
 
         for service in temp_services:
@@ -174,175 +271,235 @@ if os.path.isfile(DEFAULT_SERVICES_FILE):
                 udp_portrange=temp_services[service]["udp-portrange"] if "udp-portrange" in temp_services[service] else None,
                 built_in=True
             )
-else:
-    console.print("⚠️ no [bold]default services[/bold] file found.")
 
-formats = {
-    "iptables": format_iptables,
-    "csv": format_csv
-}
+    return services
+
+
+def template_environment():
+    """Jinja2 environment for the templates directory, compiled templates are cached."""
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader  # pylint: disable=C0415
+
+    try:
+        os.makedirs(TEMPLATES_CACHE, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(TEMPLATES_CACHE)
+    except OSError:
+        bytecode_cache = None
+
+    return Environment(
+        loader = FileSystemLoader(TEMPLATES_PATH),
+        bytecode_cache = bytecode_cache,
+        # templates don't change during a run, includes aren't stat()ed every render
+        auto_reload = False,
+        trim_blocks = True,
+        lstrip_blocks = True
+    )
+
 
-nat_rules = []
-
-with open(args.input, encoding="utf-8") as input_file:
-    formats[args.input_format](nat_rules, input_file.readlines(), network_map)
-
-dstnat_table = Table(title="Destination NAT rules")
-dstnat_table.add_column("#")
-dstnat_table.add_column("ok")
-dstnat_table.add_column("protocol", justify="center")
-dstnat_table.add_column("external if")
-dstnat_table.add_column("external ip", justify="right")
-dstnat_table.add_column("external port", justify="right")
-dstnat_table.add_column("internal if")
-dstnat_table.add_column("internal ip", justify="right")
-dstnat_table.add_column("internal port", justify="right")
-
-ix = 0
-service_ix = 1
-nat_rules_with_issues = []
-rules_df_dict = {
-    "id": [],
-    "protocol": [],
-    "extintf": [],
-    "extips": [],
-    "extports": [],
-    "intintf": [],
-    "intips": [],
-    "intports": [],
-    "fos_service": [],
-    "comments": []
+# templates by the name render() uses
+TEMPLATES = {
+    "dstnat": "dstnat.j2",
+    "service": "service.j2",
+    "aggregated": "dstnat-aggregated.j2",
+    "dstnat-cli": "dstnat.conf.j2",
+    "service-cli": "service.conf.j2"
 }
 
-for nat_rule in nat_rules:
 
-    RULE_STATUS = None
+def load_templates() -> dict:
+    """Load the templates, raises jinja2's TemplateNotFound."""
+    j2_env = template_environment()
 
-    # use default external interface?
-    if nat_rule.external_interface is not None:
-        external_interface = nat_rule.external_interface
-    else:
-        if args.default_external:
-            nat_rule.external_interface = args.default_external
-            external_interface = f"[i]{args.default_external}[/i]"
+    return {name: j2_env.get_template(file_name) for (name, file_name) in TEMPLATES.items()}
 
-        RULE_STATUS = "⚠️"
 
-    # use default internal  interface?
-    if nat_rule.internal_interface is not None:
-        internal_interface = nat_rule.internal_interface
-    else:
-        if args.default_internal:
-            nat_rule.internal_interface = args.default_internal
-            internal_interface = f"[bright_black][i]{args.default_internal}[/i][/bright_black]"
+def read_rules(input_name: str, input_format: str, network_map: NetworkMap, jobs: int = 1, interface_map: InterfaceMap | None = None) -> list:
+    """Parse the input file and return its NAT rules.
 
-        RULE_STATUS = "⚠️"
+    With more than one job, formats that support it are parsed in chunks by
+    worker processes, rules keep their file order.
+    """
+    if jobs > 1 and input_format in PARALLEL_FORMATS:
+        return list(PARALLEL_FORMATS[input_format](input_name, network_map, jobs))
 
-    # internal port defaults to external
-    if nat_rule.protocol.id in [6,17]:
-        if len(nat_rule.internal_ports) == 0:
-            internal_ports = f"[bright_black][i]{nat_rule.external_ports}[/i][/bright_black]"
-            nat_rule.internal_ports = nat_rule.external_ports
+    nat_rules = []
+
+    with open(input_name, encoding="utf-8", newline="") as input_file:
+        if input_format in INTERFACE_FORMATS:
+            INPUT_FORMATS[input_format](nat_rules, input_file, network_map, interface_map)
         else:
-            internal_ports = str(nat_rule.internal_ports)
-
-        rules_df_dict["intports"].append(nat_rule.internal_ports)
-        rules_df_dict["extports"].append(nat_rule.external_ports)
-        fos_service = services.lookup(nat_rule.protocol.name, nat_rule.internal_ports)
-        if fos_service is None:
-            service_name = f"SERVICE-{service_ix:03}"
-            if nat_rule.protocol.id == 6:
-                services.add(service_name, tcp_portrange=str(nat_rule.internal_ports))
+            INPUT_FORMATS[input_format](nat_rules, input_file, network_map)
+
+    return nat_rules
+
+
+def prepare_rules(nat_rules: list, services: Services, args) -> tuple:
+    """Apply default interfaces and ports, pick a service for each rule.
+
+    Returns the per-rule service names and (uses defaults, external if,
+    internal if, internal ports) display values.
+    """
+    service_ix = 1
+    rules_display = []
+    rule_services = []
+
+    for nat_rule in nat_rules:
+
+        uses_defaults = False
+        external_interface = ""
+        internal_interface = ""
+        internal_ports = ""
+
+        # use default external interface?
+        if nat_rule.external_interface is not None:
+            external_interface = nat_rule.external_interface
+        else:
+            if args.default_external:
+                nat_rule.external_interface = args.default_external
+                external_interface = f"[i]{args.default_external}[/i]"
+
+            uses_defaults = True
+
+        # use default internal  interface?
+        if nat_rule.internal_interface is not None:
+            internal_interface = nat_rule.internal_interface
+        else:
+            if args.default_internal:
+                nat_rule.internal_interface = args.default_internal
+                internal_interface = f"[bright_black][i]{args.default_internal}[/i][/bright_black]"
+
+            uses_defaults = True
+
+        # internal port defaults to external
+        if nat_rule.protocol.id in [6,17]:
+            if len(nat_rule.internal_ports) == 0:
+                internal_ports = f"[bright_black][i]{nat_rule.external_ports}[/i][/bright_black]"
+                nat_rule.internal_ports = nat_rule.external_ports
             else:
-                services.add(service_name, udp_portrange=str(nat_rule.internal_ports))
+                internal_ports = str(nat_rule.internal_ports)
 
-            rules_df_dict["fos_service"].append(service_name)
-            service_ix += 1
+            fos_service = services.lookup(
+                nat_rule.protocol.name,
+                nat_rule.internal_ports,
+                containing=args.service_match == "containing"
+            )
+            if fos_service is None:
+                if args.naming == "hash":
+                    service_key = f"{nat_rule.protocol.name}|{nat_rule.internal_ports}"
+                    service_name = unique_name(f"SERVICE-{name_hash(service_key)}", services.services)
+                else:
+                    # services of an --against configuration can take the numbered names
+                    while f"SERVICE-{service_ix:03}" in services.services:
+                        service_ix += 1
+                    service_name = f"SERVICE-{service_ix:03}"
+                if nat_rule.protocol.id == 6:
+                    services.add(service_name, tcp_portrange=str(nat_rule.internal_ports))
+                else:
+                    services.add(service_name, udp_portrange=str(nat_rule.internal_ports))
+
+                rule_services.append(service_name)
+                service_ix += 1
+            else:
+                rule_services.append(fos_service)
         else:
-            rules_df_dict["fos_service"]\
-                .append(services.lookup(nat_rule.protocol.name, nat_rule.internal_ports))
-    else:
-        rules_df_dict["intports"].append(None)
-        rules_df_dict["extports"].append(None)
-        rules_df_dict["fos_service"].append(None)
+            rule_services.append(None)
+
+        rules_display.append((uses_defaults, external_interface, internal_interface, internal_ports))
 
-    rule_ok = nat_rule.is_valid()
-    if not rule_ok:
-        RULE_STATUS = "⛔"
-        nat_rules_with_issues.append(ix)
-    elif RULE_STATUS is None:
-        RULE_STATUS = "✅"
+    return (rule_services, rules_display)
 
-    ix += 1
 
-    dstnat_table.add_row(
-        str(ix),
-        RULE_STATUS,
-        nat_rule.protocol.name,
-        external_interface,
-        str(nat_rule.external_address),
-        str(nat_rule.external_ports) if nat_rule.protocol.id in [6,17] else "",
-        internal_interface,
-        str(nat_rule.internal_address),
-        internal_ports if nat_rule.protocol.id in [6,17] else "",
+def print_coalesced(console, rule_members: list):
+    """Print how many rules were merged and how many VIPs and policies that saves."""
+    merged = [members for members in rule_members if len(members) > 1]
+    saved = sum(len(members) - 1 for members in merged)
+
+    console.print(
+        f"🗜️  coalesced [bold]{sum(len(members) for members in merged)}[/bold] rules into "
+        f"[bold]{len(merged)}[/bold] range VIPs: {saved} VIPs and {saved} policies saved, "
+        f"{len(rule_members)} rules left."
     )
 
-    rules_df_dict["id"].append(ix)
-    rules_df_dict["protocol"].append(nat_rule.protocol.name)
-    rules_df_dict["extintf"].append(nat_rule.external_interface)
-    rules_df_dict["extips"].append(nat_rule.external_address)
-    rules_df_dict["intintf"].append(nat_rule.internal_interface)
-    rules_df_dict["intips"].append(nat_rule.internal_address)
-    rules_df_dict["comments"].append(nat_rule.comment)
 
-console.print(dstnat_table)
-console.print("[bold]*[/bold] [bright_black][i]default values[/i][/bright_black]")
+def print_rules(console, nat_rules: list, rule_table, rules_display: list, rule_issues: dict, show_table: bool = True):
+    """Print the rules table and the rules with issues."""
+    if show_table:
+        print_rules_table(console, nat_rules, rule_table, rules_display)
 
-if len(nat_rules_with_issues)!=0:
-    console.print("\n[bold][red]NAT rules with issues:[/red][/bold]")
+    if len(rule_issues) != 0:
+        console.print("\n[bold][red]NAT rules with issues:[/red][/bold]")
 
-    for rule_id in nat_rules_with_issues:
-        issues = nat_rules[rule_id].diagnose()
+        for (rule_id, issues) in rule_issues.items():
+            console.print(f"\t⚠️  [bold]#{rule_id+1}[/bold] {nat_rules[rule_id]}")
+            for issue in issues:
+                console.print(f"\t\t⛔ {issue}")
 
-        console.print(f"\t⚠️  [bold]#{rule_id+1}[/bold] {nat_rules[rule_id]}")
-        for issue in issues:
-            console.print(f"\t\t⛔ {issue}")
+    console.print("\r")
 
-console.print("\r")
 
-if not args.ignore_issues:
-    console.print("⛔  issues found, aborting.")
-    sys.exit(-1)
+def print_rules_table(console, nat_rules: list, rule_table, rules_display: list):
+    """Print every rule, with its status and the default values it uses."""
+    from rich.table import Table  # pylint: disable=C0415
 
-console.print("⚠️  ignoring issues.")
+    dstnat_table = Table(title="Destination NAT rules")
+    dstnat_table.add_column("#")
+    dstnat_table.add_column("ok")
+    dstnat_table.add_column("protocol", justify="center")
+    dstnat_table.add_column("external if")
+    dstnat_table.add_column("external ip", justify="right")
+    dstnat_table.add_column("external port", justify="right")
+    dstnat_table.add_column("internal if")
+    dstnat_table.add_column("internal ip", justify="right")
+    dstnat_table.add_column("internal port", justify="right")
 
-# excel output
-console.print(f"🧾 generating excel file [bold]{args.output_basename}.xlsx[/bold] file.")
+    for (ix, nat_rule) in enumerate(nat_rules):
+        (uses_defaults, external_interface, internal_interface, internal_ports) = rules_display[ix]
 
-df = pd.DataFrame.from_dict(rules_df_dict)
-df.to_excel(args.output_basename + ".xlsx", sheet_name="dstnat", index=False)
+        if not rule_table.valid[ix]:
+            rule_status = "⛔"
+        elif uses_defaults:
+            rule_status = "⚠️"
+        else:
+            rule_status = "✅"
 
-# services output
-console.print(f"🧾 generating services file [bold]{args.output_basename}-services.tf[/bold] file.")
+        dstnat_table.add_row(
+            str(ix + 1),
+            rule_status,
+            nat_rule.protocol.name,
+            external_interface,
+            str(nat_rule.external_address),
+            str(nat_rule.external_ports) if nat_rule.protocol.id in [6,17] else "",
+            internal_interface,
+            str(nat_rule.internal_address),
+            internal_ports if nat_rule.protocol.id in [6,17] else "",
+        )
 
-with open (args.output_basename + "-services.tf", "w", encoding="utf-8") as services_tf:
-    services_tf.write(services_template.render(services=services))
+    console.print(dstnat_table)
+    console.print("[bold]*[/bold] [bright_black][i]default values[/i][/bright_black]")
 
-# policies and vips
-console.print(f"🧾 generating policies and vips file [bold]{args.output_basename}.tf[/bold] file.")
 
-with open(args.output_basename + ".tf", "w", encoding="utf-8") as output_tf:
-    vip_ix = 0
-    for nat_rule in nat_rules:
-        vip_ix += 1
+def dstnat_contexts(nat_rules: list, rule_table, rule_services: list, services: Services, args):
+    """Yield the (vip, policy) template contexts of every valid rule.
 
+    With --naming hash, resources are named after a hash of the rule key, so
+    adding or removing a rule doesn't rename the others.
+    """
+    taken = set()
+
+    for (ix, nat_rule) in enumerate(nat_rules):
         if nat_rule.protocol.id not in [6,17]:
             continue
 
-        if not nat_rule.is_valid():
+        if not rule_table.valid[ix]:
             continue
 
-        vip_name = f"vip-{vip_ix:03}-"
+        if args.naming == "hash":
+            # duplicated keys and hash collisions get a suffix
+            resource_id = unique_name(name_hash(nat_rule.key()), taken)
+            taken.add(resource_id)
+        else:
+            resource_id = f"{ix + 1:03}"
+
+        vip_name = f"vip-{resource_id}-"
 
         if not nat_rule.external_address.any:
             vip_name += f"{nat_rule.external_address}-"
@@ -356,32 +513,723 @@ with open(args.output_basename + ".tf", "w", encoding="utf-8") as output_tf:
         else:
             external_interface = nat_rule.external_interface
 
-        output_tf.write(vip_template.render(
-            resource_name=f"vip-{vip_ix:03}",
-            vip_name=vip_name,
-            vip_protocol=nat_rule.protocol.name,
-            vip_extintf=nat_rule.external_interface,
-            vip_extip=nat_rule.external_address,
-            vip_extport=nat_rule.external_ports,
-            vip_mappedip=nat_rule.internal_address,
-            vip_mappedport=nat_rule.internal_ports,
-        ))
-
-        service_name = services.lookup(nat_rule.protocol.name, nat_rule.internal_ports)
+        service_name = rule_services[ix]
         if services.services[service_name]["built_in"]:
             service_name = f"\"{service_name}\""
         else:
             service_name = f"fortios_firewallservice_custom.{service_name}.name"
 
-        output_tf.write(policy_template.render(
-            resource_name=f"policy-{vip_ix:03}",
-            policy_name=vip_name,
-            vip_resource_name=f"vip-{vip_ix:03}",
-            policy_extintf=external_interface,
-            policy_intintf=nat_rule.internal_interface,
-            policy_source="\"all\"",
-            policy_service=service_name
-        ))
-
-output_file.close()
-console.print("👍 done.")
+        yield (
+            {
+                "resource_name": f"vip-{resource_id}",
+                "name": vip_name,
+                "protocol": nat_rule.protocol.name,
+                "extintf": nat_rule.external_interface,
+                "extip": nat_rule.external_address,
+                "extport": nat_rule.external_ports,
+                "mappedip": nat_rule.internal_address,
+                "mappedport": nat_rule.internal_ports
+            },
+            {
+                "resource_name": f"policy-{resource_id}",
+                "name": vip_name,
+                "dstaddr": f"fortios_firewall_vip.vip-{resource_id}.name",
+                "vip_name": vip_name,
+                "extintf": external_interface,
+                "intintf": nat_rule.internal_interface,
+                "source": "\"all\"",
+                "service": service_name,
+                "service_name": rule_services[ix]
+            }
+        )
+
+
+def aggregate_policies(contexts, args, taken_names=()) -> tuple:
+    """Group the VIPs of the (vip, policy) contexts in policies and return (vips, policies).
+
+    VIPs sharing external and internal interface, source and service go in the
+    same policy, in rule order, up to --policy-members VIPs per policy. Policy
+    names in taken_names get a suffix.
+    """
+    vips = []
+    groups = {}
+
+    for (vip, policy) in contexts:
+        # existing VIPs (--against) have no vip
+        if vip is not None:
+            vips.append(vip)
+        group = (policy["extintf"], policy["intintf"], policy["source"], policy["service"], policy["service_name"])
+        groups.setdefault(group, []).append((policy["dstaddr"], policy["vip_name"]))
+
+    policies = []
+    for ((external_interface, internal_interface, source, service, service_name), members) in groups.items():
+        if args.naming == "hash":
+            group_id = name_hash("|".join((str(external_interface), str(internal_interface), source, service)))
+
+        for (chunk, start) in enumerate(range(0, len(members), args.policy_members), start=1):
+            if args.naming == "hash":
+                resource_id = f"{group_id}-{chunk}"
+            else:
+                resource_id = f"{len(policies) + 1:03}"
+
+            chunk_members = members[start:start + args.policy_members]
+            policies.append({
+                "resource_name": f"policy-{resource_id}",
+                "name": unique_name(f"dstnat-{resource_id}", taken_names),
+                "dstaddrs": [dstaddr for (dstaddr, _) in chunk_members],
+                "vip_names": [vip_name for (_, vip_name) in chunk_members],
+                "extintf": external_interface,
+                "intintf": internal_interface,
+                "source": source,
+                "service": service,
+                "service_name": service_name
+            })
+
+    return (vips, policies)
+
+
+def render(console, args, nat_rules: list, rule_table, rule_services: list, services: Services, templates: dict | None = None, delta=None):
+    """Render the services and the vips and policies files, only what isn't in the --against configuration with a delta."""
+    if templates is None:
+        from jinja2 import TemplateNotFound  # pylint: disable=C0415
+
+        try:
+            templates = load_templates()
+        except TemplateNotFound as e:
+            console.print(f"⛔ [bold]template not found:[/bold] {e}")
+            sys.exit(-1)
+
+    contexts = dstnat_contexts(nat_rules, rule_table, rule_services, services, args)
+    if delta is not None:
+        contexts = delta.contexts(contexts)
+
+    if args.output_format == "fortios-cli":
+        render_cli(console, args, contexts, services, templates, delta)
+        print_delta(console, delta)
+        return
+
+    if args.output_format == "terraform-json":
+        render_json(console, args, contexts, services, delta)
+        print_delta(console, delta)
+        return
+
+    # services output
+    console.print(f"🧾 generating services file [bold]{args.output_basename}-services.tf[/bold] file.")
+
+    services_output = OutputFile(args.output_basename + "-services.tf")
+    with services_output as services_tf:
+        services_tf.write(templates["service"].render(services=services))
+    print_unchanged(console, services_output)
+
+    # policies and vips
+    console.print(f"🧾 generating policies and vips file [bold]{args.output_basename}.tf[/bold] file.")
+
+    if args.aggregate_policies:
+        if args.cache is not None:
+            console.print("⚠️  the cache isn't used with --aggregate-policies.")
+
+        (vips, policies) = aggregate_policies(contexts, args, () if delta is None else delta.policy_names)
+        console.print(f"\t🗂️  {len(vips)} VIPs in {len(policies)} policies.")
+        print_delta(console, delta)
+
+        output = OutputFile(args.output_basename + ".tf")
+        with output as output_tf:
+            templates["aggregated"].stream(vips=vips, policies=policies).dump(output_tf)
+        print_unchanged(console, output)
+
+        return
+
+    dstnat_template = templates["dstnat"]
+    render_cache = open_cache(console, args, dstnat_template)
+
+    # single pass over the rules, written to the file as it's rendered
+    output = OutputFile(args.output_basename + ".tf")
+    with output as output_tf:
+        if render_cache is None:
+            dstnat_template.stream(rules=contexts).dump(output_tf)
+        else:
+            with render_cache:
+                output_tf.writelines(render_cache.render(dstnat_template, contexts))
+            console.print(
+                f"\t♻️  cache: {render_cache.hits} rule(s) reused, {render_cache.misses} rendered, "
+                f"{render_cache.evicted} evicted."
+            )
+    print_delta(console, delta)
+    print_unchanged(console, output)
+
+
+def render_cli(console, args, contexts, services: Services, templates: dict, delta=None):
+    """Write the services and the vips and policies FortiOS CLI scripts, in chunks with --cli-chunk.
+
+    Services go in their own scripts, to be applied before the others.
+    """
+    from cli import chunk_list, chunk_units, write_scripts  # pylint: disable=C0415
+
+    if args.cache is not None:
+        console.print("⚠️  the cache isn't used with --output-format fortios-cli.")
+
+    chunked = args.cli_chunk > 0
+    custom_services = sorted((name, data) for (name, data) in services.services.items() if not data["built_in"])
+
+    console.print(f"🧾 generating services script(s) [bold]{args.output_basename}-services.conf[/bold].")
+    (outputs, removed) = write_scripts(
+        f"{args.output_basename}-services",
+        chunk_list(custom_services, args.cli_chunk),
+        lambda chunk, script: templates["service-cli"].stream(services=chunk).dump(script),
+        chunked
+    )
+
+    if args.aggregate_policies:
+        (vips, policies) = aggregate_policies(contexts, args, () if delta is None else delta.policy_names)
+        vips_by_name = {vip["name"]: vip for vip in vips}
+        units = [([vips_by_name[name] for name in policy["vip_names"] if name in vips_by_name], policy) for policy in policies]
+    else:
+        units = [([] if vip is None else [vip], policy) for (vip, policy) in contexts]
+
+    console.print(f"🧾 generating policies and vips script(s) [bold]{args.output_basename}.conf[/bold].")
+    (rule_outputs, rule_removed) = write_scripts(
+        args.output_basename,
+        chunk_units(units, args.cli_chunk),
+        lambda chunk, script: templates["dstnat-cli"].stream(
+            vips=[vip for (unit_vips, _) in chunk for vip in unit_vips],
+            policies=[policy for (_, policy) in chunk]
+        ).dump(script),
+        chunked
+    )
+
+    if chunked:
+        console.print(
+            f"\t📦 {len(outputs)} services and {len(rule_outputs)} policies and vips script(s) of up to "
+            f"{args.cli_chunk} objects, apply the services first."
+        )
+
+    for output in outputs + rule_outputs:
+        print_unchanged(console, output)
+
+    for file_name in removed + rule_removed:
+        console.print(f"\t🗑️  removed stale script {file_name}.")
+
+
+def render_json(console, args, contexts, services: Services, delta=None):
+    """Write the services and the vips and policies Terraform JSON files, no templates involved."""
+    from tfjson import dstnat_document, services_document, write_document  # pylint: disable=C0415
+
+    if args.cache is not None:
+        console.print("⚠️  the cache isn't used with --output-format terraform-json.")
+
+    # the HCL files declare the same objects with other resource names
+    for hcl_file in (f"{args.output_basename}-services.tf", f"{args.output_basename}.tf"):
+        if os.path.isfile(hcl_file):
+            console.print(f"⚠️  {hcl_file} declares the same objects, remove it before applying the .tf.json files.")
+
+    console.print(f"🧾 generating services file [bold]{args.output_basename}-services.tf.json[/bold] file.")
+
+    services_output = OutputFile(args.output_basename + "-services.tf.json")
+    with services_output as services_json:
+        write_document(services_json, services_document(services))
+    print_unchanged(console, services_output)
+
+    if args.aggregate_policies:
+        (vips, policies) = aggregate_policies(contexts, args, () if delta is None else delta.policy_names)
+    else:
+        vips = []
+        policies = []
+        for (vip, policy) in contexts:
+            if vip is not None:
+                vips.append(vip)
+            policies.append(policy)
+
+    console.print(f"🧾 generating policies and vips file [bold]{args.output_basename}.tf.json[/bold] file.")
+    console.print(f"\t🗂️  {len(vips)} VIPs in {len(policies)} policies.")
+
+    output = OutputFile(args.output_basename + ".tf.json")
+    with output as output_json:
+        write_document(output_json, dstnat_document(vips, policies, services))
+    print_unchanged(console, output)
+
+
+def print_delta(console, delta):
+    """Print what was reused from the --against configuration, nothing without one."""
+    if delta is None:
+        return
+
+    console.print(
+        f"\t🔁 against backup: {delta.vips} existing VIP(s) and {delta.policies} existing policies reused, "
+        f"{delta.renamed} object(s) renamed to avoid existing names."
+    )
+
+
+def print_unchanged(console, output: OutputFile):
+    """Tell when an output file was left alone because its contents didn't change."""
+    if not output.changed:
+        console.print(f"\t⏸️  [bright_black]{output.file_name} unchanged, not rewritten.[/bright_black]")
+
+
+def open_cache(console, args, dstnat_template):
+    """Open the render cache if it was asked for and the template can use it, None if it can't."""
+    if args.cache is None:
+        return None
+
+    import glob  # pylint: disable=C0415
+    import sqlite3  # pylint: disable=C0415
+    from cache import RenderCache, cacheable, fingerprint  # pylint: disable=C0415
+
+    if not cacheable(dstnat_template):
+        console.print("⚠️  the dstnat template renders the rules together, not using the cache.")
+        return None
+
+    cache_fingerprint = fingerprint(sorted(glob.glob(f"{TEMPLATES_PATH}{os.sep}*.j2")) + [DEFAULT_SERVICES_FILE])
+
+    try:
+        render_cache = RenderCache(args.cache, cache_fingerprint, args.cache_size * 1024 * 1024)
+    except (OSError, sqlite3.Error) as e:
+        console.print(f"⚠️  can't open the cache in '{args.cache}', not using it: {e}")
+        return None
+
+    if render_cache.invalidated:
+        console.print("\t♻️  templates or default services changed, cache emptied.")
+
+    return render_cache
+
+
+def run(args, console, preloaded: dict | None = None) -> dict:
+    """Convert a single input, with timings and profiling if they were asked for, and return its summary."""
+    console.print(f"[bold][green]input file[/green][/bold]: {args.input}")
+    console.print(f"[bold][green]input file format[/green][/bold]: {args.input_format}")
+    console.print(f"[bold][green]output filename base[/green][/bold]: {args.output_basename}")
+
+    run_timings = timings.Timings()
+    profile_file = timings.profile_file_name(args.profile, args.output_basename) if args.profile else None
+
+    with timings.profile(args.profile, profile_file):
+        summary = convert(args, console, run_timings, preloaded)
+
+    if profile_file is not None:
+        console.print(f"🧾 {args.profile} profile written to [bold]{profile_file}[/bold].")
+
+    if args.timings is not None:
+        timings_file = args.timings or f"{args.output_basename}-timings.json"
+        console.print("\n[bold]timings[/bold]:")
+        for line in run_timings.summary():
+            console.print(f"\t{line}")
+        run_timings.write(timings_file)
+        console.print(f"🧾 timings written to [bold]{timings_file}[/bold].")
+
+    return summary
+
+
+def convert(args, console, run_timings, preloaded: dict | None = None) -> dict:
+    """Convert the input file, every stage is timed in run_timings.
+
+    preloaded has the default services and the templates when they're
+    loaded once for many inputs (batch mode), services are copied so every
+    input numbers its own.
+    """
+    # init
+    network_map = NetworkMap(allow_nested=args.allow_nested_networks)
+    interface_map = InterfaceMap()
+
+    abort = False
+
+    if args.default_internal:
+        console.print(f"[bold][cyan]default internal interface[/cyan][/bold]: {args.default_internal}")
+
+    if args.default_external:
+        console.print(f"[bold][cyan]default external interface[/cyan][/bold]: {args.default_external}")
+
+    if args.map_network:
+        console.print("[bold]network to interface map[/bold]:")
+        for map_spec in args.map_network:
+            tokens = map_spec.split(":")
+            if len(tokens) != 2:
+                console.print(f"⛔ [bold]invalid spec '{map_spec}'")
+                abort = True
+            else:
+                try:
+                    network_map.add(tokens[0], tokens[1])
+                    console.print(f"\t 🛜  {tokens[0]} => {tokens[1]}")
+                except ValueError as e:
+                    console.print(f"⛔ [bold]invalid spec '{map_spec}':[/bold] {e}")
+                    abort = True
+
+    if args.map_network_file:
+        for map_file_name in args.map_network_file:
+            try:
+                with open(map_file_name, encoding="utf-8") as map_file:
+                    map_count = network_map.load(map_file)
+                console.print(f"[bold]network to interface map[/bold]: {map_count} network(s) loaded from '{map_file_name}'")
+            except (OSError, ValueError) as e:
+                console.print(f"⛔ [bold]invalid network map file '{map_file_name}':[/bold] {e}")
+                abort = True
+
+    if args.map_interface:
+        console.print("[bold]interface to interface map[/bold]:")
+        for map_spec in args.map_interface:
+            tokens = map_spec.split(":")
+            if len(tokens) != 2:
+                console.print(f"⛔ [bold]invalid spec '{map_spec}'")
+                abort = True
+            else:
+                try:
+                    interface_map.add(tokens[0], tokens[1])
+                    console.print(f"\t ⏩ {tokens[0]} => {tokens[1]}")
+                except ValueError as e:
+                    console.print(f"⛔ [bold]invalid spec '{map_spec}':[/bold] {e}")
+                    abort = True
+
+    if args.input_format not in INPUT_FORMATS:
+        console.print(f"⛔ [bold]input format '{args.input_format}' isn't supported yet.")
+        abort = True
+
+    if abort:
+        sys.exit(-1)
+
+    if not os.path.isfile(args.input):
+        console.print(f"⛔ [bold]invalid input file '{args.input}', aborting.")
+        sys.exit(-1)
+
+    output_name = args.output_basename + OUTPUT_FORMATS[args.output_format]
+    # outputs are written to a temporary file renamed over the old one, the directory must be writable
+    output_dir = os.path.dirname(output_name) or "."
+    if not os.access(output_dir, os.W_OK):
+        console.print(f"⛔ [bold]can't create output file '{output_name}', aborting:[/bold] '{output_dir}' isn't a writable directory")
+        sys.exit(-1)
+
+    # load port to default services map
+    with run_timings.stage("load services"):
+        if preloaded is None:
+            services = load_services(DEFAULT_SERVICES_FILE)
+        else:
+            services = copy.deepcopy(preloaded["services"])
+
+    if services is not None:
+        console.print("📃 loading [bold]default services[/bold] file.")
+    else:
+        console.print("⚠️ no [bold]default services[/bold] file found.")
+        services = Services()
+
+    delta = None
+    if args.against is not None:
+        from delta import Delta  # pylint: disable=C0415
+
+        try:
+            with run_timings.stage("against"):
+                delta = Delta.load(args.against, args.against_vdom)
+        except (OSError, KeyError) as e:
+            console.print(f"⛔ [bold]can't read configuration '{args.against}', aborting:[/bold] {e}")
+            sys.exit(-1)
+
+        console.print(
+            f"📃 loading [bold]{args.against}[/bold]: {len(delta.existing_vips)} VIP(s), "
+            f"{delta.add_services(services)} custom service(s) reused."
+        )
+
+    with run_timings.stage("parse") as stage:
+        nat_rules = read_rules(args.input, args.input_format, network_map, args.jobs, interface_map)
+        stage["rules"] = len(nat_rules)
+
+    parsed_rules = len(nat_rules)
+
+    if args.coalesce_vips:
+        from coalesce import coalesce_rules  # pylint: disable=C0415
+
+        with run_timings.stage("coalesce", len(nat_rules)):
+            (nat_rules, rule_members) = coalesce_rules(nat_rules)
+
+        print_coalesced(console, rule_members)
+
+    with run_timings.stage("map", len(nat_rules)):
+        (rule_services, rules_display) = prepare_rules(nat_rules, services, args)
+
+    # validate all the rules at once, every output reads this table
+    with run_timings.stage("validate", len(nat_rules)):
+        from ruletable import RuleTable  # pylint: disable=C0415
+
+        rule_table = RuleTable(nat_rules)
+        rule_issues = dict(rule_table.rule_issues())
+
+    with run_timings.stage("display", len(nat_rules)):
+        print_rules(console, nat_rules, rule_table, rules_display, rule_issues, not args.no_table)
+
+    if len(rule_issues) != 0:
+        if not args.ignore_issues:
+            console.print("⛔  issues found, aborting.")
+            sys.exit(-1)
+
+        console.print("⚠️  ignoring issues.")
+
+    # report output
+    if not args.no_report:
+        from report import write_report  # pylint: disable=C0415
+
+        console.print(f"🧾 generating {args.report_format} report.")
+
+        try:
+            with run_timings.stage("report", len(nat_rules)):
+                report_files = write_report(args.report_format, args.output_basename, nat_rules, rule_services, rule_issues, services)
+            for report_file in report_files:
+                console.print(f"\t🧾 [bold]{report_file}[/bold]")
+        except ImportError as e:
+            console.print(f"⚠️  can't write {args.report_format} report: {e}")
+
+    with run_timings.stage("render", len(nat_rules)):
+        render(console, args, nat_rules, rule_table, rule_services, services,
+               None if preloaded is None else preloaded["templates"], delta)
+
+    return {
+        "rules": parsed_rules,
+        "issues": len(rule_issues),
+        "vips": sum(1 for (ix, nat_rule) in enumerate(nat_rules) if rule_table.valid[ix] and nat_rule.protocol.id in [6,17]),
+        "services": sum(1 for service in services.services.values() if not service["built_in"])
+    }
+
+
+# batch inputs by file extension, files without one use --input-format
+BATCH_EXTENSIONS = {
+    ".iptables": "iptables",
+    ".ipt": "iptables",
+    ".rsc": "mikrotik",
+    ".csv": "csv"
+}
+
+# csv reports written by a previous run aren't inputs
+BATCH_SKIP_SUFFIXES = ("-dstnat.csv", "-issues.csv", "-services.csv")
+
+# default services and templates, loaded once per batch worker
+BATCH_WORKER = {}
+
+
+def manifest_argv(job: dict) -> list:
+    """Convert a manifest job (option names without dashes) to command line arguments."""
+    argv = []
+    for (option, value) in job.items():
+        option = "--" + option.replace("_", "-")
+        if value is True:
+            argv.append(option)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            for item in value:
+                argv.extend((option, str(item)))
+        else:
+            argv.extend((option, str(value)))
+
+    return argv
+
+
+def batch_jobs(args) -> list:
+    """Command line arguments of every batch input.
+
+    A directory converts its files by extension, output files go next to the
+    inputs or to --output-basename. A JSON manifest is a list of jobs with the
+    same options as the command line (ex.: {"input": "site1.rsc", "input-format":
+    "mikrotik", "output-basename": "site1", "map-network": ["10.0.0.0/8:lan"]}),
+    paths relative to the manifest. Options given with --batch apply to every job.
+    """
+    jobs = []
+
+    if os.path.isdir(args.batch):
+        output_dir = args.output_basename or args.batch
+        inputs = []
+        for file_name in sorted(os.listdir(args.batch)):
+            (name, extension) = os.path.splitext(file_name)
+            input_format = BATCH_EXTENSIONS.get(extension.casefold(), args.input_format if extension == "" else None)
+
+            if input_format is not None and os.path.isfile(os.path.join(args.batch, file_name)) and not file_name.endswith(BATCH_SKIP_SUFFIXES):
+                inputs.append((file_name, name, extension, input_format))
+
+        names = [name for (_, name, _, _) in inputs]
+        for (file_name, name, extension, input_format) in inputs:
+            # site.csv and site.rsc can't both write site.tf
+            if names.count(name) > 1:
+                name += "-" + extension[1:]
+
+            jobs.append([
+                "--input", os.path.join(args.batch, file_name),
+                "--input-format", input_format,
+                "--output-basename", os.path.join(output_dir, name)
+            ])
+    else:
+        manifest_dir = os.path.dirname(os.path.abspath(args.batch))
+        with open(args.batch, encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+
+        if not isinstance(manifest, list):
+            raise ValueError(f"batch_jobs(): manifest '{args.batch}' must be a list of jobs")
+
+        for job in manifest:
+            for option in ("input", "output-basename", "output_basename", "map-network-file", "map_network_file", "against"):
+                if option in job:
+                    paths = job[option] if isinstance(job[option], list) else [job[option]]
+                    paths = [os.path.join(manifest_dir, path) for path in paths]
+                    job[option] = paths if isinstance(job[option], list) else paths[0]
+
+            jobs.append(manifest_argv(job))
+
+    return jobs
+
+
+def init_batch_worker():
+    """Load the default services and the templates once per worker process."""
+    BATCH_WORKER["services"] = load_services(DEFAULT_SERVICES_FILE)
+    BATCH_WORKER["templates"] = load_templates()
+
+
+def run_batch_job(args) -> dict:
+    """Convert a batch input, the console output goes to OUTPUT_BASENAME.log."""
+    from rich.console import Console  # pylint: disable=C0415
+
+    result = {
+        "input": args.input,
+        "input_format": args.input_format,
+        "output_basename": args.output_basename,
+        "status": "ok"
+    }
+    started = time.perf_counter()
+
+    try:
+        log_file = open(args.output_basename + ".log", "w", encoding="utf-8")  # pylint: disable=R1732
+    except OSError as e:
+        # without a log the error goes to the summary
+        result["status"] = "error"
+        result["error"] = str(e)
+        log_file = None
+
+    if log_file is not None:
+        with log_file:
+            console = Console(file=log_file, width=160, emoji_variant="emoji", tab_size=2, highlighter=None)
+            try:
+                result.update(run(args, console, BATCH_WORKER))
+            except SystemExit:
+                result["status"] = "aborted"
+            except Exception as e:  # pylint: disable=W0718
+                console.print(f"⛔ [bold]error:[/bold] {e}")
+                result["status"] = "error"
+
+    result["seconds"] = round(time.perf_counter() - started, 3)
+
+    return result
+
+
+def run_batch(args, console):
+    """Convert every batch input in a pool of worker processes and print a summary."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed  # pylint: disable=C0415
+    from rich.table import Table  # pylint: disable=C0415
+
+    parser = build_parser()
+    try:
+        jobs = [parser.parse_args(job_argv, namespace=copy.copy(args)) for job_argv in batch_jobs(args)]
+    except (OSError, ValueError) as e:
+        console.print(f"⛔ [bold]invalid batch '{args.batch}':[/bold] {e}")
+        sys.exit(-1)
+
+    for job in jobs:
+        # the report has every rule, logs only get the ones with issues
+        job.batch = None
+        job.no_table = True
+        if job.input is None or job.input_format is None or job.output_basename is None:
+            console.print(f"⛔ [bold]batch job without input, input format or output basename:[/bold] {job.input}")
+            sys.exit(-1)
+
+    # ex.: --batch DIR --output-basename NEWDIR/
+    for directory in sorted({os.path.dirname(job.output_basename) for job in jobs} - {""}):
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            console.print(f"⛔ [bold]can't create output directory '{directory}':[/bold] {e}")
+            sys.exit(-1)
+
+    console.print(f"[bold][green]batch[/green][/bold]: {len(jobs)} input(s) from '{args.batch}', {args.workers} worker(s)\n")
+
+    started = time.perf_counter()
+    results = [None] * len(jobs)
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_batch_worker) as executor:
+        futures = {executor.submit(run_batch_job, job): ix for (ix, job) in enumerate(jobs)}
+        for future in as_completed(futures):
+            job = jobs[futures[future]]
+            try:
+                result = future.result()
+            except Exception as e:  # pylint: disable=W0718
+                # the worker died or the result couldn't be sent back, the other jobs go on
+                result = {
+                    "input": job.input,
+                    "input_format": job.input_format,
+                    "output_basename": job.output_basename,
+                    "status": "error",
+                    "error": str(e),
+                    "seconds": 0.0
+                }
+
+            results[futures[future]] = result
+            status = "✅" if result["status"] == "ok" else "⛔"
+            error = f": {result['error']}" if "error" in result else ""
+            console.print(f"\t{status} {result['input']} ({result['seconds']:.2f}s){error}")
+
+    elapsed = time.perf_counter() - started
+
+    summary_table = Table(title="Batch summary")
+    for column in ("#", "input", "format", "status", "rules", "vips", "services", "issues", "seconds"):
+        summary_table.add_column(column, justify="right" if column in ("rules", "vips", "services", "issues", "seconds") else "left")
+
+    for (ix, result) in enumerate(results):
+        summary_table.add_row(
+            str(ix + 1),
+            result["input"],
+            result["input_format"],
+            result["status"] if result["status"] == "ok" else f"[red]{result['status']}[/red]",
+            str(result.get("rules", "")),
+            str(result.get("vips", "")),
+            str(result.get("services", "")),
+            str(result.get("issues", "")),
+            f"{result['seconds']:.2f}"
+        )
+
+    total_rules = sum(result.get("rules", 0) for result in results)
+    summary_table.add_section()
+    summary_table.add_row(
+        "", "total", "", "", str(total_rules),
+        str(sum(result.get("vips", 0) for result in results)),
+        str(sum(result.get("services", 0) for result in results)),
+        str(sum(result.get("issues", 0) for result in results)),
+        f"{elapsed:.2f}"
+    )
+
+    console.print(summary_table)
+    console.print(f"{total_rules / elapsed:,.0f} rules/s, every input has its log in OUTPUT_BASENAME.log")
+
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(-1)
+
+
+def main():
+    """Entry point."""
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if args.batch is None:
+        missing = [option for option in ("input", "input_format", "output_basename") if getattr(args, option) is None]
+        if missing:
+            parser.error("the following arguments are required: " + ", ".join("--" + option.replace("_", "-") for option in missing))
+
+    if args.policy_members < 1:
+        parser.error("--policy-members must be at least 1")
+
+    if args.cli_chunk < 0:
+        parser.error("--cli-chunk can't be negative")
+
+    from rich.console import Console  # pylint: disable=C0415
+
+    console = Console(emoji_variant="emoji", tab_size=2, highlighter=None)
+    console.print("[yellow][bold]dstnat2tf[/bold] Convert destination NAT rules to a FortiGate Terraform template.\n")
+
+    if args.batch is not None:
+        run_batch(args, console)
+    else:
+        run(args, console)
+
+    console.print("👍 done.")
+
+
+if __name__ == "__main__":
+    main()
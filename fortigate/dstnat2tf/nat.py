@@ -3,49 +3,82 @@ import ipaddress
 import logging
 import re
 import shlex
+import bisect
 import csv
-from collections import defaultdict
-from io import StringIO
-from validation import valid_ip, valid_network
+import hashlib
+import io
+import mmap
+import os
+from itertools import repeat, takewhile
+from validation import valid_network
+
+RX_PORTRANGE = re.compile(r"(?P<from>\d+)([-:](?P<to>\d+))?")
+RX_IPV4 = re.compile(r"(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)")
+
+
+def ip_to_int(ip_address: str) -> int | None:
+    """Convert a dotted IPv4 address to an integer, None if it's invalid."""
+    if (m := RX_IPV4.fullmatch(ip_address)) is None:
+        return None
+
+    (a, b, c, d) = m.groups()
+    return (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+
 
 class PortRange:
-    """Port Range class."""
+    """Port Range class, immutable and interned by spec and ports."""
 
-    def __init__(self, spec: str | None = None):
+    __slots__ = ("start", "end")
+
+    interned = {}
+
+    def __new__(cls, spec: str | None = None):
         """Create port range from start-end."""
-        self.start = None
-        self.end = None
+        if (port_range := cls.interned.get(spec)) is not None:
+            return port_range
 
-        if spec is not None and spec != "":
-            self.set(spec)
+        (start, end) = (None, None) if spec is None or spec == "" else cls.parse(spec)
+        port_range = cls.from_ports(start, end)
+        cls.interned[spec] = port_range
 
-    def set(self, spec: str):
-        """Set start and end port range using START-END or START:END as format."""
-        if spec is None or spec == "":
-            self.start = None
-            self.end = None
-            return
+        return port_range
+
+    @classmethod
+    def from_ports(cls, start: int | None, end: int | None):
+        """Create a port range from integer start and end ports."""
+        if (port_range := cls.interned.get((start, end))) is not None:
+            return port_range
+
+        port_range = object.__new__(cls)
+        object.__setattr__(port_range, "start", start)
+        object.__setattr__(port_range, "end", end)
+        cls.interned[(start, end)] = port_range
+
+        return port_range
 
-        rx_portrange = re.compile(r"^(?P<from>\d+)([-:](?P<to>\d+))?$")
-        if (m := rx_portrange.fullmatch(spec)) is not None:
+    @staticmethod
+    def parse(spec: str) -> tuple:
+        """Parse START-END or START:END and return (start, end)."""
+        if (m := RX_PORTRANGE.fullmatch(spec)) is not None:
             from_port = int(m.group("from"))
             if from_port < 65536:
-                self.start = from_port
+                if m.group("to") is None:
+                    return (from_port, from_port)
 
-                if m.group("to") is not None:
-                    to_port = int(m.group("to"))
-                    if to_port <= 65535:
-                        self.end = to_port
-                        if to_port < from_port:
-                            (self.end, self.start) = (from_port, to_port)
-
-                        return
-                else:
-                    self.end = self.start
-                    return
+                to_port = int(m.group("to"))
+                if to_port <= 65535:
+                    return (to_port, from_port) if to_port < from_port else (from_port, to_port)
 
         raise ValueError(f"invalid port range \"{spec}\".")
 
+    def __setattr__(self, name, value):
+        """Port ranges are immutable."""
+        raise AttributeError("PortRange is immutable")
+
+    def __reduce__(self):
+        """Pickle as integer ports."""
+        return (PortRange.from_ports, (self.start, self.end))
+
     def __repr__(self):
         """Repr."""
         if self.start is None:
@@ -82,26 +115,37 @@ class PortRange:
 
     def __hash__(self):
         """__hash__."""
-        return hash(self.__repr__())
+        return hash((self.start, self.end))
 
 
 class IPRange:
-    """Class for handling IP address ranges."""
-    def __init__(self, spec: str | None = None):
-        """Init."""
-        self.start_ip = None
-        self.end_ip = None
-        self.any = False
+    """Class for handling IP address ranges, immutable and backed by integers."""
 
-        if spec is not None:
-            self.set(spec)
+    __slots__ = ("start", "end", "any")
 
-    def set(self, spec: str):
-        """Set the IP range using START_IP-END_IP, IP/MASK or 'any'."""
+    def __init__(self, spec: str | None = None):
+        """Init."""
+        (start, end, any_address) = (None, None, False) if spec is None else self.parse(spec)
+        object.__setattr__(self, "start", start)
+        object.__setattr__(self, "end", end)
+        object.__setattr__(self, "any", any_address)
+
+    @classmethod
+    def from_ints(cls, start: int | None, end: int | None, any_address: bool = False):
+        """Create an IP range from integer start and end addresses."""
+        ip_range = object.__new__(cls)
+        object.__setattr__(ip_range, "start", start)
+        object.__setattr__(ip_range, "end", end)
+        object.__setattr__(ip_range, "any", any_address)
+
+        return ip_range
+
+    @staticmethod
+    def parse(spec: str) -> tuple:
+        """Parse START_IP-END_IP, IP/MASK or 'any' and return (start, end, any)."""
         spec = spec.strip().casefold()
-        if spec == "any" or spec.strip() == "0.0.0.0":
-            self.any = True
-            return
+        if spec == "any" or spec == "0.0.0.0":
+            return (None, None, True)
 
         if spec.find("/") != -1:
             # cidr format
@@ -112,34 +156,56 @@ class IPRange:
 
             if ip_network.prefixlen == 0:
                 # 0.0.0.0/0
-                self.any = True
-                return
+                return (None, None, True)
 
-            self.start_ip = ip_network.network_address
-            self.end_ip = ip_network.broadcast_address
-            self.any = False
-        else:
-            self.any = False
-            tokens = spec.split("-",maxsplit=1)
+            return (int(ip_network.network_address), int(ip_network.broadcast_address), False)
+
+        tokens = spec.split("-",maxsplit=1)
+
+        if (start := ip_to_int(tokens[0])) is None:
+            raise ValueError(f"invalid IP range '{spec}'")
+
+        if len(tokens) == 1:
+            return (start, start, False)
 
-            self.start_ip = valid_ip(tokens[0])
-            if not self.start_ip:
-                raise ValueError(f"invalid IP range '{spec}'")
+        if (end := ip_to_int(tokens[1])) is None:
+            raise ValueError(f"invalid IP range '{spec}'")
 
-            if len(tokens)==2:
-                self.end_ip = valid_ip(tokens[1])
-                if not self.end_ip:
-                    raise ValueError(f"invalid IP range '{spec}'")
+        return (end, start, False) if end < start else (start, end, False)
+
+    def __setattr__(self, name, value):
+        """IP ranges are immutable."""
+        raise AttributeError("IPRange is immutable")
+
+    def __reduce__(self):
+        """Pickle as integer addresses."""
+        return (IPRange.from_ints, (self.start, self.end, self.any))
+
+    @property
+    def start_ip(self) -> ipaddress.IPv4Address | None:
+        """First address of the range."""
+        return ipaddress.IPv4Address(self.start) if self.start is not None else None
+
+    @property
+    def end_ip(self) -> ipaddress.IPv4Address | None:
+        """Last address of the range."""
+        return ipaddress.IPv4Address(self.end) if self.end is not None else None
 
     def __repr__(self):
         """Repr."""
         if self.any:
             return "0.0.0.0"
 
-        if self.end_ip is not None and self.start_ip != self.end_ip:
-            return f"{self.start_ip}-{self.end_ip}"
+        if self.start is None:
+            return "None"
+
+        start = self.start
+        start_ip = f"{start >> 24}.{(start >> 16) & 255}.{(start >> 8) & 255}.{start & 255}"
+        if self.start == self.end:
+            return start_ip
 
-        return str(self.start_ip)
+        end = self.end
+        return f"{start_ip}-{end >> 24}.{(end >> 16) & 255}.{(end >> 8) & 255}.{end & 255}"
 
     def __str__(self):
         """Str."""
@@ -150,13 +216,21 @@ class IPRange:
         if self.any:
             return 4294967296
 
-        if self.start_ip is None:
+        if self.start is None:
             return 0
 
-        if self.end_ip is None:
-            return 1
+        return self.end - self.start + 1
+
+    def __eq__(self, other):
+        """Equality operator."""
+        if not isinstance(other, IPRange):
+            return NotImplemented
+
+        return self.any == other.any and self.start == other.start and self.end == other.end
 
-        return abs(int(self.start_ip)-int(self.end_ip))+1
+    def __hash__(self):
+        """__hash__."""
+        return hash((self.any, self.start, self.end))
 
 
 class InterfaceMap:
@@ -188,11 +262,14 @@ class InterfaceMap:
 
 
 class NetworkMap:
-    """Network Map,"""
+    """Network Map, longest prefix match on a binary trie keyed by integer addresses."""
 
-    def __init__(self):
+    def __init__(self, allow_nested: bool = False):
         """Init."""
         self.network_map = {}
+        self.allow_nested = allow_nested
+        # trie nodes are [zero child, one child, (network, interface) or None]
+        self.root = [None, None, None]
 
     def add(self, network: str, interface: str):
         """Add a network to interface mapping."""
@@ -204,11 +281,23 @@ class NetworkMap:
         if network_object in self.network_map:
             raise ValueError(f"duplicate network {network_object}")
 
-        # overlap test
-        for network in self.network_map:
-            if network.overlaps(network_object):
-                raise ValueError(f"network {network_object} overlaps with {network}")
+        address = int(network_object.network_address)
+        node = self.root
+        for depth in range(network_object.prefixlen):
+            # overlap test: a shorter prefix already covers this network
+            if node[2] is not None and not self.allow_nested:
+                raise ValueError(f"network {network_object} overlaps with {node[2][0]}")
+
+            bit = (address >> (31 - depth)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
 
+        # overlap test: this network covers a longer prefix
+        if (node[0] is not None or node[1] is not None) and not self.allow_nested:
+            raise ValueError(f"network {network_object} overlaps with {self._first_below(node)}")
+
+        node[2] = (network_object, interface)
         self.network_map[network_object] = interface
 
         logging.debug(
@@ -219,21 +308,70 @@ class NetworkMap:
 
         return (network_object, interface)
 
-    def lookup(self, ip_address: str) -> str | None:
-        """Lookup a network to interface mapping."""
-        if (ip_object := valid_ip(ip_address)) is False:
-            return None
-            #raise ValueError(f"'{ip_address}' is not a valid ip address")
+    @staticmethod
+    def _first_below(node: list):
+        """Return the first network stored below a trie node."""
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if node[2] is not None:
+                return node[2][0]
+            pending.extend(child for child in node[:2] if child is not None)
+
+        return None
+
+    def load(self, map_file) -> int:
+        """Bulk load PREFIX:INTERFACE lines from an open file, return the number of mappings added."""
+        count = 0
+        for line_number, line in enumerate(map_file, start=1):
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+
+            tokens = line.split(":")
+            if len(tokens) != 2:
+                raise ValueError(f"line {line_number}: invalid spec '{line}'")
+
+            try:
+                self.add(tokens[0].strip(), tokens[1].strip())
+            except ValueError as e:
+                raise ValueError(f"line {line_number}: {e}") from e
 
-        for (network, interface) in self.network_map.items():
-            if ip_object in network:
+            count += 1
+
+        return count
+
+    def lookup(self, ip_address) -> str | None:
+        """Lookup a network to interface mapping, ranges must fit in a single network."""
+        if isinstance(ip_address, IPRange):
+            if ip_address.any:
+                (start, end) = (0, 0xFFFFFFFF)
+            elif ip_address.start is None:
+                return None
+            else:
+                (start, end) = (ip_address.start, ip_address.end)
+        else:
+            if (start := ip_to_int(str(ip_address))) is None:
+                return None
+            end = start
+
+        node = self.root
+        interface = None
+        for depth in range(32):
+            if node[2] is not None:
+                interface = node[2][1]
+
+            bit = (start >> (31 - depth)) & 1
+            if bit != (end >> (31 - depth)) & 1 or (node := node[bit]) is None:
                 return interface
 
-        return None
+        return node[2][1] if node[2] is not None else interface
 
 
 class Protocol:
-    """Protocol Specification."""
+    """Protocol Specification, immutable and interned by name."""
+
+    __slots__ = ("name", "id", "support_ports")
 
     name_to_number = {
         "ah": 51,
@@ -244,28 +382,38 @@ class Protocol:
         "udp": 17
     }
 
-    def __init__(self, protocol_spec: str | None = None):
-        """Init."""
+    interned = {}
 
-        self.name = None
-        self.id = None
-        self.support_ports = None
+    def __new__(cls, protocol_spec: str | None = None):
+        """Return the protocol instance for a protocol name."""
+        if (protocol := cls.interned.get(protocol_spec)) is not None:
+            return protocol
 
+        name = None
         if protocol_spec is not None:
-            self.set(protocol_spec)
-
-    def set(self, protocol_spec: str):
-        """Set the protocol value."""
-        protocol_spec = protocol_spec.strip().casefold()
-        if protocol_spec not in self.name_to_number:
-            raise ValueError(f"unsupported protocol '{protocol_spec}'")
-
-        self.name = protocol_spec
-        self.id = self.name_to_number[protocol_spec]
-        if protocol_spec in ["tcp", "udp"]:
-            self.support_ports = True
-        else:
-            self.support_ports = False
+            name = protocol_spec.strip().casefold()
+            if name not in cls.name_to_number:
+                raise ValueError(f"unsupported protocol '{name}'")
+
+            if name != protocol_spec:
+                protocol = cls.interned[protocol_spec] = cls(name)
+                return protocol
+
+        protocol = object.__new__(cls)
+        object.__setattr__(protocol, "name", name)
+        object.__setattr__(protocol, "id", cls.name_to_number[name] if name is not None else None)
+        object.__setattr__(protocol, "support_ports", name in ["tcp", "udp"] if name is not None else None)
+        cls.interned[protocol_spec] = protocol
+
+        return protocol
+
+    def __setattr__(self, name, value):
+        """Protocols are immutable."""
+        raise AttributeError("Protocol is immutable")
+
+    def __reduce__(self):
+        """Pickle as the interned instance."""
+        return (Protocol, (self.name,))
 
     def __str__(self):
         """__str__."""
@@ -279,18 +427,37 @@ class Protocol:
         return ''
 
 
+ANY_ADDRESS = IPRange("any")
+NO_ADDRESS = IPRange()
+
+
 class NATRule:
     """NAT Specification."""
+
+    __slots__ = (
+        "external_interface",
+        "external_address",
+        "internal_interface",
+        "internal_address",
+        "protocol",
+        "external_ports",
+        "internal_ports",
+        "comment",
+        "unmapped_interface"
+    )
+
     def __init__(self):
         """Init."""
         self.external_interface = None
-        self.external_address = IPRange("any")
+        self.external_address = ANY_ADDRESS
         self.internal_interface = None
-        self.internal_address = IPRange()
+        self.internal_address = NO_ADDRESS
         self.protocol = Protocol()
         self.external_ports = PortRange()
         self.internal_ports = PortRange()
         self.comment = None
+        # input interface of the source device without a --map-interface target
+        self.unmapped_interface = None
 
     def __repr__(self):
         """Repr."""
@@ -330,6 +497,9 @@ class NATRule:
         if self.external_interface is None:
             problems.append("no external interface")
 
+        if self.unmapped_interface is not None:
+            problems.append(f"no --map-interface for interface {self.unmapped_interface}")
+
         if self.internal_interface is None:
             problems.append("no internal interface")
 
@@ -362,13 +532,124 @@ class NATRule:
         """Validate NAT rule."""
         return len(self.diagnose())==0
 
+    def key(self) -> str:
+        """Canonical key of what the rule translates: protocol, external and mapped addresses and ports."""
+        return "|".join((
+            self.protocol.name,
+            str(self.external_address),
+            str(self.external_ports),
+            str(self.internal_address),
+            str(self.internal_ports)
+        ))
+
+
+# hex digits of a content derived name are twice this
+NAME_HASH_SIZE = 5
+
+
+def name_hash(key: str) -> str:
+    """Short hash of a canonical key, for names that don't depend on the rule order."""
+    return hashlib.blake2b(key.encode(), digest_size=NAME_HASH_SIZE).hexdigest()
+
+
+def unique_name(name: str, taken) -> str:
+    """Name, or name-2, name-3... the first one that isn't in taken."""
+    candidate = name
+    suffix = 2
+    while candidate in taken:
+        candidate = f"{name}-{suffix}"
+        suffix += 1
+
+    return candidate
+
+
+class PortIndex:
+    """Port ranges of one protocol, answers exact and containing range queries."""
+
+    def __init__(self):
+        """Init."""
+        self.exact = {}
+        self.single_range = set()
+        self.intervals = []
+        self.starts = []
+        self.tree = None
+
+    def add(self, port_range: PortRange, name: str, single_range: bool, containing: bool = True):
+        """Index a service port range, only for exact queries if not containing."""
+        key = (port_range.start, port_range.end)
+        # a service that has only this range wins over one where it's one of many
+        if key not in self.exact or (single_range and key not in self.single_range):
+            self.exact[key] = name
+            if single_range:
+                self.single_range.add(key)
+
+        if not containing:
+            return
+
+        interval = (port_range.start, port_range.end, len(self.intervals), name)
+        position = bisect.bisect_right(self.starts, port_range.start)
+        self.intervals.insert(position, interval)
+        self.starts.insert(position, port_range.start)
+        self.tree = None
+
+    def containing(self, start: int, end: int) -> str | None:
+        """Return the service with the tightest range containing start-end, first added on ties."""
+        if self.tree is None:
+            self.tree = self._build(self.intervals)
+
+        best = None
+        node = self.tree
+        while node is not None:
+            (center, by_start, by_end, left, right) = node
+            if start < center:
+                candidates = takewhile(lambda interval: interval[0] <= start, by_start)
+                node = left
+            else:
+                candidates = takewhile(lambda interval: interval[1] >= start, by_end)
+                node = right
+
+            for interval in candidates:
+                if interval[1] >= end:
+                    rank = (interval[1] - interval[0], interval[2])
+                    if best is None or rank < best[0]:
+                        best = (rank, interval[3])
+
+        return best[1] if best is not None else None
+
+    @classmethod
+    def _build(cls, intervals: list):
+        """Build a centered interval tree, nodes are (center, by start, by end desc, left, right)."""
+        if not intervals:
+            return None
+
+        center = intervals[len(intervals) // 2][0]
+        here = [interval for interval in intervals if interval[0] <= center <= interval[1]]
+
+        return (
+            center,
+            here,
+            sorted(here, key=lambda interval: -interval[1]),
+            cls._build([interval for interval in intervals if interval[1] < center]),
+            cls._build([interval for interval in intervals if interval[0] > center])
+        )
+
 
 class Services():
     """TCP/UDP Services Class."""
     def __init__(self):
         self.services  = {}
-        self.tcp_portrange_to_service = defaultdict(lambda: None)
-        self.udp_portrange_to_service = defaultdict(lambda: None)
+        self.port_index = {
+            "tcp": PortIndex(),
+            "udp": PortIndex()
+        }
+
+    @staticmethod
+    def port_ranges(portrange_spec: str | None) -> list:
+        """Parse a comma separated list of port ranges."""
+        if portrange_spec is None or portrange_spec == "":
+            return []
+
+        return [PortRange(portrange) for portrange in portrange_spec.split(',')]
 
     def add(
             self,
@@ -381,27 +662,23 @@ class Services():
         if name in self.services:
             raise KeyError(f"service {name} already on the list.")
 
+        tcp_portranges = self.port_ranges(tcp_portrange)
+        udp_portranges = self.port_ranges(udp_portrange)
+
         self.services[name] = {
-            "tcp-portranges": [],
-            "udp-portranges": [],
+            "tcp-portranges": tcp_portranges,
+            "udp-portranges": udp_portranges,
             "built_in": built_in
         }
 
-        if tcp_portrange is not None and tcp_portrange != "":
-            for portrange in tcp_portrange.split(','):
-                port_range = PortRange(portrange)
-                self.services[name]["tcp-portranges"].append(port_range)
-                self.tcp_portrange_to_service[port_range] = name
+        for (protocol, portranges) in (("tcp", tcp_portranges), ("udp", udp_portranges)):
+            for port_range in portranges:
+                # services created for the rules are single exact ranges, leaving them
+                # out of the interval tree keeps it from being rebuilt after each one
+                self.port_index[protocol].add(port_range, name, len(portranges) == 1, containing=built_in)
 
-        if udp_portrange is not None and udp_portrange != "":
-            for portrange in udp_portrange.split(','):
-                port_range = PortRange(portrange)
-                self.services[name]["udp-portranges"].append(port_range)
-                self.udp_portrange_to_service[port_range] = name
-
-
-    def lookup(self, protocol: str, portrange: str | PortRange):
-        """Check."""
+    def lookup(self, protocol: str, portrange: str | PortRange, containing: bool = False):
+        """Lookup the service for a port range, optionally falling back to the tightest containing range."""
         protocol = protocol.casefold().strip()
         if isinstance(portrange, str):
             portrange = PortRange(portrange)
@@ -411,100 +688,377 @@ class Services():
         if protocol not in ["tcp", "udp"]:
             raise ValueError (f"Services().lookup(): unsupported protocol '{protocol}'.")
 
-        if protocol == "tcp":
-            return self.tcp_portrange_to_service[portrange]
-        return self.udp_portrange_to_service[portrange]
+        port_index = self.port_index[protocol]
+        if (name := port_index.exact.get((portrange.start, portrange.end))) is not None:
+            return name
 
+        if containing and portrange.start is not None:
+            return port_index.containing(portrange.start, portrange.end)
 
-def format_iptables (rules: list, config_lines: list, network_map: NetworkMap):
-    """IPtables format parser."""
-    current_section = None
+        return None
+
+
+# iptables-save lines without quotes or escapes can be split on whitespace
+RX_SHELL_QUOTING = re.compile(r"[\"'\\]")
 
+
+def tokenize_iptables(config_line: str) -> list:
+    """Split an iptables-save line, using shlex only for quoted lines (ie: comments)."""
+    if RX_SHELL_QUOTING.search(config_line) is None:
+        return config_line.split()
+
+    return shlex.split(config_line)
+
+
+def iptables_rule(config_line: str, network_map: NetworkMap) -> NATRule | None:
+    """Convert an iptables-save -A line to a NAT rule, None if it isn't a DNAT rule."""
+    tokens = iter(tokenize_iptables(config_line))
+    rule_dict = dict(zip(tokens, tokens))
+
+    if "-j" in rule_dict and rule_dict["-j"] != "DNAT":
+        # skip non-dnat rule
+        return None
+
+    nat_rule = NATRule()
+    # protocol
+    if "-p" in rule_dict:
+        nat_rule.protocol = Protocol(rule_dict["-p"])
+
+    # external address
+    if "-d" in rule_dict:
+        nat_rule.external_address = IPRange(rule_dict["-d"])
+        if (external_interface := network_map.lookup(nat_rule.external_address)) is not None:
+            nat_rule.external_interface = external_interface
+
+    # external ports
+    if "--dport" in rule_dict:
+        nat_rule.external_ports = PortRange(rule_dict["--dport"])
+
+    # internal ports
+    if "--to-destination" in rule_dict:
+        destination_spec = rule_dict["--to-destination"]
+        if destination_spec.find(":") != -1:
+            (ip, port) = destination_spec.split(":", maxsplit=1)
+            nat_rule.internal_ports = PortRange(port)
+        else:
+            ip = destination_spec
+
+        nat_rule.internal_address = IPRange(ip)
+        if (internal_interface := network_map.lookup(nat_rule.internal_address)) is not None:
+            nat_rule.internal_interface = internal_interface
+
+    return nat_rule
+
+
+def iptables_table_rules(config_lines, network_map: NetworkMap):
+    """Yield the DNAT rules of the lines of a nat table, up to its COMMIT."""
     for config_line in config_lines:
-        if config_line.startswith("*"):
-            current_section = config_line.strip()[1:]
+        if not config_line.startswith("-A"):
+            if config_line.startswith("COMMIT"):
+                break
             continue
 
-        if current_section == "nat":
-            tokens = shlex.split(config_line.strip())
-            if tokens[0] == "-A":
-                rule_dict = {}
-                while len(tokens) != 0:
-                    k = tokens.pop(0)
-                    v = tokens.pop(0)
-                    rule_dict[k] = v
-
-                if "-j" in rule_dict and rule_dict["-j"] != "DNAT":
-                    # skip non-dnat rule
-                    continue
-
-                nat_rule = NATRule()
-                # protocol
-                if "-p" in rule_dict:
-                    nat_rule.protocol.set(rule_dict["-p"])
-
-                # external address
-                if "-d" in rule_dict:
-                    nat_rule.external_address.set(rule_dict["-d"])
-                    if (external_interface := network_map.lookup(nat_rule.external_address)) is not None:
-                        nat_rule.external_interface = external_interface
-
-                # external ports
-                if "--dport" in rule_dict:
-                    nat_rule.external_ports.set(rule_dict["--dport"])
-
-                # internal ports
-                if "--to-destination" in rule_dict:
-                    destination_spec = rule_dict["--to-destination"]
-                    if destination_spec.find(":") != -1:
-                        (ip, port) = destination_spec.split(":", maxsplit=1)
-                        nat_rule.internal_ports.set(port)
-                    else:
-                        ip = destination_spec
-
-                    nat_rule.internal_address.set(ip)
-                    if (internal_interface := network_map.lookup(nat_rule.internal_address)) is not None:
-                        nat_rule.internal_interface = internal_interface
-
-                rules.append(nat_rule)
-
-
-def format_csv(rules: list, config_lines: list, network_map: NetworkMap):
-    """CSV Format parser."""
-    required_fields = { "protocol", "extip", "extport", "mappedip" }
-    csv_file = csv.DictReader(StringIO("\n".join(config_lines)))
-    fields = set(csv_file.fieldnames)
+        if (nat_rule := iptables_rule(config_line, network_map)) is not None:
+            yield nat_rule
+
+
+def parse_iptables(config_lines, network_map: NetworkMap):
+    """IPtables format parser, reads lines lazily and yields DNAT rules."""
+    config_lines = iter(config_lines)
+
+    for config_line in config_lines:
+        if config_line.startswith("*") and config_line.strip() == "*nat":
+            # other tables are skipped up to the next table line
+            yield from iptables_table_rules(config_lines, network_map)
+
+
+def iptables_nat_blocks(buffer) -> list:
+    """(start, end) byte offsets of the rules of every *nat table, from the line after *nat to its COMMIT."""
+    blocks = []
+    size = len(buffer)
+    position = 0
+
+    while position < size:
+        if buffer[position:position + 1] != b"*":
+            position = buffer.find(b"\n*", position) + 1
+            if position == 0:
+                break
+
+        line_end = buffer.find(b"\n", position) + 1 or size
+        if buffer[position:line_end].strip() != b"*nat":
+            position = line_end
+            continue
+
+        if buffer[line_end:line_end + 6] == b"COMMIT":
+            commit = line_end
+        else:
+            commit = buffer.find(b"\nCOMMIT", line_end) + 1 or size
+
+        blocks.append((line_end, commit))
+        position = commit
+
+    return blocks
+
+
+def parse_iptables_chunk(file_name: str, start: int, end: int, network_map: NetworkMap) -> list:
+    """Parse the nat table lines between two byte offsets, runs on worker processes."""
+    with open(file_name, "rb") as chunk_file:
+        chunk_file.seek(start)
+        lines = io.StringIO(chunk_file.read(end - start).decode("utf-8"), newline="")
+
+    return list(iptables_table_rules(lines, network_map))
+
+
+def parse_iptables_parallel(file_name: str, network_map: NetworkMap, jobs: int, chunk_size: int = 8 * 1024 * 1024):
+    """IPtables format parser, parses chunks of the nat tables in parallel and yields DNAT rules in order."""
+    with open(file_name, "rb") as config_file:
+        if os.fstat(config_file.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(config_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            blocks = iptables_nat_blocks(buffer)
+
+    chunks = []
+    for (block_start, block_end) in blocks:
+        chunks.extend(line_chunks(file_name, block_start, chunk_size, block_end))
+
+    yield from map_chunks(parse_iptables_chunk, file_name, chunks, jobs, network_map)
+
+
+def format_iptables (rules: list, config_lines, network_map: NetworkMap):
+    """IPtables format parser."""
+    rules.extend(parse_iptables(config_lines, network_map))
+
+
+MIKROTIK_NAT_SECTION = "/ip firewall nat"
+
+# matchers that can't be expressed with a virtual IP
+MIKROTIK_UNSUPPORTED = ("dst-address-list", "src-address", "src-address-list", "in-interface-list")
+
+
+def parse_mikrotik(config_file, network_map: NetworkMap, interface_map: InterfaceMap | None = None):
+    """RouterOS export parser, yields the dst-nat rules of /ip firewall nat.
+
+    Disabled rules and rules matching on address lists, source addresses or
+    negated values are skipped. A dst-port list yields a rule per port range.
+    When the external address isn't in the network map, in-interface is
+    renamed with the interface map, unmapped names are a rule issue.
+    """
+    # the common package is on sys.path when running through dstnat2tf
+    from common import routeros  # pylint: disable=C0415
+
+    try:
+        config_file.fileno()
+        mappable = True
+    except (AttributeError, io.UnsupportedOperation):
+        # not a real file, ex.: a list of lines or a StringIO
+        mappable = False
+
+    if mappable:
+        export = routeros.Export.map(config_file, wanted=[MIKROTIK_NAT_SECTION])
+    else:
+        export = routeros.Export(config_file, wanted=[MIKROTIK_NAT_SECTION])
+
+    for record in export.get(MIKROTIK_NAT_SECTION).records("add"):
+        params = record.params
+
+        if params.get("action") != "dst-nat":
+            continue
 
-    # FIXME
-    if not fields >= required_fields:
+        if params.get("disabled") == "yes":
+            logging.debug("parse_mikrotik(): line %d: skipping disabled rule", record.line_number)
+            continue
+
+        if any(key in params for key in MIKROTIK_UNSUPPORTED) or any(
+                (value or "").startswith("!") for value in params.values()):
+            logging.debug("parse_mikrotik(): line %d: skipping unsupported rule: %s", record.line_number, record.line)
+            continue
+
+        for external_ports in (params["dst-port"].split(",") if "dst-port" in params else [None]):
+            nat_rule = NATRule()
+            nat_rule.comment = params.get("comment")
+
+            if "protocol" in params:
+                nat_rule.protocol = Protocol(params["protocol"])
+
+            # external address, no dst-address (ex.: dst-address-type=local) is any
+            if "dst-address" in params:
+                nat_rule.external_address = IPRange(params["dst-address"])
+
+            if (external_interface := network_map.lookup(nat_rule.external_address)) is not None:
+                nat_rule.external_interface = external_interface
+            elif "in-interface" in params:
+                # RouterOS interface names, ex.: ether1
+                mapped_interface = None if interface_map is None else interface_map.lookup(params["in-interface"])
+                if mapped_interface is not None:
+                    nat_rule.external_interface = mapped_interface
+                else:
+                    nat_rule.unmapped_interface = params["in-interface"]
+
+            if external_ports is not None:
+                nat_rule.external_ports = PortRange(external_ports)
+
+            if "to-addresses" in params:
+                nat_rule.internal_address = IPRange(params["to-addresses"])
+                if (internal_interface := network_map.lookup(nat_rule.internal_address)) is not None:
+                    nat_rule.internal_interface = internal_interface
+
+            if "to-ports" in params:
+                nat_rule.internal_ports = PortRange(params["to-ports"])
+
+            yield nat_rule
+
+
+def format_mikrotik(rules: list, config_file, network_map: NetworkMap, interface_map: InterfaceMap | None = None):
+    """RouterOS export format parser."""
+    rules.extend(parse_mikrotik(config_file, network_map, interface_map))
+
+
+CSV_REQUIRED_FIELDS = ("protocol", "extip", "extport", "mappedip")
+CSV_OPTIONAL_FIELDS = ("mappedport", "comment")
+
+
+def csv_columns(header: list) -> tuple:
+    """Map CSV field names to column positions, required fields first."""
+    positions = {}
+    for position, field in enumerate(header):
+        positions.setdefault(field, position)
+
+    missing = [field for field in CSV_REQUIRED_FIELDS if field not in positions]
+    if missing:
         raise KeyError (
             "format_csv(): missing required fields: {missing}".format(
-                missing= ", ".join(required_fields.difference(fields)))
+                missing= ", ".join(missing))
         )
 
-    has_mapped_port = "mappedport" in fields
-    has_comment = "comment"
-    for row in csv_file:
+    return tuple(positions.get(field) for field in CSV_REQUIRED_FIELDS + CSV_OPTIONAL_FIELDS)
+
+
+def csv_rows_to_rules(rows, columns: tuple, network_map: NetworkMap):
+    """Convert CSV rows (lists of values) to NAT rules."""
+    (protocol_ix, extip_ix, extport_ix, mappedip_ix, mappedport_ix, comment_ix) = columns
+    if mappedport_ix is None:
+        mappedport_ix = extport_ix
+
+    width = max(position for position in columns if position is not None) + 1
+
+    for row in rows:
+        if not row:
+            # csv.DictReader used to skip blank lines
+            continue
+
+        if len(row) < width:
+            row += [""] * (width - len(row))
+
         nat_rule = NATRule()
-        nat_rule.protocol.set(row["protocol"])
-        nat_rule.external_address.set(row["extip"])
+        nat_rule.protocol = Protocol(row[protocol_ix])
+        nat_rule.external_address = IPRange(row[extip_ix])
         if (external_interface := network_map.lookup(nat_rule.external_address)) is not None:
             nat_rule.external_interface = external_interface
-        nat_rule.external_ports.set(row["extport"])
-        nat_rule.internal_address.set(row["mappedip"])
+        nat_rule.external_ports = PortRange(row[extport_ix])
+        nat_rule.internal_address = IPRange(row[mappedip_ix])
         if (internal_interface := network_map.lookup(nat_rule.internal_address)) is not None:
             nat_rule.internal_interface = internal_interface
-        nat_rule.external_ports.set(row["extport"])
-        if has_mapped_port:
-            nat_rule.internal_ports.set(row["mappedport"])
-        else:
-            nat_rule.internal_ports.set(row["extport"])
+        nat_rule.internal_ports = PortRange(row[mappedport_ix])
+
+        if comment_ix is not None and row[comment_ix] != "":
+            nat_rule.comment = row[comment_ix]
+
+        yield nat_rule
+
+
+def parse_csv(input_file, network_map: NetworkMap):
+    """CSV format parser, reads the open file lazily and yields NAT rules."""
+    csv_reader = csv.reader(input_file)
+    columns = csv_columns(next(csv_reader, []))
+
+    yield from csv_rows_to_rules(csv_reader, columns, network_map)
+
+
+def format_csv(rules: list, input_file, network_map: NetworkMap):
+    """CSV Format parser."""
+    rules.extend(parse_csv(input_file, network_map))
+
+
+def line_chunks(file_name: str, start: int, chunk_size: int, size: int | None = None):
+    """Yield (start, end) byte offsets of chunks of a file up to size (def: its end), ending on line boundaries."""
+    with open(file_name, "rb") as chunk_file:
+        if size is None:
+            size = chunk_file.seek(0, os.SEEK_END)
+
+        while start < size:
+            chunk_file.seek(start + chunk_size)
+            chunk_file.readline()
+            end = min(chunk_file.tell(), size)
+
+            yield (start, end)
+
+            start = end
+
+
+def map_chunks(parse_chunk, file_name: str, chunks: list, jobs: int, *args):
+    """Parse file chunks with parse_chunk(file_name, start, end, *args) on up to jobs processes.
+
+    Rules are yielded in file order, whatever order the chunks finish in. A
+    single chunk or job is parsed in this process.
+    """
+    if jobs <= 1 or len(chunks) <= 1:
+        for (start, end) in chunks:
+            yield from parse_chunk(file_name, start, end, *args)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor  # pylint: disable=C0415
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(chunks))) as executor:
+        for chunk_rules in executor.map(
+                parse_chunk,
+                repeat(file_name),
+                [start for (start, _) in chunks],
+                [end for (_, end) in chunks],
+                *(repeat(arg) for arg in args)):
+            yield from chunk_rules
+
+
+def csv_text_rows(text: str) -> list:
+    """Parse CSV text into rows, raises csv.Error if it ends inside a quoted value.
+
+    newline="" keeps the line ends of quoted values, like the serial parser
+    does. A quoted value left open takes the last line end, so a last value
+    that ends with one (even a closed one) is reported.
+    """
+    rows = list(csv.reader(io.StringIO(text, newline="")))
+    if rows and rows[-1] and rows[-1][-1].endswith(("\n", "\r")):
+        raise csv.Error("a quoted value may span the chunk end")
+
+    return rows
+
+
+def parse_csv_chunk(file_name: str, start: int, end: int, columns: tuple, network_map: NetworkMap) -> list:
+    """Parse the CSV rows between two byte offsets, runs on worker processes."""
+    with open(file_name, "rb") as chunk_file:
+        chunk_file.seek(start)
+        rows = csv_text_rows(chunk_file.read(end - start).decode("utf-8"))
 
-        if has_comment and row["comment"] != "":
-            nat_rule.comment = row["comment"]
+    return list(csv_rows_to_rules(rows, columns, network_map))
 
-        rules.append(nat_rule)
 
+def parse_csv_parallel(file_name: str, network_map: NetworkMap, jobs: int, chunk_size: int = 8 * 1024 * 1024):
+    """CSV format parser, parses chunks of the file in parallel and yields NAT rules in order.
 
+    Chunks are cut at line ends, if a quoted value spans one of them the
+    whole file is parsed serially instead.
+    """
+    with open(file_name, "rb") as header_file:
+        header_line = header_file.readline()
 
+    try:
+        header = csv_text_rows(header_line.decode("utf-8"))
+        columns = csv_columns(header[0] if header else [])
+        chunks = list(line_chunks(file_name, len(header_line), chunk_size))
+        rules = list(map_chunks(parse_csv_chunk, file_name, chunks, jobs, columns, network_map))
+    except csv.Error as e:
+        logging.debug("parse_csv_parallel(): %s, parsing '%s' serially", e, file_name)
+        with open(file_name, encoding="utf-8", newline="") as input_file:
+            rules = list(parse_csv(input_file, network_map))
 
+    yield from rules
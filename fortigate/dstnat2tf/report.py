@@ -0,0 +1,168 @@
+"""Destination NAT report writers."""
+import csv
+
+# sheets are (name, columns, rows), columns are (name, type) with type int, str or bool
+RULE_COLUMNS = (
+    ("id", int),
+    ("protocol", str),
+    ("extintf", str),
+    ("extips", str),
+    ("extport_start", int),
+    ("extport_end", int),
+    ("intintf", str),
+    ("intips", str),
+    ("intport_start", int),
+    ("intport_end", int),
+    ("fos_service", str),
+    ("comments", str),
+    ("issues", str)
+)
+
+ISSUE_COLUMNS = (
+    ("id", int),
+    ("issue", str)
+)
+
+SERVICE_COLUMNS = (
+    ("name", str),
+    ("built_in", bool),
+    ("tcp_portrange", str),
+    ("udp_portrange", str)
+)
+
+REPORT_FORMATS = ["xlsx", "csv", "parquet"]
+
+PARQUET_BATCH_SIZE = 65536
+
+
+def rule_rows(nat_rules: list, rule_services: list, rule_issues: dict):
+    """Yield a typed report row for every NAT rule."""
+    for (ix, nat_rule) in enumerate(nat_rules):
+        yield (
+            ix + 1,
+            nat_rule.protocol.name,
+            nat_rule.external_interface,
+            str(nat_rule.external_address),
+            nat_rule.external_ports.start,
+            nat_rule.external_ports.end,
+            nat_rule.internal_interface,
+            str(nat_rule.internal_address),
+            nat_rule.internal_ports.start,
+            nat_rule.internal_ports.end,
+            rule_services[ix],
+            nat_rule.comment,
+            ", ".join(rule_issues[ix]) if ix in rule_issues else None
+        )
+
+
+def issue_rows(rule_issues: dict):
+    """Yield a report row for every issue."""
+    for (ix, issues) in sorted(rule_issues.items()):
+        for issue in issues:
+            yield (ix + 1, issue)
+
+
+def service_rows(services):
+    """Yield a report row for every service."""
+    for (name, data) in sorted(services.services.items()):
+        yield (
+            name,
+            data["built_in"],
+            " ".join(str(port_range) for port_range in data["tcp-portranges"]) or None,
+            " ".join(str(port_range) for port_range in data["udp-portranges"]) or None
+        )
+
+
+def write_xlsx(basename: str, sheets: list) -> list:
+    """Write every sheet to a single workbook, rows are flushed as they're written."""
+    import xlsxwriter  # pylint: disable=C0415
+
+    file_name = basename + ".xlsx"
+    workbook = xlsxwriter.Workbook(file_name, {"constant_memory": True})
+    header_format = workbook.add_format({"bold": True})
+
+    for (sheet_name, columns, rows) in sheets:
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [name for (name, _) in columns], header_format)
+
+        for (row_ix, row) in enumerate(rows, start=1):
+            worksheet.write_row(row_ix, 0, row)
+
+    workbook.close()
+
+    return [file_name]
+
+
+def write_csv(basename: str, sheets: list) -> list:
+    """Write every sheet to its own CSV file."""
+    file_names = []
+
+    for (sheet_name, columns, rows) in sheets:
+        file_name = f"{basename}-{sheet_name}.csv"
+        with open(file_name, "w", newline="", encoding="utf-8") as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow([name for (name, _) in columns])
+            csv_writer.writerows(rows)
+
+        file_names.append(file_name)
+
+    return file_names
+
+
+def _arrow_table(pa, schema, batch: list):
+    """Convert a batch of rows to an arrow table."""
+    columns = list(zip(*batch)) if batch else [[] for _ in schema.names]
+
+    return pa.Table.from_arrays(
+        [pa.array(column, type=column_type) for (column, column_type) in zip(columns, schema.types)],
+        schema=schema
+    )
+
+
+def write_parquet(basename: str, sheets: list) -> list:
+    """Write every sheet to its own Parquet file, in batches of rows."""
+    import pyarrow as pa  # pylint: disable=C0415
+    import pyarrow.parquet as pq  # pylint: disable=C0415
+
+    arrow_types = {
+        int: pa.int64(),
+        str: pa.string(),
+        bool: pa.bool_()
+    }
+
+    file_names = []
+
+    for (sheet_name, columns, rows) in sheets:
+        file_name = f"{basename}-{sheet_name}.parquet"
+        schema = pa.schema([(name, arrow_types[column_type]) for (name, column_type) in columns])
+
+        with pq.ParquetWriter(file_name, schema) as parquet_writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == PARQUET_BATCH_SIZE:
+                    parquet_writer.write_table(_arrow_table(pa, schema, batch))
+                    batch = []
+
+            parquet_writer.write_table(_arrow_table(pa, schema, batch))
+
+        file_names.append(file_name)
+
+    return file_names
+
+
+def write_report(report_format: str, basename: str, nat_rules: list, rule_services: list, rule_issues: dict, services) -> list:
+    """Write the dstnat, issues and services report, return the files written."""
+    writers = {
+        "xlsx": write_xlsx,
+        "csv": write_csv,
+        "parquet": write_parquet
+    }
+
+    sheets = [
+        ("dstnat", RULE_COLUMNS, rule_rows(nat_rules, rule_services, rule_issues)),
+        ("issues", ISSUE_COLUMNS, issue_rows(rule_issues)),
+        ("services", SERVICE_COLUMNS, service_rows(services))
+    ]
+
+    return writers[report_format](basename, sheets)
@@ -6,13 +6,17 @@ import argparse
 import csv
 import logging
 import os
-import shlex
 import sys
 
 from collections import defaultdict
 
 from rich.console import Console
 
+# shared modules live in the repository's common package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# pylint: disable=C0413
+from common import routeros, timings
 from helpers import InterfaceMap, NetworkMap
 
 console = Console(emoji_variant="emoji", tab_size=2, highlighter=None)
@@ -20,6 +24,7 @@ console = Console(emoji_variant="emoji", tab_size=2, highlighter=None)
 CSV_FILE = "destination_nat.csv"
 TERRAFORM_VARS = "terraform.tfvars"
 TERRAFORM_OUTPUT = "destination_nat.tf"
+NAT_SECTION = "/ip firewall nat"
 
 network_to_interface = {}
 interface_translation = {}
@@ -73,8 +78,16 @@ parser.add_argument(
     required=True,
     help="FortiGate user with admin privileges."
 )
+timings.add_arguments(parser)
 args = parser.parse_args()
 
+run_timings = timings.Timings()
+output_basename = os.path.splitext(TERRAFORM_OUTPUT)[0]
+
+if args.profile is not None:
+    profiler = timings.Profiler(args.profile)
+    profiler.start()
+
 # start
 console.print("[bold]RSC2TF[/bold] convert Mikrotik NAT configuration to a FortiGate Terraform template.\n")
 console.print(f"[bold]Configuration file    [/bold]: {args.config}")
@@ -128,6 +141,7 @@ if args.map_network is not None:
         console.print(f"\t> added network to interface translation: '{source}' -> '{target}'")
 
 # read configuration file
+parse_stage = run_timings.start("parse")
 console.print(f"\nReading [bold]configuration file[/bold] '{args.config}'.")
 
 if os.path.exists(args.config):
@@ -136,14 +150,10 @@ if os.path.exists(args.config):
 else:
     abort(f"configuration file '{args.config}' not found")
 
-with open(args.config, encoding="utf-8") as f:
-    rsc_content = f.read().replace("\\\n    ", "")
-    config_lines = rsc_content.splitlines()
+export = routeros.Export.open(args.config, wanted=[NAT_SECTION])
 
 # search for NAT section
-try:
-    nat_config_index = config_lines.index("/ip firewall nat")
-except ValueError:
+if NAT_SECTION not in export:
     abort(f"configuration file '{args.config}' doesn't appear to have a NAT configuration")
 
 console.print("\nParsing NAT section.")
@@ -151,23 +161,21 @@ nat_seen_fields = set()
 nat_rules = []
 nat_rule_index = 1
 
-for line in config_lines[nat_config_index+1:]:
-    if line[0] == "/":
-        break
+for record in export[NAT_SECTION].records("add"):
+    try:
+        rule = defaultdict(lambda: None, record.params)
+    except ValueError as e:
+        abort(f"line {record.line_number}: {e}")
 
-    tokens = shlex.split(line)
-    if tokens[0] == "add":
-        rule = defaultdict(lambda: None)
-        for token in tokens[1:]:
-            (k, v) = token.split("=", maxsplit=1)
-            rule[k] = v
+    if rule["action"] == "dst-nat":
+        nat_seen_fields.update(rule.keys())
+        rule["index"] = nat_rule_index
+        nat_rules.append(rule)
+        nat_rule_index += 1
 
-        if rule["action"] == "dst-nat":
-            nat_seen_fields.update(rule.keys())
-            rule["index"] = nat_rule_index
-            nat_rules.append(rule)
-            nat_rule_index += 1
 
+parse_stage["rules"] = len(nat_rules)
+run_timings.stop()
 
 nat_seen_fields = list(nat_seen_fields)
 nat_seen_fields.sort()
@@ -180,6 +188,7 @@ logging.debug(
 )
 
 # create terraform.tfvars file
+run_timings.start("tfvars")
 try:
     console.print(f"\nCreating [bold]'{TERRAFORM_VARS}'[/bold].")
     with open(TERRAFORM_VARS, mode="w", newline="", encoding="utf-8") as output:
@@ -189,3 +198,17 @@ fortigate_username = "{args.user}"
 except OSError as e:
     abort(f"unable to create file '{TERRAFORM_VARS}': {e}")
 
+run_timings.stop()
+
+if args.profile is not None:
+    profile_file = timings.profile_file_name(args.profile, output_basename)
+    profiler.stop(profile_file)
+    console.print(f"\n{args.profile} profile written to [bold]'{profile_file}'[/bold].")
+
+if args.timings is not None:
+    timings_file = args.timings or f"{output_basename}-timings.json"
+    console.print("\n[bold]Timings[/bold]:")
+    for line in run_timings.summary():
+        console.print(f"\t{line}")
+    run_timings.write(timings_file)
+    console.print(f"\t> timings written to [bold]'{timings_file}'[/bold]")
@@ -1,10 +1,16 @@
 import csv
-import shlex
 import ipaddress
+import os
+import sys
 from sys import exit
 
 from collections import defaultdict
 
+# shared modules live in the repository's common package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from common import routeros  # pylint: disable=C0413
+
 network_mappings = {}
 interface_mapings = {}
 
@@ -54,6 +60,7 @@ def interface_xlat (old_interface: str) -> str:
 
 # configuration
 RSC_FILE = "fortigate\\vip\\ara1-nat.rsc"
+NAT_SECTION = "/ip firewall nat"
 DEFAULT_WAN = "isp1"
 DEFAULT_LAN = "lan"
 SDWAN = True
@@ -62,39 +69,27 @@ network_to_interface ("192.168.9.0/24", "lan")
 network_to_interface ("10.1.1.0/24", "port9")
 interface_map("WAN", "isp1")
 
-# read configuration file and convert multi-line configs to single line
-with open(RSC_FILE, encoding="utf-8") as f:
-    rsc = f.read().replace("\\\n    ", "")
-    config_lines = rsc.splitlines()
+# read the NAT section of the configuration file
+export = routeros.Export.open(RSC_FILE, wanted=[NAT_SECTION])
 
 rules = []
 fields = set()
 
 # lookup nat config, if there is one
-try:
-    nat_config_index = config_lines.index("/ip firewall nat")
-except ValueError:
-    print("Configuration file {rsc_file} doesn't have a NAT configuration.")
+if NAT_SECTION not in export:
+    print(f"Configuration file {RSC_FILE} doesn't have a NAT configuration.")
     exit()
 
-print(f"NAT configuration found at line {nat_config_index}.")
+print(f"NAT configuration found at line {export.index[routeros.section_path(NAT_SECTION)][0]}.")
 
 # convert NAT configuration to a dictionary array
-for line in config_lines[nat_config_index+1:]:
-    if line[0] == "/":
-        break
-
-    tokens = shlex.split(line)
-    if tokens[0] == "add":
-        rule = defaultdict(lambda: None)
-        for token in tokens[1:]:
-            (k, v) = token.split("=", maxsplit=1)
-            rule[k] = v
-            fields.add(k)
-
-        if rule["action"] == "dst-nat":
-            print(rule)
-            rules.append(rule)
+for record in export[NAT_SECTION].records("add"):
+    rule = defaultdict(lambda: None, record.params)
+    fields.update(record.params)
+
+    if rule["action"] == "dst-nat":
+        print(rule)
+        rules.append(rule)
 
 fields = list(fields)
 fields.sort()
@@ -0,0 +1,361 @@
+"""Columnar NAT rule table."""
+import bisect
+import heapq
+
+import numpy as np
+
+from nat import NATRule
+
+# issue codes, in the same order NATRule.diagnose() reports them
+NO_EXTERNAL_INTERFACE = 0
+UNMAPPED_INTERFACE = 1
+NO_INTERNAL_INTERFACE = 2
+NO_EXTERNAL_IP = 3
+NO_INTERNAL_IP = 4
+ANY_TO_RANGE = 5
+UNEVEN_RANGES = 6
+NO_EXTERNAL_PORT = 7
+UNSUPPORTED_PROTOCOL = 8
+VIP_CONFLICT = 9
+
+# other is the conflicting rule index for VIP_CONFLICT, -1 otherwise
+ISSUE_DTYPE = np.dtype([("rule", np.uint32), ("code", np.uint8), ("other", np.int32)])
+
+NO_PROTOCOL = 255
+NO_INTERFACE = -1
+
+# leaves of the port segment tree, node 1 is the root and port p is leaf PORT_LEAVES + p
+PORT_LEAVES = 65536
+
+
+class ActivePorts:
+    """Port ranges of the rules that are in the conflict sweep, answers overlap queries.
+
+    A segment tree over the ports keeps every range in the nodes that cover it
+    (a single port is in one node), so the ranges containing a port are in the
+    nodes on its way to the root. Starts are kept sorted for the ranges that
+    start inside a query. Adding, removing and querying are O(log n) plus the
+    ranges found.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.starts = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    @staticmethod
+    def _cover(port_start: int, port_end: int):
+        """Yield the segment tree nodes that cover port_start-port_end."""
+        low = port_start + PORT_LEAVES
+        high = port_end + PORT_LEAVES + 1
+        while low < high:
+            if low & 1:
+                yield low
+                low += 1
+            if high & 1:
+                high -= 1
+                yield high
+            low >>= 1
+            high >>= 1
+
+    def add(self, port_start: int, port_end: int, ix: int):
+        """Add the port range of a rule."""
+        for node in self._cover(port_start, port_end):
+            self.nodes.setdefault(node, set()).add(ix)
+        bisect.insort(self.starts, (port_start, ix))
+
+    def remove(self, port_start: int, port_end: int, ix: int):
+        """Remove the port range of a rule."""
+        for node in self._cover(port_start, port_end):
+            rules = self.nodes[node]
+            rules.discard(ix)
+            if not rules:
+                del self.nodes[node]
+        del self.starts[bisect.bisect_left(self.starts, (port_start, ix))]
+
+    def overlapping(self, port_start: int, port_end: int):
+        """Yield the rules whose range overlaps port_start-port_end, each once."""
+        node = port_start + PORT_LEAVES
+        while node:
+            if (rules := self.nodes.get(node)) is not None:
+                yield from rules
+            node >>= 1
+
+        # the ones that start at port_start contain it, they were found above
+        first = bisect.bisect_left(self.starts, (port_start + 1,))
+        last = bisect.bisect_left(self.starts, (port_end + 1,))
+        for (_, ix) in self.starts[first:last]:
+            yield ix
+
+
+class RuleTable:
+    """NAT rules stored as NumPy columns, diagnosed all at once."""
+
+    def __init__(self, rules: list):
+        """Build the columns from a list of NAT rules."""
+        self.rules = rules
+        size = len(rules)
+
+        self.interfaces = []
+        interface_codes = {None: NO_INTERFACE}
+
+        self.external_start = np.zeros(size, dtype=np.uint32)
+        self.external_end = np.zeros(size, dtype=np.uint32)
+        self.external_any = np.zeros(size, dtype=bool)
+        self.external_empty = np.zeros(size, dtype=bool)
+        self.internal_start = np.zeros(size, dtype=np.uint32)
+        self.internal_end = np.zeros(size, dtype=np.uint32)
+        self.internal_any = np.zeros(size, dtype=bool)
+        self.internal_empty = np.zeros(size, dtype=bool)
+        self.external_port_start = np.zeros(size, dtype=np.uint16)
+        self.external_port_end = np.zeros(size, dtype=np.uint16)
+        self.external_ports_empty = np.zeros(size, dtype=bool)
+        self.internal_port_start = np.zeros(size, dtype=np.uint16)
+        self.internal_port_end = np.zeros(size, dtype=np.uint16)
+        self.internal_ports_empty = np.zeros(size, dtype=bool)
+        self.protocol = np.full(size, NO_PROTOCOL, dtype=np.uint8)
+        self.external_interface = np.full(size, NO_INTERFACE, dtype=np.int16)
+        self.internal_interface = np.full(size, NO_INTERFACE, dtype=np.int16)
+        self.unmapped_interface = np.zeros(size, dtype=bool)
+
+        for (ix, nat_rule) in enumerate(rules):
+            self._set_address(ix, nat_rule.external_address, self.external_start, self.external_end, self.external_any, self.external_empty)
+            self._set_address(ix, nat_rule.internal_address, self.internal_start, self.internal_end, self.internal_any, self.internal_empty)
+            self._set_ports(ix, nat_rule.external_ports, self.external_port_start, self.external_port_end, self.external_ports_empty)
+            self._set_ports(ix, nat_rule.internal_ports, self.internal_port_start, self.internal_port_end, self.internal_ports_empty)
+
+            if nat_rule.protocol.id is not None:
+                self.protocol[ix] = nat_rule.protocol.id
+
+            if nat_rule.unmapped_interface is not None:
+                self.unmapped_interface[ix] = True
+
+            for (interface, column) in (
+                    (nat_rule.external_interface, self.external_interface),
+                    (nat_rule.internal_interface, self.internal_interface)):
+                if (code := interface_codes.get(interface)) is None:
+                    code = interface_codes[interface] = len(self.interfaces)
+                    self.interfaces.append(interface)
+                column[ix] = code
+
+        self.issues = self.diagnose()
+        self.valid = np.ones(size, dtype=bool)
+        self.valid[self.issues["rule"]] = False
+
+    @staticmethod
+    def _set_address(ix: int, ip_range, start, end, any_address, empty):
+        """Store an IP range in the address columns."""
+        if ip_range.any:
+            any_address[ix] = True
+        elif ip_range.start is None:
+            empty[ix] = True
+        else:
+            start[ix] = ip_range.start
+            end[ix] = ip_range.end
+
+    @staticmethod
+    def _set_ports(ix: int, port_range, start, end, empty):
+        """Store a port range in the port columns."""
+        if port_range.start is None:
+            empty[ix] = True
+        else:
+            start[ix] = port_range.start
+            end[ix] = port_range.end
+
+    def __len__(self):
+        """Number of rules."""
+        return len(self.rules)
+
+    def external_length(self) -> np.ndarray:
+        """External range sizes, same as len(IPRange)."""
+        return self._length(self.external_start, self.external_end, self.external_any, self.external_empty)
+
+    def internal_length(self) -> np.ndarray:
+        """Internal range sizes, same as len(IPRange)."""
+        return self._length(self.internal_start, self.internal_end, self.internal_any, self.internal_empty)
+
+    @staticmethod
+    def _length(start, end, any_address, empty) -> np.ndarray:
+        """Range sizes for a pair of address columns."""
+        length = end.astype(np.int64) - start.astype(np.int64) + 1
+        length[any_address] = 4294967296
+        length[empty] = 0
+
+        return length
+
+    def diagnose(self) -> np.ndarray:
+        """Diagnose all the rules and return a structured (rule, code) issue array."""
+        external_length = self.external_length()
+        internal_length = self.internal_length()
+        both_addresses = (external_length != 0) & (internal_length != 0)
+        port_protocol = (self.protocol == 6) | (self.protocol == 17)
+
+        masks = (
+            (NO_EXTERNAL_INTERFACE, self.external_interface == NO_INTERFACE),
+            (UNMAPPED_INTERFACE, self.unmapped_interface),
+            (NO_INTERNAL_INTERFACE, self.internal_interface == NO_INTERFACE),
+            (NO_EXTERNAL_IP, external_length == 0),
+            (NO_INTERNAL_IP, internal_length == 0),
+            (ANY_TO_RANGE, both_addresses & self.external_any & (internal_length != 1)),
+            (UNEVEN_RANGES, both_addresses & ~self.external_any & (external_length != internal_length)),
+            (NO_EXTERNAL_PORT, port_protocol & self.external_ports_empty),
+            (UNSUPPORTED_PROTOCOL, ~port_protocol)
+        )
+
+        rule_indexes = []
+        codes = []
+        other_issues = np.zeros(len(self), dtype=bool)
+        for (code, mask) in masks:
+            indexes = np.flatnonzero(mask)
+            rule_indexes.append(indexes)
+            codes.append(np.full(len(indexes), code, dtype=np.uint8))
+            other_issues |= mask
+
+        others = [np.full(len(indexes), -1, dtype=np.int32) for indexes in rule_indexes]
+
+        # the first rule of overlapping ones is kept, the later ones get an issue pointing to it
+        conflicts = np.array(self.flag_conflicts(self.find_conflicts(), other_issues), dtype=np.int64).reshape(-1, 2)
+        rule_indexes.append(conflicts[:, 0])
+        others.append(conflicts[:, 1].astype(np.int32))
+        codes.append(np.full(len(conflicts), VIP_CONFLICT, dtype=np.uint8))
+
+        issues = np.empty(sum(len(indexes) for indexes in rule_indexes), dtype=ISSUE_DTYPE)
+        issues["rule"] = np.concatenate(rule_indexes)
+        issues["code"] = np.concatenate(codes)
+        issues["other"] = np.concatenate(others)
+
+        # group by rule, keeping the diagnose() order inside each rule
+        return issues[np.lexsort((issues["other"], issues["code"], issues["rule"]))]
+
+    def find_conflicts(self) -> list:
+        """Return the (rule, rule) pairs that claim the same external IP, protocol and ports.
+
+        Rules are sorted by (protocol, external address, port start) and grouped by
+        external address range. A sweep over the address ranges keeps the port
+        ranges of the groups that overlap the current one in a shared
+        ActivePorts index, the ports of the current group are looked up in it
+        and swept among themselves, O(n log n) plus the number of conflicts.
+        Wide ranges (ex.: any) stay in the index, but don't make every group
+        merge their ports again.
+        """
+        port_protocol = (self.protocol == 6) | (self.protocol == 17)
+        candidates = port_protocol & ~self.external_ports_empty & ~self.external_empty
+
+        address_start = np.where(self.external_any, 0, self.external_start).astype(np.int64)
+        address_end = np.where(self.external_any, 0xFFFFFFFF, self.external_end).astype(np.int64)
+
+        order = np.lexsort((self.external_port_start, address_end, address_start, self.protocol))
+        order = order[candidates[order]]
+
+        # groups of rules with the same protocol and address range, sorted by port start
+        groups = []
+        last_key = None
+        for (ix, protocol, start, end, port_start, port_end) in zip(
+                order.tolist(),
+                self.protocol[order].tolist(),
+                address_start[order].tolist(),
+                address_end[order].tolist(),
+                self.external_port_start[order].tolist(),
+                self.external_port_end[order].tolist()):
+            if (protocol, start, end) != last_key:
+                last_key = (protocol, start, end)
+                groups.append((protocol, start, end, []))
+            groups[-1][3].append((port_start, port_end, ix))
+
+        conflicts = []
+        active = []
+        active_ports = ActivePorts()
+        active_protocol = None
+        for (group_ix, (protocol, start, end, ports)) in enumerate(groups):
+            if protocol != active_protocol:
+                (active, active_ports, active_protocol) = ([], ActivePorts(), protocol)
+
+            while active and active[0][0] < start:
+                (_, other_ix) = heapq.heappop(active)
+                for (port_start, port_end, ix) in groups[other_ix][3]:
+                    active_ports.remove(port_start, port_end, ix)
+
+            conflicts.extend(self._port_overlaps(ports))
+            if active_ports:
+                for (port_start, port_end, ix) in ports:
+                    conflicts.extend((other_ix, ix) for other_ix in active_ports.overlapping(port_start, port_end))
+
+            for (port_start, port_end, ix) in ports:
+                active_ports.add(port_start, port_end, ix)
+            heapq.heappush(active, (end, group_ix))
+
+        return sorted((min(pair), max(pair)) for pair in conflicts)
+
+    @staticmethod
+    def flag_conflicts(conflicts: list, other_issues) -> list:
+        """Return (rule, kept rule) for every rule that conflicts with an earlier kept rule.
+
+        Rules are kept in order, a rule overlapping an earlier kept one isn't,
+        so of every overlapping set the first rule still gets its VIP. Rules
+        with other issues aren't generated and don't take part.
+        """
+        flagged = {}
+        for (rule_ix, other_ix) in sorted((pair[1], pair[0]) for pair in conflicts):
+            if rule_ix in flagged or other_issues[rule_ix] or other_issues[other_ix] or other_ix in flagged:
+                continue
+
+            flagged[rule_ix] = other_ix
+
+        return list(flagged.items())
+
+    @staticmethod
+    def _port_overlaps(ports: list):
+        """Sweep port ranges sorted by start and yield the overlapping rule pairs."""
+        active = []
+        for (port_start, port_end, ix) in ports:
+            while active and active[0][0] < port_start:
+                heapq.heappop(active)
+
+            for (_, other_ix) in active:
+                yield (other_ix, ix)
+
+            heapq.heappush(active, (port_end, ix))
+
+    def issue_message(self, rule_ix: int, code: int, other: int = -1) -> str:
+        """Describe an issue, using the same text as NATRule.diagnose()."""
+        nat_rule: NATRule = self.rules[rule_ix]
+
+        if code == NO_EXTERNAL_INTERFACE:
+            return "no external interface"
+        if code == UNMAPPED_INTERFACE:
+            return f"no --map-interface for interface {nat_rule.unmapped_interface}"
+        if code == NO_INTERNAL_INTERFACE:
+            return "no internal interface"
+        if code == NO_EXTERNAL_IP:
+            return "no external IP"
+        if code == NO_INTERNAL_IP:
+            return "no internal (mapped) IP"
+        if code == ANY_TO_RANGE:
+            return "0.0.0.0 can be mapped only to 1 IP"
+        if code == UNEVEN_RANGES:
+            return f"uneven external and internal ip range sizes: {len(nat_rule.external_address)} -> {len(nat_rule.internal_address)} "
+        if code == NO_EXTERNAL_PORT:
+            return f"{nat_rule.protocol.name} requires at least an external port"
+        if code == UNSUPPORTED_PROTOCOL:
+            return f"unsuported virtual IP protocol: {nat_rule.protocol.name}"
+        if code == VIP_CONFLICT:
+            return f"external IP, protocol and ports conflict with rule #{other + 1}"
+
+        raise ValueError(f"unknown issue code {code}")
+
+    def rule_issues(self):
+        """Yield (rule index, [issue messages]) for every rule with issues."""
+        rule_indexes = self.issues["rule"]
+        boundaries = np.flatnonzero(np.diff(rule_indexes)) + 1
+
+        for group in np.split(self.issues, boundaries):
+            if len(group) == 0:
+                continue
+
+            rule_ix = int(group["rule"][0])
+            yield (rule_ix, [
+                self.issue_message(rule_ix, int(code), int(other))
+                for (code, other) in zip(group["code"], group["other"])
+            ])
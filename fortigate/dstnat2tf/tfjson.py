@@ -0,0 +1,159 @@
+"""Terraform JSON (.tf.json) output, one resource per object type with for_each over a map."""
+import json
+
+# resource names, ex.: fortios_firewall_vip.dstnat["vip-001"]
+RESOURCE_NAME = "dstnat"
+
+# for_each maps are written apart, in place of this mark, at resource > type > name depth
+FOR_EACH_MARK = "<for_each>"
+FOR_EACH_INDENT = " " * 8
+
+
+def vip_values(vip: dict) -> dict:
+    """for_each values of a VIP context."""
+    return {
+        "name": vip["name"],
+        "extintf": vip["extintf"],
+        "extip": str(vip["extip"]),
+        "mappedip": str(vip["mappedip"]),
+        "protocol": vip["protocol"],
+        "extport": str(vip["extport"]),
+        "mappedport": str(vip["mappedport"])
+    }
+
+
+def policy_values(policy: dict, vip_keys: dict, services) -> dict:
+    """for_each values of a policy context.
+
+    vips and services have the map keys of the generated VIPs and services,
+    vip_names and service_names the names of the ones that already exist
+    (built in services, VIPs of an --against configuration).
+    """
+    vip_names = policy.get("vip_names") or [policy["vip_name"]]
+    service_name = policy["service_name"]
+    custom_service = not services.services[service_name]["built_in"]
+
+    return {
+        "name": policy["name"],
+        "srcintf": policy["extintf"],
+        "dstintf": policy["intintf"],
+        # the source is a quoted name in the HCL contexts
+        "srcaddr": policy["source"].strip('"'),
+        "vips": [vip_keys[name] for name in vip_names if name in vip_keys],
+        "vip_names": [name for name in vip_names if name not in vip_keys],
+        "services": [service_name] if custom_service else [],
+        "service_names": [] if custom_service else [service_name]
+    }
+
+
+def dynamic_names(block: str, keys: str, resource: str, names: str) -> dict:
+    """Dynamic block with a name per generated resource key and per existing name."""
+    return {
+        block: {
+            "for_each": f"${{concat([for key in each.value.{keys} : {resource}.{RESOURCE_NAME}[key].name], each.value.{names})}}",
+            "content": {"name": f"${{{block}.value}}"}
+        }
+    }
+
+
+def dstnat_document(vips: list, policies: list, services) -> dict:
+    """Terraform JSON document of the VIPs and policies."""
+    vip_keys = {vip["name"]: vip["resource_name"] for vip in vips}
+
+    policy_dynamic = dynamic_names("dstaddr", "vips", "fortios_firewall_vip", "vip_names")
+    policy_dynamic.update(dynamic_names("service", "services", "fortios_firewallservice_custom", "service_names"))
+
+    return {
+        "resource": {
+            "fortios_firewall_vip": {
+                RESOURCE_NAME: {
+                    "for_each": {vip["resource_name"]: vip_values(vip) for vip in vips},
+                    "name": "${each.value.name}",
+                    "extintf": "${each.value.extintf}",
+                    "extip": "${each.value.extip}",
+                    "mappedip": [{"range": "${each.value.mappedip}"}],
+                    "protocol": "${each.value.protocol}",
+                    "portforward": "enable",
+                    "extport": "${each.value.extport}",
+                    "mappedport": "${each.value.mappedport}"
+                }
+            },
+            "fortios_firewall_policy": {
+                RESOURCE_NAME: {
+                    "for_each": {policy["resource_name"]: policy_values(policy, vip_keys, services) for policy in policies},
+                    "name": "${each.value.name}",
+                    "action": "accept",
+                    "logtraffic": "all",
+                    "schedule": "always",
+                    "status": "enable",
+                    "srcintf": [{"name": "${each.value.srcintf}"}],
+                    "dstintf": [{"name": "${each.value.dstintf}"}],
+                    "srcaddr": [{"name": "${each.value.srcaddr}"}],
+                    "dynamic": policy_dynamic
+                }
+            }
+        }
+    }
+
+
+def services_document(services) -> dict:
+    """Terraform JSON document of the custom (not built in) services, sorted by name."""
+    custom_services = {}
+    for (name, data) in sorted(services.services.items()):
+        if data["built_in"]:
+            continue
+
+        custom_services[name] = {
+            "tcp_portrange": " ".join(str(port_range) for port_range in data["tcp-portranges"]) or None,
+            "udp_portrange": " ".join(str(port_range) for port_range in data["udp-portranges"]) or None
+        }
+
+    return {
+        "resource": {
+            "fortios_firewallservice_custom": {
+                RESOURCE_NAME: {
+                    "for_each": custom_services,
+                    "name": "${each.key}",
+                    "protocol": "TCP/UDP/SCTP",
+                    "tcp_portrange": "${each.value.tcp_portrange}",
+                    "udp_portrange": "${each.value.udp_portrange}"
+                }
+            }
+        }
+    }
+
+
+def write_document(output_file, document: dict):
+    """Write a document indented, with a line per for_each entry.
+
+    A diff shows the objects that changed, and entries are serialized by the
+    json C encoder (indent= uses the much slower Python one).
+    """
+    for_each_maps = []
+    skeleton = {}
+    for (resource_type, resources) in document["resource"].items():
+        skeleton[resource_type] = {}
+        for (name, resource) in resources.items():
+            for_each_maps.append(resource["for_each"])
+            skeleton[resource_type][name] = dict(resource, for_each=FOR_EACH_MARK)
+
+    parts = json.dumps({"resource": skeleton}, indent=2).split(json.dumps(FOR_EACH_MARK))
+
+    output_file.write(parts[0])
+    for (for_each, part) in zip(for_each_maps, parts[1:]):
+        write_for_each(output_file, for_each)
+        output_file.write(part)
+    output_file.write("\n")
+
+
+def write_for_each(output_file, for_each: dict):
+    """Write a for_each map, an entry per line."""
+    if not for_each:
+        output_file.write("{}")
+        return
+
+    separator = "{\n"
+    for (key, values) in for_each.items():
+        output_file.write(f"{separator}{FOR_EACH_INDENT}  {json.dumps(key)}: {json.dumps(values)}")
+        separator = ",\n"
+    output_file.write(f"\n{FOR_EACH_INDENT}}}")
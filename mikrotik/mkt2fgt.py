@@ -1,6 +1,7 @@
 import argparse
-import shlex
 import ipaddress
+import os
+import sys
 
 import pprint
 
@@ -8,6 +9,21 @@ from collections import defaultdict
 from os.path import isfile
 from sys import exit
 
+# shared modules live in the repository's common package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import fortios, routeros, timings
+
+# sections used by the conversions, the rest of the export is skipped
+SECTIONS = (
+    "/ppp/secret",
+    "/ip/address",
+    "/ip/pool",
+    "/ip/dhcp-server",
+    "/ip/dhcp-server/network",
+    "/ip/dhcp-server/lease"
+)
+
 # helpers
 def valid_ip(str_ip):
     try:
@@ -25,6 +41,11 @@ def valid_network(str_network):
     
     return(network)
 
+def configured_address(existing, interface, ip, network):
+    # the --against configuration has this address on the interface
+    address = ipaddress.ip_interface("{ip}/{prefixlen}".format(ip=ip, prefixlen=network.prefixlen))
+    return existing is not None and existing["addresses"].get(address) == interface
+
 
 # command line
 parser = argparse.ArgumentParser(description="Converts mikrotik configuration sections to fortigate")
@@ -34,12 +55,21 @@ parser.add_argument("--map-interfaces", nargs="*", help="[MKT_IF:FGT_IF ... ]. r
 parser.add_argument("--addresses", nargs="*", help="[INTERFACE ...] generate interface address configuration for INTERFACE, * for all", default=False, )
 parser.add_argument("--dhcp-servers", nargs="*", help="[SERVER ...]. dhcp servers to migrate, * for all")
 parser.add_argument("--ppp-users", help="convert ppp users to local users", default=False, action='store_true')
+parser.add_argument("--against", help="fortigate config backup, users, addresses and dhcp reservations it already has are skipped")
+parser.add_argument("--against-vdom", help="vdom of the --against config backup (def: the global or only one)")
+timings.add_arguments(parser)
 
 args = parser.parse_args()
 
+output_basename = os.path.splitext(args.fortigate_config)[0]
+run_timings = timings.Timings()
+
+if args.profile is not None:
+    profiler = timings.Profiler(args.profile)
+    profiler.start()
+
 # open mikrotik config file
 if isfile(args.mikrotik_config):
-    f = open(args.mikrotik_config)
     print("--- opened mikrotik config file {file}".format(
             file=args.mikrotik_config
         ))
@@ -76,51 +106,72 @@ for ifmapping in args.map_interfaces:
     ifmap[v[0]] = v[1]
 
 # convert config to dict and lists
+parse_stage = run_timings.start("parse")
+# only the converted sections are decoded, the rest of the file is just scanned
+export = routeros.Export.open(args.mikrotik_config, wanted=SECTIONS)
+
 config = dict()
-current_line = 1
-current_section = None
-for l in f.readlines():
-    try:
-        tokens = shlex.split(l)
-    except:
-        print(l)
-        exit(-1)
+for section in SECTIONS:
+    config[section] = list()
+    for record in export.get(section):
+        try:
+            config[section].append((record.command, record.params))
+        except ValueError as e:
+            print("*** ERROR: line {line_number}: {error}: {line}".format(
+                line_number=record.line_number,
+                error=e,
+                line=record.line
+            ))
+            exit(-1)
 
-    # comment
-    if tokens[0][0] == "#":
-        continue
+parse_stage["rules"] = sum(len(section) for section in config.values())
 
-    if tokens[0][0] == "/":
-        current_section = tokens[0] + "/" + "/".join(tokens[1:])
-    else:
-        if current_section is not None:
-            if current_section not in config:
-                config[current_section] = list()
-
-            cmd = tokens[0]
-            params = dict()
-            if len(tokens) >= 2:
-                for param in tokens[1:]:
-                    # for now, we ignore this
-                    if param not in [ "[", "find", "]", "\n"]:
-                        v = param.split("=", 1)
-                        params[v[0]] = v[1] if len(v) == 2 else None
-            config[current_section].append((cmd, params))
-        else:
-            print("{l:>5}: config options without section".format(
-                l=l
+# existing fortigate configuration, only what it doesn't have is generated
+existing = None
+if args.against is not None:
+    run_timings.start("against")
+    if not isfile(args.against):
+        print("*** ERROR: file '{file}' not found, exiting.".format(
+            file=args.against
+        ))
+        exit(-1)
+
+    with fortios.Config.open(args.against) as fortigate_config:
+        if args.against_vdom is not None and args.against_vdom not in fortigate_config.vdoms:
+            print("*** ERROR: vdom '{vdom}' not found in {file}, exiting.".format(
+                vdom=args.against_vdom,
+                file=args.against
             ))
+            exit(-1)
 
-    current_line += 1
+        objects = fortios.Objects(fortigate_config, args.against_vdom)
+        existing = {
+            "users": objects.names("user local"),
+            "addresses": objects.interface_addresses,
+            "dhcp servers": objects.dhcp_servers,
+            "dhcp reservations": objects.dhcp_reservations
+        }
+
+    print("--- loaded fortigate config {file}: {users} users, {addresses} interface addresses, {reservations} dhcp reservations".format(
+        file=args.against,
+        users=len(existing["users"]),
+        addresses=len(existing["addresses"]),
+        reservations=len(existing["dhcp reservations"])
+    ))
 
 # ppp users
+run_timings.start("ppp users")
 if args.ppp_users == True:
     print (">>> creating local users from ppp users")
     if "/ppp/secret" in config and len(config["/ppp/secret"]) > 0:
         o.write("\nconfig user local\n")
         for user_cmd in config["/ppp/secret"]:
             (c,p) = user_cmd
-            if c == "add":
+            if c == "add" and existing is not None and p["name"] in existing["users"]:
+                print("--- skipped existing user {user}".format(
+                    user=p["name"]
+                ))
+            elif c == "add":
                 o.write("    edit \"{user}\"\n        set type password\n        set passwd \"{password}\"\n    next\n".format(
                     user=p["name"],
                     password=p["password"]
@@ -130,6 +181,7 @@ if args.ppp_users == True:
         print("!!! no users to migrate")
 
 # addresses
+run_timings.start("addresses")
 if args.addresses is not None:
     
     if "*" in args.addresses:
@@ -184,25 +236,41 @@ if args.addresses is not None:
         if len(ifaddress) > 0:
             o.write("\nconfig system interface\n")
             for interface in ifaddress.keys():
-                # primary ip address
-                (ip, network) = ifaddress[interface][0]
+                primary = ifaddress[interface][0]
+                secondaries = ifaddress[interface][1:]
+
+                # addresses already in the --against config aren't configured again
+                if configured_address(existing, interface, *primary):
+                    primary = None
+                secondaries = [sec for sec in secondaries if not configured_address(existing, interface, *sec)]
+
+                if primary is None and len(secondaries) == 0:
+                    print("--- skipped interface {interface}, addresses already configured".format(
+                        interface=interface
+                    ))
+                    continue
+
                 o.write("    edit \"{interface}\"\n".format(
                     interface=interface
                 ))
-                o.write("        set ip {ip} {mask}\n".format(
-                    ip=ip,
-                    mask=network.netmask
-                ))
-                o.write("        set allowaccess ping\n")
-                print("--- configured primary ip {ip} for interface {interface}".format(
-                    ip=str(ip) + "/" + str(network.prefixlen),
-                    interface=interface
-                ))
+
+                # primary ip address
+                if primary is not None:
+                    (ip, network) = primary
+                    o.write("        set ip {ip} {mask}\n".format(
+                        ip=ip,
+                        mask=network.netmask
+                    ))
+                    o.write("        set allowaccess ping\n")
+                    print("--- configured primary ip {ip} for interface {interface}".format(
+                        ip=str(ip) + "/" + str(network.prefixlen),
+                        interface=interface
+                    ))
                 
                 # secondary addresses
-                if len(ifaddress[interface]) > 1:
+                if len(secondaries) > 0:
                     o.write("        set secondary-IP enable\n        config secondaryip\n")
-                    for sec in ifaddress[interface][1:]:
+                    for sec in secondaries:
                         (ip, network) = sec
                         o.write("            edit 0\n                set ip {ip} {mask}\n".format(
                             ip=ip,
@@ -221,6 +289,7 @@ if args.addresses is not None:
         print("!!! no interface addresses to migrate")
 
 # dhcp servers
+run_timings.start("dhcp servers")
 if args.dhcp_servers is not None:
     
     if "*" in args.dhcp_servers:
@@ -352,47 +421,53 @@ if args.dhcp_servers is not None:
     
     o.write("\nconfig system dhcp server\n")
     for dhcp_server in dhcp_servers:
-        o.write("    edit 0\n")
-        # domain
-        if dhcp_server["domain"] is not None:
-            o.write("        set domain \"{domain}\"\n".format(
-                domain=dhcp_server["domain"]
-            ))        
-        # gateway
-        if dhcp_server["gateway"] is not None:
-            o.write("        set default-gateway {gateway}\n".format(
-                gateway=dhcp_server["gateway"]
-            ))
+        # servers already in the --against config only get the reservations they lack
+        server_id = existing["dhcp servers"].get(dhcp_server["interface"]) if existing is not None else None
+        if server_id is None:
+            o.write("    edit 0\n")
+            # domain
+            if dhcp_server["domain"] is not None:
+                o.write("        set domain \"{domain}\"\n".format(
+                    domain=dhcp_server["domain"]
+                ))        
+            # gateway
+            if dhcp_server["gateway"] is not None:
+                o.write("        set default-gateway {gateway}\n".format(
+                    gateway=dhcp_server["gateway"]
+                ))
 
-        # network
-        if dhcp_server["network"] is not None:
-            o.write("        set netmask {netmask}\n".format(
-                netmask=dhcp_server["network"].netmask
-            ))
+            # network
+            if dhcp_server["network"] is not None:
+                o.write("        set netmask {netmask}\n".format(
+                    netmask=dhcp_server["network"].netmask
+                ))
 
-        # interface
-        o.write("        set interface \"{interface}\"\n".format(
-            interface=dhcp_server["interface"]
-        ))
+            # interface
+            o.write("        set interface \"{interface}\"\n".format(
+                interface=dhcp_server["interface"]
+            ))
 
-        if len(dhcp_server["pool"]) > 0:
-            o.write("        config ip-range\n")
+            if len(dhcp_server["pool"]) > 0:
+                o.write("        config ip-range\n")
 
-            for (s,e) in dhcp_server["pool"]:
-                o.write("            edit 0\n")
-                o.write("                set start-ip {ip}\n".format(ip=s))
-                o.write("                set end-ip {ip}\n".format(ip=s))
-                o.write("            next\n")
+                for (s,e) in dhcp_server["pool"]:
+                    o.write("            edit 0\n")
+                    o.write("                set start-ip {ip}\n".format(ip=s))
+                    o.write("                set end-ip {ip}\n".format(ip=s))
+                    o.write("            next\n")
 
-            o.write("        end\n")
-        o.write("    next\n")
+                o.write("        end\n")
+        else:
+            o.write("    edit {server_id}\n".format(
+                server_id=server_id
+            ))
         print("--- configured dhcp server for interface {interface}".format(
             interface=dhcp_server["interface"]
         ))
 
-        # reserved addresses
+        # reserved addresses, inside the server entry
         limit = 200 
-        o.write("    config reserved-address\n")
+        o.write("        config reserved-address\n")
         for rsvadr in config["/ip/dhcp-server/lease"]:
             (cmd, opt) = rsvadr
             if cmd != "add":
@@ -404,28 +479,36 @@ if args.dhcp_servers is not None:
             ip=valid_ip(opt["address"])
             if ip is None:
                 continue
+
+            if existing is not None and (str(ip), opt["mac-address"].casefold()) in existing["dhcp reservations"]:
+                print("--- skipped existing dhcp reservation {ip} {mac}".format(
+                    ip=ip,
+                    mac=opt["mac-address"].casefold()
+                ))
+                continue
         
-            o.write("        edit 0\n")
-            o.write("            set ip {ip}\n".format(
+            o.write("            edit 0\n")
+            o.write("                set ip {ip}\n".format(
                 ip=ip
             ))
-            o.write("            set mac {mac}\n".format(
+            o.write("                set mac {mac}\n".format(
                 mac=opt["mac-address"].casefold()
             ))
 
             if "comment" in opt:
-                o.write("            set description \"{comment}\"\n".format(
+                o.write("                set description \"{comment}\"\n".format(
                     comment=opt["comment"]
                 ))
 
-            o.write("        next\n")
+            o.write("            next\n")
             limit -= 1
             if limit <= 0:
                 print("!!! output truncated: max 200 dhcp leases per network")
                 break
 
 
-        o.write("    end\n")
+        o.write("        end\n")
+        o.write("    next\n")
 
 
     o.write("end\n")
@@ -441,4 +524,23 @@ if args.dhcp_servers is not None:
 
 #
 o.close()
+run_timings.stop()
+
+if args.profile is not None:
+    profile_file = timings.profile_file_name(args.profile, output_basename)
+    profiler.stop(profile_file)
+    print("--- {profiler} profile written to {file}".format(
+        profiler=args.profile,
+        file=profile_file
+    ))
+
+if args.timings is not None:
+    timings_file = args.timings or output_basename + "-timings.json"
+    for line in run_timings.summary():
+        print("    " + line)
+    run_timings.write(timings_file)
+    print("--- timings written to {file}".format(
+        file=timings_file
+    ))
+
 print("--- done")
\ No newline at end of file